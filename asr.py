@@ -0,0 +1,247 @@
+"""
+语音识别模块：可插拔的ASR后端，默认使用进程内共享的智谱客户端
+超过asr_chunk_seconds的长录音流式解码、在静音处切段，逐段识别后拼接
+"""
+
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator, Optional, Protocol
+
+import numpy as np
+
+from config import get_settings
+from media import AUDIO_EXTENSIONS, encode_wav, iter_audio_chunks, preprocess_audio, probe_duration
+from media_cache import content_hash, get_media_cache
+from metrics import STAGE_SECONDS, timed
+from outbound import get_limiter
+
+settings = get_settings()
+
+
+class ASRBackend(Protocol):
+    """ASR后端接口：transcribe返回完整文本，stream逐段返回增量文本"""
+
+    def transcribe(self, audio_path: str) -> str: ...
+
+    def stream(self, audio_path: str) -> Iterator[str]: ...
+
+
+def _field(chunk, name: str):
+    """流式返回的字段可能在模型属性里，也可能在model_extra里"""
+    value = getattr(chunk, name, None)
+    if value is None and getattr(chunk, "model_extra", None):
+        value = chunk.model_extra.get(name)
+    return value
+
+
+class ZhipuASR:
+    """
+    智谱glm-asr
+    整个进程共享一个ZhipuAiClient，底层httpx连接池保持长连接，不再每次录音都重新建立TLS连接
+    开启外部调用调度时，请求经过zhipu调度器限速限并发，429等错误由调度器退避重试
+    """
+
+    def __init__(self, model: Optional[str] = None, client=None):
+        self.model = model or settings.asr_model
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    from zai import ZhipuAiClient
+                    http_client = httpx.Client(
+                        timeout=settings.asr_timeout,
+                        limits=httpx.Limits(
+                            max_connections=settings.asr_max_connections,
+                            max_keepalive_connections=settings.asr_max_connections,
+                            keepalive_expiry=settings.asr_keepalive_expiry,
+                        ),
+                    )
+                    self._client = ZhipuAiClient(api_key=settings.zai_api_key or None, http_client=http_client,
+                                                 max_retries=0 if settings.outbound_enabled else 3)
+        return self._client
+
+    def _audio_file(self, audio_path: str):
+        """上传前先预处理（单声道、16kHz、去静音），减小上传体积"""
+        if not settings.audio_preprocess:
+            return open(audio_path, "rb")
+        prepared = preprocess_audio(audio_path, target_rate=settings.asr_sample_rate, codec="wav")
+        return (f"audio.{AUDIO_EXTENSIONS[prepared.mime]}", prepared.data, prepared.mime)
+
+    def _transcribe(self, audio_path: str) -> str:
+        response = self.client.audio.transcriptions.create(
+            model=self.model,
+            file=self._audio_file(audio_path),
+            stream=False
+        )
+        return response.model_extra['text']
+
+    def _stream(self, audio_path: str) -> Iterator[str]:
+        response = self.client.audio.transcriptions.create(
+            model=self.model,
+            file=self._audio_file(audio_path),
+            stream=True
+        )
+        for chunk in response:
+            if _field(chunk, "type") == "transcript.text.delta":
+                yield _field(chunk, "delta") or ""
+
+    def transcribe(self, audio_path: str) -> str:
+        if not settings.outbound_enabled:
+            return self._transcribe(audio_path)
+        return get_limiter("zhipu").call(lambda: self._transcribe(audio_path))
+
+    def stream(self, audio_path: str) -> Iterator[str]:
+        if not settings.outbound_enabled:
+            return self._stream(audio_path)
+        #还没返回任何文字前失败才重试
+        return get_limiter("zhipu").stream(lambda: self._stream(audio_path))
+
+
+_backend: Optional[ASRBackend] = None
+
+
+def get_asr_backend() -> ASRBackend:
+    """获取当前ASR后端，默认是共享的智谱客户端"""
+    global _backend
+    if _backend is None:
+        _backend = ZhipuASR()
+    return _backend
+
+
+def set_asr_backend(backend: ASRBackend) -> None:
+    """替换ASR后端（测试和基准测试中可换成本地假后端）"""
+    global _backend
+    _backend = backend
+
+
+def _quietest_cut(samples: np.ndarray, frame: int, window: int) -> int:
+    """在samples末尾window个采样点内找能量最低的一帧，返回该帧中点的位置"""
+    start = max(len(samples) - window, 1)
+    n = (len(samples) - start) // frame
+    if n == 0:
+        return len(samples)
+    energy = np.square(samples[start:start + n * frame]).reshape(n, frame).mean(axis=1)
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+
+def split_segments(chunks: Iterable[np.ndarray], rate: int, seconds: Optional[float] = None,
+                   search: Optional[float] = None) -> Iterator[np.ndarray]:
+    """
+    把连续的音频块重新切成不超过seconds秒的片段：每段在末尾search秒内最安静的20ms处切开，
+    不把一个字切成两半，切剩的部分并入下一段；内存中最多同时有两块
+    """
+    limit = int((seconds or settings.asr_chunk_seconds) * rate)
+    window = int((settings.asr_cut_search_seconds if search is None else search) * rate)
+    frame = max(1, rate // 50)
+    buffer = np.zeros(0, np.float32)
+    for chunk in chunks:
+        buffer = np.concatenate([buffer, chunk])
+        while len(buffer) > limit:
+            cut = _quietest_cut(buffer[:limit], frame, window)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if len(buffer):
+        yield buffer
+
+
+def _is_silent(samples: np.ndarray) -> bool:
+    rms = float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+    return 20 * np.log10(max(rms, 1e-10)) <= settings.audio_silence_threshold_db
+
+
+def needs_chunking(audio_path: str) -> bool:
+    """超过asr_chunk_seconds的录音分段识别；获取不到时长但有ffmpeg时也分段（ffmpeg逐块解码，不必知道时长）"""
+    duration = probe_duration(audio_path)
+    if duration is None:
+        return shutil.which("ffmpeg") is not None
+    return duration > settings.asr_chunk_seconds
+
+
+def iter_segment_files(audio_path: str) -> Iterator[str]:
+    """长录音逐段写成临时WAV文件交给后端识别，识别完即删除；整段静音的片段跳过"""
+    rate = settings.asr_sample_rate
+    chunks = iter_audio_chunks(audio_path, settings.asr_chunk_seconds, rate)
+    with tempfile.TemporaryDirectory(prefix="asr_") as tmp:
+        for index, segment in enumerate(split_segments(chunks, rate)):
+            if _is_silent(segment):
+                continue
+            path = Path(tmp) / f"segment_{index}.wav"
+            path.write_bytes(encode_wav(segment, rate))
+            yield str(path)
+            path.unlink()
+
+
+def iter_transcript(audio_path: str, backend: Optional[ASRBackend] = None,
+                    streaming: Optional[bool] = None) -> Iterator[str]:
+    """逐段产出增量文本：短录音整段识别，长录音分段依次识别（中文直接拼接，不加分隔）"""
+    backend = backend or get_asr_backend()
+    streaming = settings.asr_streaming if streaming is None else streaming
+    paths = iter_segment_files(audio_path) if needs_chunking(audio_path) else [audio_path]
+    for path in paths:
+        if streaming:
+            yield from backend.stream(path)
+        else:
+            yield backend.transcribe(path)
+
+
+def transcribe_file(audio_path: str, backend: Optional[ASRBackend] = None) -> str:
+    """同步识别整段录音（长录音分段），返回完整文本"""
+    return "".join(iter_transcript(audio_path, backend, streaming=False))
+
+
+def _cache_params(backend: ASRBackend) -> dict:
+    """识别结果缓存键中的参数：除后端和模型外，还有决定送去识别的音频的预处理和分段参数，改了配置不会取到旧的识别结果"""
+    return {
+        "backend": type(backend).__name__,
+        "model": getattr(backend, "model", None),
+        "preprocess": settings.audio_preprocess,
+        "rate": settings.asr_sample_rate,
+        "threshold": settings.audio_silence_threshold_db,
+        "padding": settings.audio_silence_padding,
+        "chunk_seconds": settings.asr_chunk_seconds,
+        "cut_search_seconds": settings.asr_cut_search_seconds,
+    }
+
+
+async def astream_transcript(audio_path: str, backend: Optional[ASRBackend] = None) -> AsyncIterator[str]:
+    """
+    异步地逐段产出识别结果（累计文本），不阻塞事件循环
+    settings.asr_streaming关闭时只产出一次完整文本
+    """
+    backend = backend or get_asr_backend()
+    #同一段录音（按内容摘要）只识别一次
+    cache = get_media_cache()
+    key = cache.make_key("asr", await asyncio.to_thread(content_hash, audio_path), _cache_params(backend))
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    #只统计实际调用识别服务的耗时，不含等待前端消费增量文本的时间
+    if not settings.asr_streaming:
+        with timed("asr"):
+            text = await asyncio.to_thread(transcribe_file, audio_path, backend)
+        yield text
+    else:
+        iterator = iter_transcript(audio_path, backend, streaming=True)
+        text = ""
+        elapsed = 0.0
+        while True:
+            start = time.perf_counter()
+            delta = await asyncio.to_thread(next, iterator, None)
+            elapsed += time.perf_counter() - start
+            if delta is None:
+                break
+            text += delta
+            yield text
+        STAGE_SECONDS.observe(elapsed, stage="asr")
+    cache.set(key, text)
@@ -0,0 +1,81 @@
+"""
+后台摘要基准：回答前同步摘要 vs 写入后由后台线程摘要
+统计长对话中每轮的首token延迟和摘要调用次数；再模拟同一会话的连续消息，检查去重后的摘要次数
+使用本地假模型，摘要模型的每个token较慢，用来放大摘要调用的耗时
+运行：python benchmarks/bench_background.py
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.chat_history import InMemoryChatMessageHistory  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel  # noqa: E402
+from context import ContextWindow  # noqa: E402
+from summary import RollingSummarizer, SummaryWorker  # noqa: E402
+
+TURNS = 30
+ANSWER_TOKEN_DELAY = 0.002
+SUMMARY_TOKEN_DELAY = 0.004  # 一次摘要约50个token，约200ms
+BURST = 20
+
+
+def build(background):
+    from main import build_final_chain
+    histories = {}
+
+    def get_session_history(session_id):
+        return histories.setdefault(session_id, InMemoryChatMessageHistory())
+
+    summary_llm = CountingFakeChatModel(token_delay=SUMMARY_TOKEN_DELAY)
+    summarizer = RollingSummarizer(summary_llm)
+    window = ContextWindow(budget=300, summary_reserve=100)
+    worker = SummaryWorker(summarizer, get_session_history, window) if background else None
+    chain = build_final_chain(CountingFakeChatModel(token_delay=ANSWER_TOKEN_DELAY), get_session_history,
+                              summarizer, window=window, worker=worker)
+    return chain, summary_llm, worker
+
+
+async def run(name, background):
+    chain, summary_llm, worker = build(background)
+    config = {"configurable": {"session_id": name}}
+    ttft = []
+    for turn in range(TURNS):
+        inputs = {"input": f"第{turn}轮：请记住数字{turn * 7}，并解释它的含义。" * 3, "config": config}
+        start = time.perf_counter()
+        first = None
+        async for _ in chain.astream(inputs, config=config):
+            if first is None:
+                first = time.perf_counter() - start
+        ttft.append(first)
+        #模拟用户阅读回答的间隔，后台摘要在这段时间内完成
+        await asyncio.sleep(0.3)
+    if worker:
+        worker.wait_idle()
+    p95 = statistics.quantiles(ttft, n=20)[18]
+    print(f"{name:<6} 首token中位数={statistics.median(ttft) * 1000:>7.1f}ms  p95={p95 * 1000:>7.1f}ms  "
+          f"摘要调用={summary_llm.calls}")
+
+
+def burst():
+    """同一会话连续写入BURST轮：正在摘要时到达的通知只合并成一次重跑"""
+    history = InMemoryChatMessageHistory()
+    summary_llm = CountingFakeChatModel(token_delay=SUMMARY_TOKEN_DELAY)
+    worker = SummaryWorker(RollingSummarizer(summary_llm), lambda session_id: history,
+                           ContextWindow(budget=300, summary_reserve=100))
+    wrapped = worker.history_factory("burst")
+    for turn in range(BURST):
+        wrapped.add_user_message(f"第{turn}条：" + "连续发送的消息。" * 20)
+    worker.wait_idle()
+    print(f"连续{BURST}条消息  后台摘要执行={worker.runs}次  合并的通知={worker.skipped}次  摘要调用={summary_llm.calls}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run("同步摘要", background=False))
+    asyncio.run(run("后台摘要", background=True))
+    burst()
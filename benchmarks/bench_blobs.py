@@ -0,0 +1,110 @@
+"""
+媒体存储基准：图片/录音较多的会话中，base64内联在聊天记录里 vs 存入blob只保存引用
+统计表中消息的总字节数、加载全部历史（JSON解析+反序列化）的耗时，以及按窗口还原最近媒体的耗时
+能连上Postgres时再用临时表测一次真实的表大小和加载耗时，连不上时跳过
+运行：python benchmarks/bench_blobs.py
+"""
+
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict, messages_from_dict  # noqa: E402
+
+from blobstore import BlobStore  # noqa: E402
+from context import ContextWindow  # noqa: E402
+
+TURNS = 100
+IMAGE_BYTES = 40_000
+AUDIO_BYTES = 160_000
+REPEAT = 5
+
+
+class InlineBlobStore(BlobStore):
+    """原实现：媒体保持base64内联在消息中"""
+
+    def externalize(self, message):
+        return message
+
+
+def media_message(turn):
+    """偶数轮发图片，奇数轮发录音"""
+    if turn % 2 == 0:
+        data = base64.b64encode(os.urandom(IMAGE_BYTES)).decode("ascii")
+        part = {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{data}", "detail": "low"}}
+    else:
+        data = base64.b64encode(os.urandom(AUDIO_BYTES)).decode("ascii")
+        part = {"type": "audio_url", "audio_url": {"url": f"data:audio/wav;base64,{data}", "duration": 5}}
+    return HumanMessage([{"type": "text", "text": f"第{turn}轮：请看这个文件。"}, part])
+
+
+def session():
+    messages = []
+    for turn in range(TURNS):
+        messages.append(media_message(turn))
+        messages.append(AIMessage(f"好的，这是第{turn}轮的回答。"))
+    return messages
+
+
+def load(rows):
+    """模拟从message表读取：JSONB解析后反序列化为消息对象"""
+    return messages_from_dict([json.loads(row) for row in rows])
+
+
+def timed(fn):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples)
+
+
+def run(name, rows, blob_store=None):
+    window = ContextWindow(budget=4000, keep_media_messages=2)
+    history, load_time = timed(lambda: load(rows))
+    recent = window.select(history).recent
+    _, resolve_time = timed(lambda: blob_store.resolve_all(recent) if blob_store else recent)
+    size = sum(len(row.encode("utf-8")) for row in rows)
+    print(f"{name:<8} 表中字节={size / 1e6:>8.2f}MB  加载历史={load_time * 1000:>7.1f}ms  "
+          f"还原窗口内媒体={resolve_time * 1000:>6.1f}ms")
+
+
+def run_postgres(messages, blob_store):
+    """真实数据库：两张临时表分别写入内联和引用两种形式"""
+    try:
+        from db import PooledPostgresChatMessageHistory, get_pool
+        pool = get_pool()
+        with pool.connection():
+            pass
+    except Exception as e:
+        print(f"跳过Postgres测试（{type(e).__name__}）")
+        return
+    inline_store = InlineBlobStore(blob_store.root)
+    for name, table, store in (("内联", "bench_inline_store", inline_store), ("blob", "bench_blob_store", blob_store)):
+        history = PooledPostgresChatMessageHistory("bench", table_name=table, blob_store=store)
+        history.clear()
+        history.add_messages(messages)
+        _, load_time = timed(lambda: history.messages)
+        with pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_total_relation_size(%s);", (table,))
+            size = cur.fetchone()[0]
+            cur.execute(f"DROP TABLE {table};")
+        print(f"Postgres {name:<6} 表大小={size / 1e6:>8.2f}MB  加载历史={load_time * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    messages = session()
+    blob_store = BlobStore(tempfile.mkdtemp(prefix="bench_blobs_"))
+    inline_rows = [json.dumps(message_to_dict(m)) for m in messages]
+    ref_rows = [json.dumps(message_to_dict(m)) for m in blob_store.externalize_all(messages)]
+    run("内联", inline_rows)
+    run("blob", ref_rows, blob_store)
+    run_postgres(messages, blob_store)
@@ -0,0 +1,103 @@
+"""
+回答缓存基准：大量新会话提出少数几个常见问题（措辞、标点、空格略有不同）
+比较不开缓存、按会话（默认）精确匹配、跨会话共享时的精确匹配和精确+相似匹配（本地确定性向量HashingEmbeddings）
+的大模型调用次数和首token延迟
+最后统计会话隔离、按会话关闭、过期与按容量淘汰时的命中情况
+运行：python benchmarks/bench_cache.py
+"""
+
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.chat_history import InMemoryChatMessageHistory  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel  # noqa: E402
+from context import ContextWindow  # noqa: E402
+from response_cache import HashingEmbeddings, ResponseCache  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+SESSIONS = 200
+TOKEN_DELAY = 0.002
+THRESHOLD = 0.92
+
+#常见问题及其变体：前两种只差标点/空格/大小写（精确匹配可命中），其余是轻微改写（需要相似匹配）
+FAQ = [
+    ["什么是机器学习？", "什么是机器学习", "什么是 机器学习?", "请问什么是机器学习"],
+    ["怎么重置密码？", "怎么重置密码!", "怎么 重置密码", "请问怎么重置密码呀"],
+    ["你们的营业时间是几点到几点？", "你们的营业时间是几点到几点", "你们的营业时间 是几点到几点？", "请问你们的营业时间是几点到几点"],
+    ["如何申请退款？", "如何申请退款", "如何申请退款。", "我想问下如何申请退款"],
+    ["Python和Java有什么区别？", "python和java有什么区别", "PYTHON和JAVA有什么区别?", "Python和Java到底有什么区别"],
+]
+
+
+def build(cache):
+    from main import build_final_chain
+    histories = {}
+
+    def get_session_history(session_id):
+        return histories.setdefault(session_id, InMemoryChatMessageHistory())
+
+    llm = CountingFakeChatModel(token_delay=TOKEN_DELAY)
+    chain = build_final_chain(llm, get_session_history, RollingSummarizer(CountingFakeChatModel()),
+                              window=ContextWindow(budget=2000), cache=cache)
+    return chain, llm
+
+
+async def ask(chain, session_id, question):
+    config = {"configurable": {"session_id": session_id}}
+    start = time.perf_counter()
+    first = None
+    answer = ""
+    async for chunk in chain.astream({"input": question, "config": config}, config=config):
+        if first is None:
+            first = time.perf_counter() - start
+        answer += chunk.content
+    return first, answer
+
+
+async def run(name, cache):
+    chain, llm = build(cache)
+    rng = random.Random(0)
+    ttft = []
+    for session in range(SESSIONS):
+        variants = rng.choice(FAQ)
+        first, _ = await ask(chain, f"{name}-{session}", rng.choice(variants))
+        ttft.append(first)
+    stats = f"  {cache.snapshot()}" if cache else ""
+    print(f"{name:<10} 大模型调用={llm.calls:<4} 首token中位数={statistics.median(ttft) * 1000:>6.1f}ms{stats}")
+
+
+async def behavior():
+    """统计会话隔离、按会话关闭、过期与淘汰时的命中情况（正确性见tests/test_response_cache.py）"""
+    cache = ResponseCache(embeddings=HashingEmbeddings(), threshold=THRESHOLD, ttl=0.2, max_entries=3)
+    chain, llm = build(cache)
+    await ask(chain, "a", "我叫小明")
+    await ask(chain, "b", "我叫小红")
+    _, answer_a = await ask(chain, "a", "我叫什么名字？")
+    _, answer_b = await ask(chain, "b", "我叫什么名字？")
+    cache.disable("c")
+    calls = llm.calls
+    for session in ("d", "d", "c", "c"):
+        await ask(chain, session, "什么是机器学习？")
+    opt_out_calls = llm.calls - calls
+    await asyncio.sleep(0.25)
+    await ask(chain, "d", "什么是机器学习？")
+    for i in range(5):
+        await ask(chain, f"f{i}", f"第{i}个问题")
+    print(f"两个会话问同一问题的回答{'不同' if answer_a != answer_b else '相同'}；"
+          f"d,d,c,c（c关闭缓存）调用大模型{opt_out_calls}次  {cache.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run("不开缓存", None))
+    asyncio.run(run("按会话", ResponseCache(ttl=0, max_entries=1000, shared=False)))
+    asyncio.run(run("共享精确", ResponseCache(ttl=0, max_entries=1000, shared=True)))
+    asyncio.run(run("共享+相似", ResponseCache(embeddings=HashingEmbeddings(), threshold=THRESHOLD, ttl=0,
+                                           max_entries=1000, shared=True)))
+    asyncio.run(behavior())
@@ -0,0 +1,91 @@
+"""
+并发压测：同步线程池路径 vs 异步信号量路径
+在1、10、100个并发会话下统计每轮延迟的p50/p99，使用本地假模型和带延迟的假数据库
+运行：python benchmarks/bench_concurrency.py
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fakes import CountingFakeChatModel, FakeLatencyHistory  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+TURNS = 3
+TOKEN_DELAY = 0.005  # 每个token 5ms
+DB_LATENCY = 0.005  # 每次数据库往返 5ms
+SYNC_WORKERS = 4  # 同步路径的工作线程数
+MAX_CONCURRENT_TURNS = 32  # 异步路径的信号量
+
+
+def build_chain():
+    from main import build_final_chain
+    histories = {}
+    chain = build_final_chain(
+        CountingFakeChatModel(token_delay=TOKEN_DELAY),
+        lambda session_id: histories.setdefault(session_id, FakeLatencyHistory(DB_LATENCY)),
+        RollingSummarizer(CountingFakeChatModel(token_delay=TOKEN_DELAY)),
+    )
+    return chain
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else values[0]
+
+
+def report(name, sessions, latencies, elapsed):
+    print(f"{name:<6} 并发会话={sessions:<4} p50={percentile(latencies, 50) * 1000:8.1f}ms "
+          f"p99={percentile(latencies, 99) * 1000:8.1f}ms 吞吐={len(latencies) / elapsed:7.1f}轮/秒")
+
+
+def run_sync(sessions):
+    chain = build_chain()
+    latencies = []
+
+    def session(n):
+        config = {"configurable": {"session_id": f"s{n}"}}
+        #延迟从请求到达算起（包括排队等待线程的时间）；第一轮在压测开始时到达，之后每轮在上一轮结束时到达
+        ready = start
+        for turn in range(TURNS):
+            for _ in chain.stream({"input": f"第{turn}轮问题", "config": config}, config=config):
+                pass
+            end = time.perf_counter()
+            latencies.append(end - ready)
+            ready = end
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(SYNC_WORKERS) as pool:
+        list(pool.map(session, range(sessions)))
+    report("sync", sessions, latencies, time.perf_counter() - start)
+
+
+async def run_async(sessions):
+    chain = build_chain()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+    latencies = []
+
+    async def session(n):
+        config = {"configurable": {"session_id": f"s{n}"}}
+        ready = start
+        for turn in range(TURNS):
+            async with semaphore:
+                async for _ in chain.astream({"input": f"第{turn}轮问题", "config": config}, config=config):
+                    pass
+            end = time.perf_counter()
+            latencies.append(end - ready)
+            ready = end
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(n) for n in range(sessions)))
+    report("async", sessions, latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    for sessions in (1, 10, 100):
+        run_sync(sessions)
+        asyncio.run(run_async(sessions))
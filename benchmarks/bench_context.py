@@ -0,0 +1,74 @@
+"""
+上下文窗口基准：图文混合的对话中，固定保留最近k条 vs 按token预算切分
+统计每轮送入大模型的历史token数、历史字节数（含base64媒体）和摘要调用次数，使用本地假模型
+窗口的正确性（媒体占位、短对话不摘要、超长消息）见tests/test_context.py
+运行：python benchmarks/bench_context.py
+"""
+
+import base64
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel  # noqa: E402
+from context import ContextWindow, TokenCounter  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+TURNS = 60
+K = 2
+BUDGET = 2000
+
+
+def image_message(turn):
+    data = base64.b64encode(os.urandom(60_000)).decode("ascii")
+    return HumanMessage([
+        {"type": "text", "text": f"第{turn}轮：这张图片里有什么？"},
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{data}", "detail": "low"}},
+    ])
+
+
+def user_message(turn):
+    """每5轮一张图片，每7轮粘贴一段长文档，其余为短问题"""
+    if turn % 5 == 0:
+        return image_message(turn)
+    if turn % 7 == 0:
+        return HumanMessage(f"第{turn}轮：帮我总结这份文档。" + "这是一段很长的文档内容。" * 400)
+    return HumanMessage(f"第{turn}轮：请记住数字{turn * 7}。")
+
+
+def history_bytes(messages):
+    return sum(len(str(m.content).encode("utf-8")) for m in messages)
+
+
+def run(name, select):
+    llm = CountingFakeChatModel()
+    summarizer = RollingSummarizer(llm)
+    counter = TokenCounter()
+    history, tokens, sizes = [], [], []
+    start = time.perf_counter()
+    for turn in range(TURNS):
+        recent, _ = select(summarizer, history)
+        tokens.append(counter.count_messages(recent))
+        sizes.append(history_bytes(recent))
+        history.append(user_message(turn))
+        history.append(AIMessage(f"好的，这是第{turn}轮的回答。"))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} 摘要调用={llm.calls:<4} 历史token(平均/最大)={sum(tokens) // len(tokens)}/{max(tokens):<7} "
+          f"历史字节(最大)={max(sizes):<8} 耗时={elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    window = ContextWindow(budget=BUDGET, summary_reserve=300, keep_media_messages=2)
+    run("最近k条", lambda s, h: s.summarize("bench", h, K))
+
+    def windowed(summarizer, history):
+        selection = window.select(history)
+        return summarizer.summarize_until("bench", selection.messages, selection.boundary)
+
+    run("token预算", windowed)
+    print(f"token计数缓存：命中={window.counter.hits} 未命中={window.counter.misses}")
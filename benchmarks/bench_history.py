@@ -0,0 +1,119 @@
+"""
+聊天记录后端基准：每轮读写数据库（postgres） vs 热会话在内存、批量写回（tiered） vs 仅内存（memory）
+数据库用每次往返5ms的假历史记录模拟；统计每轮读取历史的耗时、数据库往返次数、淘汰与写回次数
+最后统计内存条数上限下的滚动摘要：历史前部被截断后，摘要水位线按锚点重新定位（正确性见tests/test_context.py）
+运行：python benchmarks/bench_history.py
+"""
+
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel, FakeLatencyHistory  # noqa: E402
+from context import ContextWindow  # noqa: E402
+from history_store import MemoryChatMessageHistory, SessionStore  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+DB_LATENCY = 0.005
+SESSIONS = 20
+TURNS = 15
+MAX_SESSIONS = 12
+
+
+class CountingDB:
+    """按会话保存假历史记录，并统计往返次数"""
+
+    def __init__(self):
+        self.histories = {}
+        self.round_trips = 0
+
+    def __call__(self, session_id):
+        history = self.histories.setdefault(session_id, FakeLatencyHistory(DB_LATENCY))
+        db = self
+
+        class Counted:
+            @property
+            def messages(self):
+                db.round_trips += 1
+                return history.messages
+
+            def add_messages(self, messages):
+                db.round_trips += 1
+                history.add_messages(messages)
+
+        return Counted()
+
+
+def run(name, factory, db, store=None):
+    reads = []
+    start = time.perf_counter()
+    #轮流与各会话对话：同一时刻活跃的会话数少于SESSIONS，超出MAX_SESSIONS的冷会话会被淘汰
+    for turn in range(TURNS):
+        for session in range(SESSIONS):
+            if session >= 8 and (turn + session) % 5:
+                continue  # 前8个会话每轮都活跃，其余会话偶尔来一次
+            history = factory(f"s{session}")
+            t = time.perf_counter()
+            history.messages
+            reads.append(time.perf_counter() - t)
+            history.add_messages([HumanMessage(f"第{turn}轮问题"), AIMessage(f"第{turn}轮回答")])
+    if store:
+        store.flush()
+    elapsed = time.perf_counter() - start
+    extra = f"  {store.snapshot()}" if store else ""
+    print(f"{name:<9} 读取中位数={statistics.median(reads) * 1000:>6.2f}ms  数据库往返={db.round_trips:<5} "
+          f"总耗时={elapsed:.2f}s{extra}")
+
+
+class RecordingSummarizer(RollingSummarizer):
+    """记录每次交给大模型折叠的消息"""
+
+    def __init__(self, llm, **kwargs):
+        super().__init__(llm, **kwargs)
+        self.folded = []
+
+    def _fold_input(self, rolling, stored_messages, boundary):
+        fold_input = super()._fold_input(rolling, stored_messages, boundary)
+        self.folded.extend(m.content for m in fold_input["chat_history"])
+        return fold_input
+
+
+def capped_summary():
+    """内存中只保留最近10条：统计历史前部被截断后的摘要调用和折叠的消息数"""
+    llm = CountingFakeChatModel()
+    window = ContextWindow(budget=60, summary_reserve=20, keep_media_messages=0)
+    #预算很小，折叠阈值按摘要预留的一半设置（默认阈值按默认预算设置）
+    summarizer = RecordingSummarizer(llm, min_new_tokens=window.summary_reserve // 2)
+    history = MemoryChatMessageHistory("capped", SessionStore(max_messages=10))
+    sent = []
+    for turn in range(40):
+        selection = window.select(history.messages)
+        recent, _ = summarizer.summarize_until("capped", selection.messages, selection.boundary)
+        turn_messages = [HumanMessage(f"第{turn}轮：数字{turn}"), AIMessage(f"记住了{turn}")]
+        sent.extend(m.content for m in turn_messages)
+        history.add_messages(turn_messages)
+    repeated = len(summarizer.folded) - len(set(summarizer.folded))
+    missing = sum(1 for m in sent[:len(summarizer.folded)] if m not in summarizer.folded)
+    print(f"内存上限10条、40轮对话：摘要调用={llm.calls}次，折叠消息={len(summarizer.folded)}条，"
+          f"重复={repeated}条，遗漏={missing}条")
+
+
+if __name__ == "__main__":
+    db = CountingDB()
+    run("postgres", db, db)
+
+    db = CountingDB()
+    store = SessionStore(cold=db, max_sessions=MAX_SESSIONS, ttl=0, max_messages=200, flush_interval=0.05)
+    run("tiered", lambda session_id: MemoryChatMessageHistory(session_id, store), db, store)
+    store.close()
+
+    db = CountingDB()
+    store = SessionStore(max_sessions=MAX_SESSIONS, ttl=0, max_messages=200)
+    run("memory", lambda session_id: MemoryChatMessageHistory(session_id, store), db, store)
+
+    capped_summary()
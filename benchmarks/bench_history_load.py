@@ -0,0 +1,202 @@
+"""
+历史回放基准：一个有1万条消息的会话（夹杂图片），打开页面时把历史加载到聊天界面
+比较：
+1、一次读出整个会话（PostgresChatMessageHistory.messages的做法）：媒体内联 / 媒体为blob引用，再全部转换为界面消息
+2、HistoryReader键集分页：只读最近一页、只取类型和内容两个字段，逐行转换；再向上翻若干页
+本地用内存中的“表”模拟（按(session_id, id)排好序的索引 + JSON文本行），统计扫描行数、传给客户端的字节数和耗时；
+能连上Postgres时再用临时表测一次真实耗时，并比较迁移（建(session_id, id)索引）前后
+运行：python benchmarks/bench_history_load.py [--messages 10000]
+"""
+
+import argparse
+import base64
+import bisect
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict, messages_from_dict  # noqa: E402
+
+from blobstore import BlobStore  # noqa: E402
+from history_reader import rows_to_page, to_gradio  # noqa: E402
+
+PAGE_SIZE = 50
+SCROLL_PAGES = 5
+OTHER_SESSIONS = 10
+IMAGE_EVERY = 50  # 每50轮有一轮带图片
+IMAGE_BYTES = 40_000
+REPEAT = 5
+
+
+def session(turns: int):
+    messages = []
+    image = base64.b64encode(os.urandom(IMAGE_BYTES)).decode("ascii")
+    for turn in range(turns):
+        text = {"type": "text", "text": f"第{turn}轮：" + "我想问一个关于项目进度的问题。" * 3}
+        if turn % IMAGE_EVERY == 0:
+            #每张图片内容不同（前缀不同），blob存储中各存一份
+            url = f"data:image/jpeg;base64,{base64.b64encode(turn.to_bytes(4, 'little')).decode()}{image}"
+            messages.append(HumanMessage([text, {"type": "image_url", "image_url": {"url": url}}]))
+        else:
+            messages.append(HumanMessage([text]))
+        messages.append(AIMessage(f"第{turn}轮的回答：" + "这是一个比较详细的回答。" * 8,
+                                  response_metadata={"model_name": "fake", "finish_reason": "stop"}))
+    return messages
+
+
+class LocalTable:
+    """内存中的message_store：行按id递增追加，多个会话交错写入；索引为每个会话排好序的id列表"""
+
+    def __init__(self):
+        self.rows = []  # (id, session_id, JSON文本)
+        self.index = {}  # session_id -> [(id, 行号)]
+        self.scanned = 0
+        self.bytes_sent = 0
+
+    def insert(self, session_id, messages):
+        for message in messages:
+            row_id = len(self.rows) + 1
+            self.index.setdefault(session_id, []).append((row_id, len(self.rows)))
+            self.rows.append((row_id, session_id, json.dumps(message_to_dict(message))))
+
+    def select_all(self, session_id):
+        """SELECT message ... WHERE session_id = ? ORDER BY id（没有索引时扫描全表）"""
+        result = []
+        for row_id, sid, text in self.rows:
+            self.scanned += 1
+            if sid == session_id:
+                self.bytes_sent += len(text.encode("utf-8"))
+                result.append(text)
+        return result
+
+    def select_page(self, session_id, before, limit):
+        """SELECT id, type, content ... WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?（走索引）"""
+        entries = self.index.get(session_id, [])
+        end = len(entries) if before is None else bisect.bisect_left(entries, (before, -1))
+        result = []
+        for row_id, position in reversed(entries[max(end - limit, 0):end]):
+            self.scanned += 1
+            #服务端的字段投影：客户端只收到类型和内容
+            data = json.loads(self.rows[position][2])
+            projected = (data["type"], json.dumps(data["data"]["content"]))
+            self.bytes_sent += sum(len(p.encode("utf-8")) for p in projected)
+            result.append((row_id, projected[0], json.loads(projected[1])))
+        return result
+
+
+def timed(fn):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples)
+
+
+def full_load(table, session_id, blob_store):
+    """一次读出整个会话，反序列化为消息对象后全部转换为界面消息"""
+    messages = messages_from_dict([json.loads(text) for text in table.select_all(session_id)])
+    return [m for message in messages for m in to_gradio(message.type, message.content, blob_store)]
+
+
+def paged_load(table, session_id, blob_store, pages):
+    ui, before = [], None
+    for _ in range(pages):
+        page = rows_to_page(table.select_page(session_id, before, PAGE_SIZE + 1), PAGE_SIZE, blob_store)
+        ui = page.messages + ui
+        before = page.before
+        if before is None:
+            break
+    return ui
+
+
+def report(name, table, fn):
+    table.scanned = table.bytes_sent = 0
+    ui, elapsed = timed(fn)
+    print(f"{name:<22} 耗时={elapsed * 1000:>8.1f}ms  扫描行数={table.scanned // REPEAT:>7}  "
+          f"传给客户端={table.bytes_sent / REPEAT / 1e6:>7.2f}MB  界面消息={len(ui)}")
+    return elapsed
+
+
+def run_local(messages, blob_store):
+    others = session(len(messages) // 2 // OTHER_SESSIONS)
+    tables = {}
+    for name, store in (("内联", None), ("blob", blob_store)):
+        table = LocalTable()
+        stored = blob_store.externalize_all(messages) if store else messages
+        #其他会话的消息与测试会话交错写入
+        chunk = len(stored) // OTHER_SESSIONS
+        for i in range(OTHER_SESSIONS):
+            table.insert("bench", stored[i * chunk:(i + 1) * chunk])
+            table.insert(f"other{i}", others)
+        table.insert("bench", stored[OTHER_SESSIONS * chunk:])
+        tables[name] = table
+
+    full_inline = report("整会话读取（媒体内联）", tables["内联"], lambda: full_load(tables["内联"], "bench", blob_store))
+    full_blob = report("整会话读取（blob引用）", tables["blob"], lambda: full_load(tables["blob"], "bench", blob_store))
+    first = report("分页：最近一页", tables["blob"], lambda: paged_load(tables["blob"], "bench", blob_store, 1))
+    report(f"分页：向上翻{SCROLL_PAGES}页", tables["blob"],
+           lambda: paged_load(tables["blob"], "bench", blob_store, SCROLL_PAGES))
+    print(f"首屏加速：相对媒体内联{full_inline / first:.0f}倍，相对blob引用{full_blob / first:.0f}倍")
+    #分页读到最后与整会话读取的结果一致（正确性见tests/test_history_reader.py）
+    same = paged_load(tables["blob"], "bench", blob_store, len(messages)) == full_load(tables["blob"], "bench", blob_store)
+    print(f"分页读完与整会话读取一致：{'是' if same else '否'}")
+
+
+def run_postgres(messages, blob_store):
+    """真实数据库：临时表中写入测试会话和其他会话，比较迁移前后整会话读取与分页读取的耗时"""
+    try:
+        import psycopg2.extras
+        from db import get_pool, migrate_history_table
+        from history_reader import PostgresHistoryReader
+        pool = get_pool()
+        with pool.connection():
+            pass
+    except Exception as e:
+        print(f"跳过Postgres测试（{type(e).__name__}）")
+        return
+    table = "bench_history_load"
+    rows = [json.dumps(message_to_dict(m)) for m in blob_store.externalize_all(messages)]
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table};")
+        cur.execute(f"CREATE TABLE {table} (id SERIAL PRIMARY KEY, session_id TEXT NOT NULL, message JSONB NOT NULL);")
+        chunk = len(rows) // OTHER_SESSIONS
+        for i in range(OTHER_SESSIONS):
+            psycopg2.extras.execute_values(cur, f"INSERT INTO {table} (session_id, message) VALUES %s;",
+                                           [("bench", r) for r in rows[i * chunk:(i + 1) * chunk]]
+                                           + [(f"other{i}", r) for r in rows[:chunk]])
+        cur.execute(f"ANALYZE {table};")
+    reader = PostgresHistoryReader(pool=pool, table_name=table, blob_store=blob_store)
+    #表已存在，不让读取器再建表/建索引，迁移前后的对比由migrate_history_table控制
+    reader.table._ready_tables.add((id(pool), table))
+
+    def select_all():
+        with pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT message FROM {table} WHERE session_id = %s ORDER BY id;", ("bench",))
+            return cur.fetchall()
+
+    for stage in ("迁移前", "迁移后"):
+        if stage == "迁移后":
+            migrate_history_table(pool, table)
+        _, full = timed(select_all)
+        _, first = timed(lambda: reader.page("bench", limit=PAGE_SIZE))
+        print(f"Postgres {stage}：整会话读取={full * 1000:>7.1f}ms  分页首屏={first * 1000:>6.1f}ms")
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute(f"DROP TABLE {table};")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="历史回放基准")
+    parser.add_argument("--messages", type=int, default=10_000, help="测试会话的消息条数")
+    args = parser.parse_args()
+
+    messages = session(args.messages // 2)
+    blob_store = BlobStore(tempfile.mkdtemp(prefix="bench_history_load_"))
+    run_local(messages, blob_store)
+    run_postgres(messages, blob_store)
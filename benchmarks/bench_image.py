@@ -0,0 +1,72 @@
+"""
+图片预处理基准：原实现（原尺寸按原格式重新保存）与新流水线的CPU耗时和上传字节数
+样本为合成的大尺寸照片（可在命令行追加真实照片路径）
+运行：python benchmarks/bench_image.py [更多图片...]
+"""
+
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from media import preprocess_image  # noqa: E402
+
+
+def synth_photo(path: Path, size, fmt: str, orientation: int = 1):
+    """合成一张“照片”：平滑渐变叠加噪声，接近真实照片的压缩难度"""
+    w, h = size
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([x / w * 255, y / h * 255, (x + y) / (w + h) * 255], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels, "RGB")
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    if fmt == "JPEG":
+        img.save(path, format=fmt, quality=95, exif=exif)
+    else:
+        img.save(path, format=fmt)
+
+
+def original_pipeline(image_path):
+    """原transcribe_image：解码后按原格式、原尺寸重新保存"""
+    with Image.open(image_path) as img:
+        img_format = img.format if img.format else "JPEG"
+        buffered = io.BytesIO()
+        img.save(buffered, format=img_format)
+        return buffered.getvalue()
+
+
+def measure(fn, path, repeat=3):
+    start = time.process_time()
+    for _ in range(repeat):
+        data = fn(path)
+    return (time.process_time() - start) / repeat, data
+
+
+def bench(path: Path):
+    old_cpu, old_data = measure(original_pipeline, str(path))
+    new_cpu, prepared = measure(preprocess_image, str(path))
+    print(f"{path.name:<24} 原文件={path.stat().st_size:>9}B | 原实现 CPU={old_cpu * 1000:7.1f}ms 上传={len(old_data):>9}B | "
+          f"新流水线 CPU={new_cpu * 1000:7.1f}ms 上传={len(prepared.data):>7}B {prepared.size[0]}x{prepared.size[1]}")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = []
+        for name, size, fmt, orientation in [("photo_4032x3024.jpg", (4032, 3024), "JPEG", 6),
+                                             ("photo_6000x4000.jpg", (6000, 4000), "JPEG", 1),
+                                             ("screenshot_2880x1800.png", (2880, 1800), "PNG", 1),
+                                             ("small_400x300.jpg", (400, 300), "JPEG", 1)]:
+            path = Path(tmp) / name
+            synth_photo(path, size, fmt, orientation)
+            samples.append(path)
+        samples += [Path(p) for p in sys.argv[1:]]
+        for sample in samples:
+            bench(sample)
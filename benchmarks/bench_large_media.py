@@ -0,0 +1,128 @@
+"""
+大文件基准：用tracemalloc统计处理过程中Python堆（含NumPy数组）的峰值，比较内存占用与文件大小的关系
+1、base64：一次读入再编码 vs b64encode_file流式编码
+2、长录音分段识别：5分钟和20分钟的录音，峰值内存、分段数、切点是否落在静音处
+3、payload上限：长录音发给大模型时变为转写文字，超过上限的原文件不再发送
+4、视频：有ffmpeg时合成一段带音轨的视频，抽关键帧和音轨；没有ffmpeg时展示兜底
+正确性（编码结果、分段边界、payload上限、兜底片段）见tests/test_media.py
+运行：python benchmarks/bench_large_media.py
+"""
+
+import asyncio
+import base64
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fakes import SegmentASR, write_long_wav  # noqa: E402
+from config import get_settings  # noqa: E402
+
+settings = get_settings()
+
+
+def peak(fn):
+    """返回（结果，Python堆峰值字节数，耗时）"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[1], time.perf_counter() - start
+    finally:
+        tracemalloc.stop()
+
+
+def mb(n: int) -> str:
+    return f"{n / 1e6:7.1f}MB"
+
+
+def bench_base64(tmp: Path):
+    from media import b64encode_file
+    print("== base64编码")
+    for size in (8_000_000, 32_000_000, 128_000_000):
+        path = tmp / f"blob_{size}.bin"
+        with open(path, "wb") as f:
+            for _ in range(size // 4_000_000):
+                f.write(os.urandom(4_000_000))
+        whole, whole_peak, whole_time = peak(lambda: base64.b64encode(path.read_bytes()).decode("utf-8"))
+        streamed, streamed_peak, streamed_time = peak(lambda: b64encode_file(str(path)))
+        del whole, streamed
+        print(f"  文件={mb(size)}  一次读入：峰值={mb(whole_peak)} 耗时={whole_time * 1000:6.0f}ms  "
+              f"流式：峰值={mb(streamed_peak)} 耗时={streamed_time * 1000:6.0f}ms  "
+              f"峰值/编码结果={streamed_peak / (size * 4 / 3):.2f}")
+        path.unlink()
+
+
+def bench_chunked_asr(tmp: Path):
+    from asr import transcribe_file
+    print("== 长录音分段识别")
+    peaks = []
+    for minutes in (5, 20):
+        path = tmp / f"recording_{minutes}min.wav"
+        write_long_wav(path, minutes * 60)
+        asr = SegmentASR()
+        text, used, elapsed = peak(lambda: transcribe_file(str(path), backend=asr))
+        peaks.append(used)
+        longest = max(asr.durations)
+        print(f"  {minutes:>2}分钟 文件={mb(path.stat().st_size)} 峰值={mb(used)} 耗时={elapsed:5.2f}s "
+              f"分段={asr.calls} 最长片段={longest:5.2f}s 切在停顿处={asr.clean_cuts}/{asr.calls - 1}")
+        path.unlink()
+    print(f"  峰值内存：20分钟/5分钟={peaks[1] / peaks[0]:.2f}")
+    return peaks
+
+
+def bench_payload(tmp: Path):
+    from asr import set_asr_backend
+    from media import MediaTooLarge, encode_audio_part, prepare_media_groups, raw_file_part
+    print("== payload上限")
+    set_asr_backend(SegmentASR())
+    short, long = tmp / "short.wav", tmp / "long.wav"
+    write_long_wav(short, 10)
+    write_long_wav(long, settings.media_max_audio_seconds + 60)
+    short_part = encode_audio_part(str(short))
+    long_part, used, _ = peak(lambda: encode_audio_part(str(long)))
+    print(f"  10秒录音 -> {short_part['type']}（{len(short_part['audio_url']['url']) / 1e3:.0f}KB）  "
+          f"{settings.media_max_audio_seconds + 60:.0f}秒录音 -> {long_part['type']}（峰值={mb(used)}）")
+
+    big = tmp / "big.m4a"
+    with open(big, "wb") as f:
+        f.truncate(settings.media_max_payload_bytes)
+    try:
+        raw_file_part(str(big))
+    except MediaTooLarge as e:
+        print(f"  原文件兜底超过上限：{e}")
+    #编码失败（没有ffmpeg无法解码m4a时原样上传也会超限）时换成说明文字，不影响同一条消息中的其他文件
+    groups = asyncio.run(prepare_media_groups([str(short), str(big)]))
+    print(f"  同一条消息：{[[p['type'] for p in g] for g in groups]}")
+
+
+def bench_video(tmp: Path):
+    from media import encode_video_parts, prepare_media_groups
+    print("== 视频")
+    video = tmp / "clip.mp4"
+    if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        video.write_bytes(os.urandom(200_000))
+        groups = asyncio.run(prepare_media_groups([str(video)]))
+        print(f"  没有ffmpeg，跳过抽帧；兜底片段：{[p['type'] for p in groups[0]]}")
+        return
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=25",
+                    "-f", "lavfi", "-i", "sine=frequency=440", "-t", "60", "-g", "50", "-shortest", str(video)],
+                   check=True)
+    parts, used, elapsed = peak(lambda: encode_video_parts(str(video)))
+    kinds = [p["type"] for p in parts]
+    print(f"  60秒视频 文件={mb(video.stat().st_size)} 片段={kinds} 峰值={mb(used)} 耗时={elapsed:5.2f}s")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory(prefix="bench_large_media_") as tmp:
+        tmp = Path(tmp)
+        bench_base64(tmp)
+        bench_chunked_asr(tmp)
+        bench_payload(tmp)
+        bench_video(tmp)
@@ -0,0 +1,133 @@
+"""
+长期记忆基准：一个很长的会话，开头几轮告诉助手一些具体事实，之后是大量无关的闲聊，最后逐一提问这些事实
+比较只有滚动摘要、摘要+长期记忆（本地确定性向量HashingEmbeddings + 进程内NumPy索引）时：
+1、回忆率：提问时答案所需的原始事实是否出现在发给大模型的提示词中
+2、提示词大小：会话变长时每轮提示词的token数是否保持有界
+3、增量向量化：向量化的消息条数与批量调用次数
+正确性（按时间顺序取回、增量索引、并入系统提示词）见tests/test_memory.py
+运行：python benchmarks/bench_memory.py [--turns 300]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.chat_history import InMemoryChatMessageHistory  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel, approx_tokens, message_text  # noqa: E402
+from context import ContextWindow  # noqa: E402
+from memory import InMemoryMemoryStore, LongTermMemory  # noqa: E402
+from response_cache import HashingEmbeddings  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+BUDGET = 1500
+BATCH_SIZE = 16
+
+#（开头告诉助手的事实，最后的提问，答案中必须出现的关键字）
+FACTS = [
+    ("我的车牌号是京A7K3Q9，记一下", "我的车牌号是多少？", "京A7K3Q9"),
+    ("我妹妹叫林晓雨，她的生日是三月十四日", "我妹妹的生日是哪天？", "三月十四日"),
+    ("我家的WiFi密码是sunflower2024", "我家WiFi密码是什么来着？", "sunflower2024"),
+    ("我对花生过敏，吃了会起疹子", "我对什么过敏？", "花生"),
+    ("我的护照号码是E93817265", "我的护照号码是多少？", "E93817265"),
+]
+
+FILLER_TOPICS = ["天气", "足球比赛", "做菜", "旅游攻略", "电影推荐", "编程语言", "健身计划", "读书笔记", "股票行情",
+                 "手机评测", "历史故事", "音乐专辑", "宠物饲养", "园艺种植", "摄影技巧", "咖啡冲泡"]
+
+
+def filler(turn: int) -> str:
+    topic = FILLER_TOPICS[turn % len(FILLER_TOPICS)]
+    return f"第{turn}轮：随便聊聊{topic}，说说关于{topic}你知道的第{turn % 7 + 1}个冷知识吧"
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """统计向量模型的调用次数和向量化的文本条数"""
+
+    def __init__(self):
+        super().__init__()
+        self.document_calls = 0
+        self.documents = 0
+        self.queries = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.document_calls += 1
+        self.documents += len(texts)
+        return [HashingEmbeddings.embed_query(self, text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queries += 1
+        return super().embed_query(text)
+
+
+class PromptRecordingModel(CountingFakeChatModel):
+    """记录最近一次收到的提示词"""
+
+    last_prompt: str = ""
+
+    def _reply(self, messages):
+        self.last_prompt = "\n".join(message_text(m) for m in messages)
+        return super()._reply(messages)
+
+
+async def run(name: str, turns: int, memory: LongTermMemory = None):
+    from main import build_final_chain
+    histories = {}
+
+    def get_session_history(session_id):
+        return histories.setdefault(session_id, InMemoryChatMessageHistory())
+
+    llm = PromptRecordingModel(reply_chars=60)
+    #摘要模型只保留末尾的一小段文字，模拟摘要压缩时丢失的细节
+    summarizer = RollingSummarizer(CountingFakeChatModel(reply_chars=120))
+    chain = build_final_chain(llm, get_session_history, summarizer, window=ContextWindow(budget=BUDGET),
+                              memory=memory)
+    config = {"configurable": {"session_id": "long"}}
+
+    async def ask(question: str) -> str:
+        async for _ in chain.astream({"input": question, "config": config}, config=config):
+            pass
+        return llm.last_prompt
+
+    prompt_tokens = {}
+    for fact, _, _ in FACTS:
+        await ask(fact)
+    for turn in range(turns):
+        prompt = await ask(filler(turn))
+        if turn + 1 in (turns // 4, turns // 2, turns):
+            prompt_tokens[turn + 1] = approx_tokens(prompt)
+    recalled = 0
+    question_tokens = []
+    for _, question, answer in FACTS:
+        prompt = await ask(question)
+        recalled += answer in prompt
+        question_tokens.append(approx_tokens(prompt))
+
+    sizes = "  ".join(f"第{t}轮={n}" for t, n in prompt_tokens.items())
+    print(f"== {name} ==")
+    print(f"  回忆率={recalled}/{len(FACTS)}  提问时提示词中位数={statistics.median(question_tokens):.0f}token")
+    print(f"  闲聊时提示词大小：{sizes}")
+    if memory is not None:
+        messages = len(get_session_history("long").messages)
+        embeddings = memory.embeddings
+        print(f"  向量化：{embeddings.documents}条消息（历史共{messages}条），{embeddings.document_calls}次批量调用，"
+              f"{embeddings.queries}次问题向量化")
+    return recalled, prompt_tokens
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="长期记忆基准")
+    parser.add_argument("--turns", type=int, default=300, help="事实与提问之间的闲聊轮数")
+    args = parser.parse_args()
+
+    baseline, _ = asyncio.run(run("只有滚动摘要", args.turns))
+    memory = LongTermMemory(CountingEmbeddings(), InMemoryMemoryStore(), top_k=4, batch_size=BATCH_SIZE)
+    recalled, sizes = asyncio.run(run("摘要+长期记忆", args.turns, memory))
+    #会话长度翻倍时提示词大小的变化（窗口预算 + top_k条记忆 + 摘要）
+    first, last = list(sizes.values())[0], list(sizes.values())[-1]
+    print(f"回忆率：{baseline}/{len(FACTS)} -> {recalled}/{len(FACTS)}  闲聊提示词：第一次采样{first} -> 最后{last}token")
@@ -0,0 +1,166 @@
+"""
+外部调用调度基准：本地模拟的服务商（服务端令牌桶 + 并发上限，超出返回429），不访问任何外部服务
+1、突发：同一时刻到达一批交互式回答和一批后台摘要
+   直连（客户端自带的重试，各请求互不协调） vs ProviderLimiter（按服务商限速、按优先级放行、退避重试），
+   比较服务商返回的429次数、最终失败数，以及两类请求各自的p50/p99
+2、向量化微批：大量线程同时embed_query，比较发给服务商的请求数
+3、集成：ChatApp的回答模型和摘要模型共用一个调度器，多会话并发对话不失败、流式输出仍是逐块的
+运行：python benchmarks/bench_outbound.py [--calls 60]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fakes import (FakeLatencyHistory, MockProvider, MockProviderChatModel,  # noqa: E402
+                              MockProviderEmbeddings)
+from outbound import (BACKGROUND, INTERACTIVE, ProviderLimiter, ScheduledChatModel,  # noqa: E402
+                      ScheduledEmbeddings, is_retryable, retry_after)
+
+#服务商的限额，调度器按同样的数值配置
+RATE = 40.0
+BURST = 8
+MAX_IN_FLIGHT = 6
+LATENCY = 0.05
+TOKEN_DELAY = 0.001
+#openai客户端默认的重试：2次，0.5秒起指数退避（有Retry-After时照做）
+CLIENT_RETRIES = 2
+CLIENT_BACKOFF = 0.5
+
+
+def provider():
+    return MockProvider(RATE, BURST, MAX_IN_FLIGHT, latency=LATENCY)
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+async def client_retry(llm, prompt):
+    """直连：与客户端库一样各自重试，不知道其他请求的存在"""
+    for attempt in range(CLIENT_RETRIES + 1):
+        try:
+            return await llm.ainvoke(prompt)
+        except Exception as e:
+            if attempt == CLIENT_RETRIES or not is_retryable(e):
+                raise
+            delay = retry_after(e)
+            await asyncio.sleep(delay if delay is not None else CLIENT_BACKOFF * 2 ** attempt * random.uniform(0.75, 1))
+
+
+async def burst(name, calls, scheduled):
+    server = provider()
+    model = MockProviderChatModel(provider=server, reply_chars=40, token_delay=TOKEN_DELAY)
+    limiter = ProviderLimiter("bench", rate=RATE, burst=BURST, max_in_flight=MAX_IN_FLIGHT,
+                              max_retries=4, backoff_base=0.05, backoff_max=2.0)
+    latencies = {INTERACTIVE: [], BACKGROUND: []}
+    failures = 0
+
+    async def one(priority, index):
+        nonlocal failures
+        prompt = f"{'回答' if priority == INTERACTIVE else '摘要'}请求{index}"
+        start = time.perf_counter()
+        try:
+            if scheduled:
+                await ScheduledChatModel(inner=model, limiter=limiter, priority=priority).ainvoke(prompt)
+            else:
+                await client_retry(model, prompt)
+        except Exception:
+            failures += 1
+            return
+        latencies[priority].append(time.perf_counter() - start)
+
+    #后台摘要先到，交互式回答随后到达
+    tasks = [one(BACKGROUND, i) for i in range(calls)] + [one(INTERACTIVE, i) for i in range(calls)]
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    def fmt(samples):
+        if not samples:
+            return "      -/      -"
+        return f"{percentile(samples, 0.5) * 1000:6.0f}/{percentile(samples, 0.99) * 1000:6.0f}ms"
+
+    print(f"{name:<10} 服务商收到={server.requests:<4} 429={server.rejected:<4} 失败={failures:<3} "
+          f"回答p50/p99={fmt(latencies[INTERACTIVE])} 摘要p50/p99={fmt(latencies[BACKGROUND])} 总耗时={elapsed:5.2f}s")
+    return server, failures, latencies
+
+
+def embedding_batching(callers):
+    texts = [f"问题{i}" for i in range(callers)]
+    results = {}
+    for name, batched in (("逐条请求", False), ("微批", True)):
+        server = MockProvider(rate=1000.0, burst=1000, max_in_flight=1000, latency=0.02)
+        embeddings = MockProviderEmbeddings(server)
+        if batched:
+            limiter = ProviderLimiter("bench-embeddings", max_retries=0)
+            embeddings_client = ScheduledEmbeddings(embeddings, limiter, max_batch=64, max_wait=0.005)
+        else:
+            embeddings_client = embeddings
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            vectors = list(pool.map(embeddings_client.embed_query, texts))
+        elapsed = time.perf_counter() - start
+        #合批后每个调用方仍拿到自己问题的向量（正确性见tests/test_outbound.py）
+        mismatched = sum(v != embeddings._vector(t) for v, t in zip(vectors, texts))
+        print(f"{name:<10} 调用方={callers} 服务商请求数={embeddings.calls:<4} 总耗时={elapsed * 1000:6.0f}ms "
+              f"向量错配={mismatched}")
+        results[name] = embeddings.calls
+    return results
+
+
+async def integration(users):
+    from main import ChatApp, get_config
+    from outbound import with_priority
+    from summary import RollingSummarizer
+    server = provider()
+    limiter = ProviderLimiter("bench-app", rate=RATE, burst=BURST, max_in_flight=MAX_IN_FLIGHT,
+                              max_retries=6, backoff_base=0.05, backoff_max=2.0)
+    llm = ScheduledChatModel(inner=MockProviderChatModel(provider=server, reply_chars=40, token_delay=TOKEN_DELAY),
+                             limiter=limiter)
+    histories = {}
+    app = ChatApp(llm=llm,
+                  get_session_history=lambda session_id: histories.setdefault(session_id, FakeLatencyHistory()),
+                  summarizer=RollingSummarizer(with_priority(llm, BACKGROUND)))
+    chain = app.final_chain
+    chunks = []
+
+    async def user(index):
+        session_id = f"u{index}"
+        config = get_config(session_id)
+        for turn in range(3):
+            async with app.turn(session_id):
+                count = 0
+                async for _ in chain.astream({"input": f"[{session_id}] 第{turn}轮问题", "config": config},
+                                             config=config):
+                    count += 1
+                chunks.append(count)
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+    if app.summary_worker is not None:
+        app.summary_worker.wait_idle()
+    stats = limiter.snapshot()
+    print(f"集成       会话={users} 对话轮={len(chunks)} 每轮流式块数中位数={statistics.median(chunks):.0f} "
+          f"调度={stats} 服务商429={server.rejected}")
+    return stats, chunks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="外部调用调度基准")
+    parser.add_argument("--calls", type=int, default=60, help="每类请求的数量")
+    parser.add_argument("--embed-callers", type=int, default=200, help="同时embed_query的线程数")
+    parser.add_argument("--users", type=int, default=20, help="集成测试的会话数")
+    args = parser.parse_args()
+
+    asyncio.run(burst("直连", args.calls, scheduled=False))
+    asyncio.run(burst("调度器", args.calls, scheduled=True))
+    embedding_batching(args.embed_callers)
+    asyncio.run(integration(args.users))
@@ -0,0 +1,315 @@
+"""
+完整对话流水线基准：用本地假模型/假ASR/假数据库跑final_chain（语音转文字后对话）和多模态chain_history
+按阶段统计延迟（ASR、媒体编码、加载历史、摘要/窗口、提示词、大模型首token与总耗时、写入历史），
+以及大模型调用次数、token数、发给大模型和读写数据库的字节数，可作为回归检查的基线
+运行：
+    python benchmarks/bench_pipeline.py                         # 打印各阶段耗时
+    python benchmarks/bench_pipeline.py --json base.json        # 保存结果作为基线
+    python benchmarks/bench_pipeline.py --baseline base.json    # 与基线比较，超出容差时返回非0
+    python benchmarks/bench_pipeline.py --profile out.prof      # 保存cProfile结果（可用snakeviz查看）
+    python benchmarks/bench_pipeline.py --folded out.folded     # 采样调用栈，输出flamegraph.pl/speedscope可读的折叠格式
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+#基准数据写到临时目录，不污染仓库和真实缓存
+_tmp = tempfile.mkdtemp(prefix="bench_pipeline_")
+os.environ.setdefault("BLOB_STORE_DIR", os.path.join(_tmp, "blobs"))
+os.environ["MEDIA_CACHE_DIR"] = ""
+os.environ["SUMMARY_BACKGROUND"] = "false"
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from asr import astream_transcript  # noqa: E402
+from blobstore import get_blob_store  # noqa: E402
+from benchmarks.bench_audio import synth_recording  # noqa: E402
+from benchmarks.bench_image import synth_photo  # noqa: E402
+from benchmarks.fakes import CountingFakeChatModel, FakeASR, FakeLatencyHistory  # noqa: E402
+from context import ContextWindow  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+TURNS = 12
+TOKEN_DELAY = 0.002  # 假模型每个token 2ms
+DB_LATENCY = 0.003  # 每次数据库往返 3ms
+ASR_DELAY = 0.002  # 假ASR每个字 2ms
+BUDGET = 600  # 较小的token预算，让长对话触发摘要
+
+#需要统计的LangChain运行（run_name）-> 报告中的阶段名
+STAGES = {
+    "load_history": "加载历史",
+    "summarize_messages": "摘要/窗口",
+    "fit_history": "摘要/窗口",
+    "ChatPromptTemplate": "提示词",
+    "insert_history": "写入历史",
+}
+STAGE_ORDER = ["ASR", "媒体编码", "加载历史", "摘要/窗口", "摘要模型", "提示词", "大模型首token", "大模型", "写入历史", "整轮"]
+SUMMARY_LLM = "summary_llm"
+
+
+class StageTimer(BaseCallbackHandler):
+    """按run_id记录各阶段的开始和结束时间，同一阶段在一轮内的耗时累加"""
+
+    run_inline = True  # 异步链中也在当前线程直接回调，计时不受线程池排队影响
+
+    def __init__(self):
+        self.turn: Dict[str, float] = defaultdict(float)
+        self._starts: Dict[Any, tuple] = {}
+        self._llm_first: Dict[Any, bool] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, name=None, **kwargs):
+        stage = STAGES.get(name or (serialized or {}).get("name"))
+        if stage:
+            self._starts[run_id] = (stage, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started:
+            self.turn[started[0]] += time.perf_counter() - started[1]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        #摘要模型的调用嵌套在"摘要/窗口"阶段内，单独计入"摘要模型"
+        summary = (serialized or {}).get("name") == SUMMARY_LLM
+        self._starts[run_id] = ("摘要模型" if summary else "大模型", time.perf_counter())
+        self._llm_first[run_id] = not summary
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if self._llm_first.pop(run_id, False):
+            self.turn["大模型首token"] += time.perf_counter() - self._starts[run_id][1]
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        self._llm_first.pop(run_id, None)
+        if started:
+            self.turn[started[0]] += time.perf_counter() - started[1]
+
+    def take(self) -> Dict[str, float]:
+        turn, self.turn = dict(self.turn), defaultdict(float)
+        return turn
+
+
+class Histories:
+    """按会话创建假历史记录，并汇总读写次数与字节数"""
+
+    def __init__(self):
+        self.items: Dict[str, FakeLatencyHistory] = {}
+
+    def __call__(self, session_id):
+        if session_id not in self.items:
+            self.items[session_id] = FakeLatencyHistory(DB_LATENCY, blob_store=get_blob_store())
+        return self.items[session_id]
+
+    def totals(self) -> Dict[str, int]:
+        return {key: sum(getattr(h, key) for h in self.items.values())
+                for key in ("reads", "writes", "bytes_read", "bytes_written")}
+
+
+class Pipeline:
+    """一条被测流水线：大模型、摘要模型、历史记录和各轮的阶段耗时"""
+
+    def __init__(self, name):
+        self.name = name
+        self.llm = CountingFakeChatModel(token_delay=TOKEN_DELAY)
+        self.summary_llm = CountingFakeChatModel(token_delay=TOKEN_DELAY, name=SUMMARY_LLM)
+        self.summarizer = RollingSummarizer(self.summary_llm)
+        self.window = ContextWindow(budget=BUDGET, summary_reserve=150)
+        self.histories = Histories()
+        self.timer = StageTimer()
+        self.turns: List[Dict[str, float]] = []
+        self.media_bytes = 0
+
+    async def stream(self, chain, inputs, session_id, extra=None):
+        config = {"configurable": {"session_id": session_id}, "callbacks": [self.timer]}
+        start = time.perf_counter()
+        async for _ in chain.astream({**inputs, "config": config} if "input" in inputs else inputs, config=config):
+            pass
+        turn = self.timer.take()
+        turn.update(extra or {})
+        turn["整轮"] = time.perf_counter() - start + sum((extra or {}).values())
+        self.turns.append(turn)
+
+    def report(self) -> Dict[str, Any]:
+        stages = {}
+        for stage in STAGE_ORDER:
+            values = [turn.get(stage, 0.0) for turn in self.turns]
+            if any(values):
+                stages[stage] = {"p50": statistics.median(values), "mean": statistics.fmean(values),
+                                 "max": max(values)}
+        return {
+            "stages": stages,
+            "llm_calls": self.llm.calls,
+            "summary_calls": self.summary_llm.calls,
+            "input_tokens": self.llm.input_tokens + self.summary_llm.input_tokens,
+            "output_tokens": self.llm.output_tokens + self.summary_llm.output_tokens,
+            "llm_bytes": self.llm.input_bytes + self.summary_llm.input_bytes,
+            "media_bytes": self.media_bytes,
+            **{f"db_{key}": value for key, value in self.histories.totals().items()},
+        }
+
+
+async def run_text(workdir: Path) -> Dict[str, Any]:
+    """语音前端的一轮：ASR识别录音，再把文字交给final_chain"""
+    from main import build_final_chain
+    pipeline = Pipeline("text")
+    chain = build_final_chain(pipeline.llm, pipeline.histories, pipeline.summarizer, window=pipeline.window)
+    asr = FakeASR(text="请详细介绍一下今天讨论的这个话题，并给出三个要点。", delta_delay=ASR_DELAY)
+    for turn in range(TURNS):
+        audio = workdir / f"text_{turn}.wav"
+        synth_recording(audio, 16000, 1, 1.0 + turn * 0.05, 0.1)
+        start = time.perf_counter()
+        async for text in astream_transcript(str(audio), backend=asr):
+            pass
+        asr_time = time.perf_counter() - start
+        await pipeline.stream(chain, {"input": f"第{turn}轮：{text}"}, "text", {"ASR": asr_time})
+    return pipeline.report()
+
+
+async def run_multimodal(workdir: Path) -> Dict[str, Any]:
+    """多模态前端的一轮：图片和录音并行编码，连同文字一起交给chain_history"""
+    from main import build_multimodal_chain
+    from media import prepare_media_parts
+    pipeline = Pipeline("multimodal")
+    chain = build_multimodal_chain(pipeline.llm, pipeline.histories, pipeline.summarizer, window=pipeline.window)
+    for turn in range(TURNS):
+        image, audio = workdir / f"mm_{turn}.jpg", workdir / f"mm_{turn}.wav"
+        synth_photo(image, (1600 + turn, 1200), "JPEG")
+        synth_recording(audio, 44100, 2, 1.0 + turn * 0.05, 0.2)
+        start = time.perf_counter()
+        parts = await prepare_media_parts([str(image), str(audio)])
+        encode_time = time.perf_counter() - start
+        pipeline.media_bytes += sum(len(json.dumps(part)) for part in parts)
+        message = HumanMessage([{"type": "text", "text": f"第{turn}轮：图片和录音里分别有什么？"}, *parts])
+        await pipeline.stream(chain, {"messages": [message]}, "multimodal", {"媒体编码": encode_time})
+    return pipeline.report()
+
+
+def print_report(name: str, result: Dict[str, Any]) -> None:
+    print(f"\n== {name}（{TURNS}轮）==")
+    for stage, values in result["stages"].items():
+        print(f"  {stage:<10} p50={values['p50'] * 1000:>8.1f}ms  平均={values['mean'] * 1000:>8.1f}ms  "
+              f"最大={values['max'] * 1000:>8.1f}ms")
+    print(f"  大模型调用={result['llm_calls']}  摘要调用={result['summary_calls']}  "
+          f"输入token={result['input_tokens']}  输出token={result['output_tokens']}")
+    print(f"  发给大模型={result['llm_bytes'] / 1024:.1f}KB  媒体片段={result['media_bytes'] / 1024:.1f}KB  "
+          f"数据库读={result['db_reads']}次/{result['db_bytes_read'] / 1024:.1f}KB  "
+          f"写={result['db_writes']}次/{result['db_bytes_written'] / 1024:.1f}KB")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """对比基线：阶段p50和各项计数超出容差的列为回归（耗时另加2ms绝对容差，避免计时抖动）"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for stage, values in result["stages"].items():
+            old = base["stages"].get(stage)
+            if old and values["p50"] > old["p50"] * (1 + tolerance) + 0.002:
+                regressions.append(f"{name}/{stage}: p50 {old['p50'] * 1000:.1f}ms -> {values['p50'] * 1000:.1f}ms")
+        for key, value in result.items():
+            if key != "stages" and key in base and value > base[key] * (1 + tolerance):
+                regressions.append(f"{name}/{key}: {base[key]} -> {value}")
+    return regressions
+
+
+class StackSampler:
+    """简单的采样分析器：定时抓取主线程调用栈，统计折叠格式（frame;frame;frame 次数）"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._target = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+async def run_all() -> Dict[str, Any]:
+    workdir = Path(_tmp)
+    return {"text": await run_text(workdir), "multimodal": await run_multimodal(workdir)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="完整对话流水线基准")
+    parser.add_argument("--json", help="把结果保存为JSON（可作为基线）")
+    parser.add_argument("--baseline", help="与之前保存的基线比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="回归容差，默认20%%")
+    parser.add_argument("--profile", help="保存cProfile结果到该文件")
+    parser.add_argument("--folded", help="保存采样调用栈（折叠格式）到该文件")
+    args = parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    sampler = StackSampler() if args.folded else None
+    if profiler:
+        profiler.enable()
+    if sampler:
+        sampler.__enter__()
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        if sampler:
+            sampler.__exit__(None, None, None)
+            sampler.save(args.folded)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    for name, result in results.items():
+        print_report(name, result)
+    if profiler:
+        print(f"\ncProfile已保存到{args.profile}，累计耗时最多的函数：")
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(15)
+    if sampler:
+        print(f"\n采样调用栈已保存到{args.folded}（{sum(sampler.counts.values())}个样本）")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        if regressions:
+            print("\n⚠️ 相对基线的回归：")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n与基线相比没有回归")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+多会话并发测试：大量模拟用户同时通过ChatApp.turn执行final_chain（本地假模型 + 带延迟的假数据库 + 内存摘要）
+统计：每个会话发给大模型的提示词里混入的其他会话消息（串话）、写入的历史是否按一问一答交替、
+同一会话的两个标签页同时发送时读到过期历史的会话数（有会话锁 / 只用全局信号量），以及延迟与吞吐
+运行：python benchmarks/bench_sessions.py [--users 200]
+"""
+
+import argparse
+import asyncio
+import re
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel, FakeLatencyHistory, message_text  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+TURNS = 4
+TABS = 2
+TOKEN_DELAY = 0.002
+DB_LATENCY = 0.005
+TAG = re.compile(r"^\[(\w+)/")
+
+
+class SeenTurnsModel(CountingFakeChatModel):
+    """记录每次调用时提示词中已有的同会话轮数，以及混入的其他会话的消息数"""
+
+    seen: dict = {}
+    leaked: int = 0
+
+    def _reply(self, messages):
+        humans = [m for m in messages if isinstance(m, HumanMessage)]
+        user = TAG.match(message_text(humans[-1])).group(1)
+        tags = [TAG.match(message_text(m)) for m in humans[:-1]]
+        self.seen.setdefault(user, []).append(sum(1 for t in tags if t and t.group(1) == user))
+        self.leaked += sum(1 for t in tags if t and t.group(1) != user)
+        return super()._reply(messages)
+
+
+def build_app():
+    from main import ChatApp
+    histories = {}
+    llm = SeenTurnsModel(token_delay=TOKEN_DELAY, reply_chars=40, seen={})
+    app = ChatApp(llm=llm,
+                  get_session_history=lambda session_id: histories.setdefault(session_id, FakeLatencyHistory(DB_LATENCY)),
+                  summarizer=RollingSummarizer(CountingFakeChatModel()))
+    return app, llm, histories
+
+
+async def run(name: str, users: int, tabs: int, session_locks: bool = True):
+    from main import get_config
+    app, llm, histories = build_app()
+    chain = app.final_chain
+    latencies = []
+
+    @asynccontextmanager
+    async def admit(session_id):
+        if session_locks:
+            async with app.turn(session_id):
+                yield
+        else:
+            async with app.turn_semaphore:
+                yield
+
+    async def tab(user: str, index: int):
+        config = get_config(user)
+        for turn in range(TURNS):
+            start = time.perf_counter()
+            async with admit(user):
+                async for _ in chain.astream({"input": f"[{user}/{index}] 第{turn}轮问题", "config": config},
+                                             config=config):
+                    pass
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(tab(f"u{u}", t) for u in range(users) for t in range(tabs)))
+    elapsed = time.perf_counter() - start
+    if app.summary_worker is not None:
+        app.summary_worker.wait_idle()
+
+    #每轮应当看到同一会话之前的所有轮次：依次为0、1、2……
+    turns = TURNS * tabs
+    stale = sum(sorted(seen) != list(range(turns)) for seen in llm.seen.values())
+    broken = 0
+    for user in llm.seen:
+        messages = histories[user]._messages
+        #流式写入的回复是AIMessageChunk，按AIMessage计
+        roles = [HumanMessage if isinstance(m, HumanMessage) else AIMessage if isinstance(m, AIMessage) else None
+                 for m in messages]
+        broken += roles != [HumanMessage, AIMessage] * turns
+    print(f"{name:<22} 会话={users:<4} 标签页={tabs} p50={statistics.median(latencies) * 1000:7.1f}ms "
+          f"吞吐={len(latencies) / elapsed:7.1f}轮/秒 读到过期历史的会话={stale:<4} 历史错乱={broken} "
+          f"串话={llm.leaked} 排队={app.session_locks.waits}")
+    return stale, broken, llm.leaked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多会话并发测试")
+    parser.add_argument("--users", type=int, default=200, help="模拟的用户（会话）数")
+    args = parser.parse_args()
+
+    asyncio.run(run("每用户一个标签页", args.users, 1))
+    asyncio.run(run("两个标签页+会话锁", args.users // 4, TABS))
+    #对照：只有全局信号量时，同一会话两个标签页的对话轮交错，读到过期历史（正确性见tests/test_sessions.py）
+    asyncio.run(run("两个标签页+只有信号量", args.users // 4, TABS, session_locks=False))
@@ -0,0 +1,122 @@
+"""
+启动基准：冷启动时导入各入口模块的耗时，以及从进程启动到第一个请求返回的时间
+1、python -X importtime：导入main（以及安装了gradio时导入两个前端）的总耗时，列出最慢的模块
+2、首个请求：新进程中导入main、创建应用并处理一轮对话（大模型换成本地假模型，聊天记录使用内存后端），
+   分别记录导入、创建大模型客户端、组装处理链、首token和整轮完成的时间点
+每项在新的子进程中运行RUNS次取中位数
+运行：python benchmarks/bench_startup.py [--runs 5] [--top 15]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+#子进程中处理一轮对话：各阶段的时间点相对进程启动（由父进程传入的启动时刻）计算
+FIRST_REQUEST = r"""
+import asyncio, json, os, sys, time
+started = float(os.environ["BENCH_STARTED"])
+marks = {}
+def mark(name):
+    marks[name] = time.time() - started
+
+sys.path.insert(0, os.getcwd())
+import main
+mark("导入main")
+from benchmarks.fakes import CountingFakeChatModel
+
+#真实的大模型客户端只创建、不调用，计入首个请求的准备时间
+main.ChatApp().llm
+mark("创建大模型客户端")
+
+app = main.ChatApp(llm=CountingFakeChatModel(reply_chars=40))
+chain = app.final_chain
+mark("组装处理链")
+
+async def serve():
+    config = main.get_config("startup")
+    first = True
+    async for _ in chain.astream({"input": "你好", "config": config}, config=config):
+        if first:
+            mark("首token")
+            first = False
+asyncio.run(serve())
+mark("首个请求完成")
+print(json.dumps(marks, ensure_ascii=False))
+"""
+
+
+def child_env() -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench_startup_")
+    return {
+        **os.environ,
+        "HISTORY_BACKEND": "memory",
+        "SUMMARY_BACKGROUND": "false",
+        "BLOB_STORE_DIR": os.path.join(tmp, "blobs"),
+        "MEDIA_CACHE_DIR": "",
+        "LOG_LEVEL": "WARNING",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "sk-bench",
+        "PYTHONWARNINGS": "ignore",
+    }
+
+
+def importtime(code: str):
+    """运行python -X importtime，返回（墙钟耗时，各模块的累计导入耗时）"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        #每深一层缩进两个空格；只保留入口模块和它直接导入的模块，更深的子模块已计入其父模块
+        if len(name) - len(name.lstrip()) <= 3:
+            modules[name.strip()] = int(cumulative_us) / 1e6
+    return elapsed, modules
+
+
+def run_importtime(name: str, code: str, runs: int, top: int) -> None:
+    samples = [importtime(code) for _ in range(runs)]
+    elapsed = statistics.median(s[0] for s in samples)
+    modules = samples[len(samples) // 2][1]
+    print(f"== {name}：进程启动+导入 中位数={elapsed * 1000:.0f}ms ==")
+    for module, seconds in sorted(modules.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {seconds * 1000:>8.1f}ms  {module}")
+
+
+def run_first_request(runs: int) -> None:
+    samples = []
+    for _ in range(runs):
+        env = {**child_env(), "BENCH_STARTED": repr(time.time())}
+        result = subprocess.run([sys.executable, "-c", FIRST_REQUEST], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    print(f"== 从进程启动到首个请求（{runs}次中位数，时间点相对进程启动）==")
+    for name in samples[0]:
+        print(f"  {name:<10} {statistics.median(s[name] for s in samples) * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="冷启动基准")
+    parser.add_argument("--runs", type=int, default=5, help="每项运行的次数")
+    parser.add_argument("--top", type=int, default=15, help="列出最慢的模块数")
+    args = parser.parse_args()
+
+    run_importtime("import main", "import main", args.runs, args.top)
+    if importlib.util.find_spec("gradio") is not None:
+        #前端文件名带括号，用runpy按路径加载（__name__不是__main__，不会启动服务）
+        for frontend in ("frontend(only_audio).py", "frontend(multimodal).py"):
+            run_importtime(frontend, f"import runpy; runpy.run_path({frontend!r})", args.runs, args.top)
+    else:
+        print("未安装gradio，跳过前端的导入测试")
+    run_first_request(args.runs)
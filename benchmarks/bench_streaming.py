@@ -0,0 +1,60 @@
+"""
+流式输出基准：invoke 与 stream 的首token时间（TTFT）和总耗时
+使用本地假流式模型和内存历史记录
+运行：python benchmarks/bench_streaming.py
+"""
+
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.chat_history import InMemoryChatMessageHistory  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+TURNS = 10
+TOKEN_DELAY = 0.01  # 每个token 10ms
+
+
+def build_chain():
+    #main在导入时会创建OpenAI客户端，这里只用它的组装函数
+    from main import build_final_chain
+    llm = CountingFakeChatModel(token_delay=TOKEN_DELAY)
+    histories = {}
+    chain = build_final_chain(
+        llm,
+        lambda session_id: histories.setdefault(session_id, InMemoryChatMessageHistory()),
+        RollingSummarizer(CountingFakeChatModel()),
+    )
+    return chain, histories
+
+
+def run(mode):
+    chain, histories = build_chain()
+    config = {"configurable": {"session_id": mode}}
+    ttft, total = [], []
+    for turn in range(TURNS):
+        inputs = {"input": f"第{turn}轮：请详细介绍一下流式输出。", "config": config}
+        start = time.perf_counter()
+        if mode == "invoke":
+            chain.invoke(inputs, config=config)
+            ttft.append(time.perf_counter() - start)
+        else:
+            first = None
+            for _ in chain.stream(inputs, config=config):
+                if first is None:
+                    first = time.perf_counter() - start
+            ttft.append(first)
+        total.append(time.perf_counter() - start)
+    persisted = len(histories[mode].messages)
+    print(f"{mode:<7} 首token中位数={statistics.median(ttft) * 1000:7.1f}ms  "
+          f"总耗时中位数={statistics.median(total) * 1000:7.1f}ms  已保存消息={persisted}")
+
+
+if __name__ == "__main__":
+    run("invoke")
+    run("stream")
@@ -0,0 +1,67 @@
+"""
+摘要基准：200轮对话中，每轮全量重新摘要 vs 滚动增量摘要（每轮折叠 / 移出窗口的消息攒够summary_min_new_tokens个token再折叠）
+统计大模型调用次数与token数，以及每轮提示词中保留的原始消息条数和token数，使用本地假模型
+运行：python benchmarks/bench_summary.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder  # noqa: E402
+
+from benchmarks.fakes import CountingFakeChatModel  # noqa: E402
+from config import get_settings  # noqa: E402
+from context import get_context_window  # noqa: E402
+from summary import RollingSummarizer  # noqa: E402
+
+settings = get_settings()
+
+TURNS = 200
+K = 2
+
+
+def full_resummarize(llm, stored_messages, k):
+    """原实现：每轮把窗口之前的全部历史交给大模型重新摘要"""
+    if len(stored_messages) <= k:
+        return stored_messages[-k:], None
+    summarization_prompt = ChatPromptTemplate.from_messages([
+        ("system", "请将下列历史对话压缩为一条保留关键消息的摘要信息，不丢失信息密度"),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "请生成包含上述对话核心内容的摘要，保留重要事实和决策。")
+    ])
+    summary_message = (summarization_prompt | llm).invoke({"chat_history": stored_messages[:-k]})
+    return stored_messages[-k:], summary_message.content
+
+
+def run(name, summarize):
+    llm = CountingFakeChatModel()
+    history = []
+    kept = []
+    start = time.perf_counter()
+    for turn in range(TURNS):
+        #与final_chain一致：先对已存储的历史做摘要，回答后再写入本轮的一问一答
+        recent, _ = summarize(llm, history)
+        kept.append((len(recent), get_context_window().counter.count_messages(recent)))
+        history.append(HumanMessage(f"第{turn}轮：请记住数字{turn * 7}，并解释它的含义。"))
+        history.append(AIMessage(f"好的，我记住了数字{turn * 7}。这是第{turn}轮的回答。"))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} 调用次数={llm.calls:<5} 输入token={llm.input_tokens:<9} "
+          f"输出token={llm.output_tokens:<7} 保留消息最多={max(n for n, _ in kept)}条/{max(t for _, t in kept)}token 耗时={elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    run("全量摘要", lambda llm, h: full_resummarize(llm, h, K))
+    summarizers = {}
+
+    def rolling(min_new_tokens=None):
+        def summarize(llm, history):
+            summarizer = summarizers.setdefault(id(llm), RollingSummarizer(llm, min_new_tokens=min_new_tokens))
+            return summarizer.summarize("bench", history, K)
+        return summarize
+
+    run("滚动/每轮", rolling(1))
+    run(f"滚动/攒{settings.summary_min_new_tokens}token", rolling())
@@ -0,0 +1,174 @@
+"""
+实时语音基准：合成的录音（几句话，句间停顿，夹一声咳嗽）写成WAV，按浏览器的节奏每0.25秒送一块给StreamingTranscriber
+识别用本地假ASR（逐字返回并模拟识别延迟），比较：
+1、录完再识别（原来的audio_input.change）：整段录音结束后才开始识别，第一句话要等到最后
+2、实时语音：每句话说完（静音vad_end_ms）就识别并可以提交
+统计切出的句子数、边界与真实句子的偏差、识别中文字的更新次数；另测一段底噪较大的录音（自适应阈值）
+切句和提交的正确性见tests/test_vad.py
+运行：python benchmarks/bench_vad.py [--speed 1.0]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fakes import FakeASR  # noqa: E402
+from config import get_settings  # noqa: E402
+
+settings = get_settings()
+
+RATE = 48000  # 浏览器麦克风常见的采样率
+CHUNK = 0.25
+SENTENCES = (2.4, 1.6, 3.0, 2.0, 2.6)  # 每句话的时长（秒）
+PAUSE = 1.4
+ASR_DELTA_DELAY = 0.05  # 假ASR逐字返回的间隔，一句话约0.6秒识别完
+
+
+def synth(path: Path, noise_db: float = -60.0, seed: int = 0):
+    """
+    合成录音并写成48kHz立体声16位WAV，返回每句话的(开始, 结束)秒数
+    每句话由0.2秒的“音节”（调幅的谐波）和音节间0.06秒的短停顿组成；第二个停顿加长，中间有一声0.1秒的咳嗽
+    """
+    rng = np.random.default_rng(seed)
+    noise = 10 ** (noise_db / 20)
+    pieces, spans, t = [rng.standard_normal(int(RATE * PAUSE)) * noise], [], PAUSE
+    for index, seconds in enumerate(SENTENCES):
+        n = int(RATE * seconds)
+        x = np.arange(n) / RATE
+        syllable = (x % 0.26) < 0.2
+        pitch = 180 + 40 * np.sin(2 * np.pi * 0.5 * x)
+        voice = sum(np.sin(2 * np.pi * k * pitch * x) / k for k in (1, 2, 3)) * 0.15
+        envelope = np.where(syllable, 0.6 + 0.4 * np.sin(2 * np.pi * 4 * x), 0.0)
+        pieces.append(voice * envelope + rng.standard_normal(n) * noise)
+        spans.append((t, t + seconds))
+        t += seconds
+        #咳嗽前后的静音都超过vad_end_ms，咳嗽单独成段，应因太短被丢弃
+        gap = PAUSE if index != 1 else 2 * PAUSE
+        pause = rng.standard_normal(int(RATE * gap)) * noise
+        if index == 1:
+            cough = slice(int(RATE * (gap / 2 - 0.05)), int(RATE * (gap / 2 + 0.05)))
+            pause[cough] += rng.standard_normal(cough.stop - cough.start) * 0.3
+        pieces.append(pause)
+        t += gap
+    mono = np.clip(np.concatenate(pieces), -1, 1)
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes((np.repeat(mono[:, None], 2, axis=1) * 32767).astype("<i2").tobytes())
+    return spans, len(mono) / RATE
+
+
+def read_chunks(path: Path):
+    """像浏览器一样每CHUNK秒发送一块(采样率, int16数组[帧数, 声道数])"""
+    with wave.open(str(path)) as wav:
+        rate, channels = wav.getframerate(), wav.getnchannels()
+        frames = int(rate * CHUNK)
+        while True:
+            raw = wav.readframes(frames)
+            if not raw:
+                return
+            yield rate, np.frombuffer(raw, "<i2").reshape(-1, channels)
+
+
+class TimedASR(FakeASR):
+    """记录每次识别收到的片段（开始识别时刻、时长）"""
+
+    def __init__(self):
+        super().__init__(delta_delay=ASR_DELTA_DELAY)
+        self.segments = []
+
+    def stream(self, audio_path: str):
+        with wave.open(audio_path) as wav:
+            self.segments.append(wav.getnframes() / wav.getframerate())
+        yield from super().stream(audio_path)
+
+    def transcribe(self, audio_path: str) -> str:
+        return "".join(self.stream(audio_path))
+
+
+async def batch(path: Path, total: float, speed: float):
+    """录完再识别：等整段录音结束，再识别整个文件"""
+    from asr import astream_transcript
+    from media_cache import get_media_cache
+    get_media_cache()._memory.clear()
+    start = time.perf_counter()
+    await asyncio.sleep(total / speed)
+    text = ""
+    async for text in astream_transcript(str(path), backend=TimedASR()):
+        pass
+    return time.perf_counter() - start
+
+
+async def live(path: Path, speed: float):
+    """实时语音：按节奏送入音频块，记录每句话可提交的时刻和识别中文字的变化"""
+    from vad import StreamingTranscriber
+    asr = TimedASR()
+    transcriber = StreamingTranscriber(backend=asr)
+    ready_at, partials, boundaries = [], [], []
+    start = time.perf_counter()
+    clock = 0.0
+
+    def poll():
+        #界面每收到一块音频刷新一次输入框：记录识别中的文字发生变化的次数
+        if transcriber.partial and transcriber.partial != (partials[-1] if partials else None):
+            partials.append(transcriber.partial)
+        for _ in transcriber.take_ready():
+            ready_at.append(time.perf_counter() - start)
+        #模拟回答立即结束，之后的句子可以继续提交
+        transcriber.submitting = False
+
+    for rate, data in read_chunks(path):
+        before = transcriber.utterances
+        transcriber.feed(rate, data)
+        clock += len(data) / rate
+        if transcriber.utterances > before:
+            boundaries.append(clock)
+        poll()
+        #按真实时间送下一块；等待期间后台任务在识别
+        await asyncio.sleep(max(0.0, clock / speed - (time.perf_counter() - start)))
+    for _ in await transcriber.finish():
+        ready_at.append(time.perf_counter() - start)
+    return transcriber, asr, ready_at, partials, boundaries
+
+
+async def run(speed: float):
+    with tempfile.TemporaryDirectory(prefix="bench_vad_") as tmp:
+        path = Path(tmp) / "recording.wav"
+        spans, total = synth(path)
+        batch_first = await batch(path, total, speed)
+        transcriber, asr, ready_at, partials, boundaries = await live(path, speed)
+
+        print(f"录音{total:.1f}秒，{len(spans)}句话 + 1声咳嗽，每{CHUNK}秒一块")
+        print(f"录完再识别：第一句在{batch_first:5.2f}s后才有文字（识别片段{len(SENTENCES)}句合为1段）")
+        delays = [ready - end / speed for ready, (_, end) in zip(ready_at, spans)]
+        for (s, e), ready, delay, seconds in zip(spans, ready_at, delays, asr.segments):
+            print(f"  句子 {s:5.2f}-{e:5.2f}s  片段时长={seconds:4.2f}s  可提交={ready:5.2f}s  说完后{delay:4.2f}s")
+        print(f"实时语音：第一句在{ready_at[0]:5.2f}s可提交，说完到可提交中位数={statistics.median(delays):.2f}s，"
+              f"识别中文字更新{len(partials)}次")
+        #片段 = 句子 + 开头的preroll + 结尾保留的静音；说完后的延迟 = 判定句末的静音 + 识别耗时 + 音频块间隔
+        extra = [seconds - (e - s) for seconds, (s, e) in zip(asr.segments, spans)]
+        print(f"切出{transcriber.utterances}句（真实{len(spans)}句，咳嗽应被丢弃），片段比句子长{min(extra):.2f}-{max(extra):.2f}s，"
+              f"第一句比录完再识别早{batch_first - ready_at[0]:.2f}s")
+
+        noisy = Path(tmp) / "noisy.wav"
+        spans, _ = synth(noisy, noise_db=-38.0, seed=1)
+        transcriber, *_ = await live(noisy, speed * 4)
+        print(f"底噪-38dB（高于固定阈值{settings.vad_threshold_db}dB）：切出{transcriber.utterances}句，"
+              f"自适应阈值={transcriber.vad.threshold():.1f}dB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="实时语音基准")
+    parser.add_argument("--speed", type=float, default=1.0, help="送入音频块的速度（相对实时的倍数）")
+    args = parser.parse_args()
+    asyncio.run(run(args.speed))
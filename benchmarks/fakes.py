@@ -0,0 +1,298 @@
+"""本地基准测试使用的假模型，不访问任何外部服务"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+import wave
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, message_to_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def approx_tokens(text: str) -> int:
+    """粗略估算token数：按UTF-8字节数/4"""
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def message_text(message: BaseMessage) -> str:
+    """取出消息中的文本部分（多模态内容只统计text）"""
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(part.get("text", "") for part in message.content if isinstance(part, dict))
+
+
+class CountingFakeChatModel(BaseChatModel):
+    """确定性的假聊天模型：回复输入的截断回显，并统计调用次数和token数；token_delay模拟逐token生成耗时"""
+
+    reply_chars: int = 200
+    token_delay: float = 0.0
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    input_bytes: int = 0  # 请求体中消息内容的字节数（含base64媒体）
+
+    @property
+    def _llm_type(self) -> str:
+        return "counting-fake"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        text = "\n".join(message_text(m) for m in messages)
+        self.calls += 1
+        self.input_tokens += approx_tokens(text)
+        self.input_bytes += sum(len(json.dumps(m.content, ensure_ascii=False).encode("utf-8")) for m in messages)
+        reply = text[-self.reply_chars:]
+        self.output_tokens += approx_tokens(reply)
+        return reply
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        reply = self._reply(messages)
+        time.sleep(self.token_delay * len(self._chunks(reply)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for piece in self._chunks(self._reply(messages)):
+            time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        reply = self._reply(messages)
+        await asyncio.sleep(self.token_delay * len(self._chunks(reply)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for piece in self._chunks(self._reply(messages)):
+            await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _chunks(text: str, size: int = 4) -> List[str]:
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def reset(self) -> None:
+        self.calls = self.input_tokens = self.output_tokens = self.input_bytes = 0
+
+
+class FakeLatencyHistory(BaseChatMessageHistory):
+    """内存中的聊天记录，每次读写模拟一次数据库往返延迟"""
+
+    def __init__(self, latency: float = 0.0, blob_store=None):
+        self._messages: List[BaseMessage] = []
+        self.latency = latency
+        self.blob_store = blob_store  # 与PooledPostgresChatMessageHistory一样，写入前把媒体移到blob存储
+        self.reads = self.writes = 0
+        self.bytes_read = self.bytes_written = 0  # 按message_to_dict的JSON计算，与message表中的行一致
+
+    @staticmethod
+    def _size(messages: Sequence[BaseMessage]) -> int:
+        return sum(len(json.dumps(message_to_dict(m)).encode("utf-8")) for m in messages)
+
+    def _read(self) -> List[BaseMessage]:
+        self.reads += 1
+        self.bytes_read += self._size(self._messages)
+        return list(self._messages)
+
+    def _write(self, messages: Sequence[BaseMessage]) -> None:
+        if self.blob_store is not None:
+            messages = self.blob_store.externalize_all(list(messages))
+        self.writes += 1
+        self.bytes_written += self._size(messages)
+        self._messages.extend(messages)
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        time.sleep(self.latency)
+        return self._read()
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        time.sleep(self.latency)
+        self._write(messages)
+
+    def clear(self) -> None:
+        self._messages = []
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        await asyncio.sleep(self.latency)
+        return self._read()
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        await asyncio.sleep(self.latency)
+        self._write(messages)
+
+
+class FakeASR:
+    """假ASR后端：忽略音频内容，按固定文本逐字返回，并模拟识别延迟"""
+
+    def __init__(self, text: str = "你好，请介绍一下你自己。", delta_delay: float = 0.0):
+        self.text = text
+        self.delta_delay = delta_delay
+        self.calls = 0
+
+    def transcribe(self, audio_path: str) -> str:
+        self.calls += 1
+        time.sleep(self.delta_delay * len(self.text))
+        return self.text
+
+    def stream(self, audio_path: str) -> Iterator[str]:
+        self.calls += 1
+        for char in self.text:
+            time.sleep(self.delta_delay)
+            yield char
+
+
+class SegmentASR(FakeASR):
+    """记录每次收到的片段时长，以及片段末尾是否是静音（切点没有切在“词”中间）"""
+
+    def __init__(self):
+        super().__init__(text="段")
+        self.durations = []
+        self.clean_cuts = 0
+
+    def transcribe(self, audio_path: str) -> str:
+        with wave.open(audio_path) as wav:
+            rate = wav.getframerate()
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), "<i2").astype(np.float32) / 32768
+        self.durations.append(len(samples) / rate)
+        tail = samples[-rate // 100:]
+        self.clean_cuts += float(np.sqrt(np.mean(np.square(tail)))) < 0.05
+        return super().transcribe(audio_path)
+
+    def stream(self, audio_path: str) -> Iterator[str]:
+        yield self.transcribe(audio_path)
+
+
+def write_long_wav(path, seconds: float, rate: int = 44100, channels: int = 2,
+                   word: float = 1.2, pause: float = 0.3) -> None:
+    """逐块写入一段长录音：word秒的正弦波（“词”）与pause秒的底噪交替"""
+    rng = np.random.default_rng(0)
+    period = word + pause
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        block = 10 * rate
+        for start in range(0, int(seconds * rate), block):
+            t = (start + np.arange(min(block, int(seconds * rate) - start))) / rate
+            voiced = (t % period) < word
+            signal = np.where(voiced, 0.4 * np.sin(2 * np.pi * 220 * t), 0.001 * rng.standard_normal(len(t)))
+            frames = np.repeat(signal[:, None], channels, axis=1)
+            wav.writeframes((frames * 32767).astype("<i2").tobytes())
+
+
+class RateLimitError(Exception):
+    """模拟服务商返回的429：带status_code和Retry-After响应头，与openai/zai客户端的异常字段一致"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = type("Response", (), {"status_code": 429, "headers": {"retry-after": f"{retry_after:.3f}"}})()
+
+
+class MockProvider:
+    """
+    模拟服务商的限额：服务端令牌桶（每秒rate个请求、突发burst个）和同时处理的请求数上限，
+    超出时立即返回429；每个请求处理latency秒
+    """
+
+    def __init__(self, rate: float, burst: int, max_in_flight: int, latency: float = 0.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.requests = self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _admit(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.requests += 1
+            if self.tokens < 1 or self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                raise RateLimitError(max((1 - self.tokens) / self.rate, 0.0))
+            self.tokens -= 1
+            self.in_flight += 1
+
+    def _done(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def handle(self, work=None):
+        """同步处理一个请求"""
+        self._admit()
+        try:
+            time.sleep(self.latency)
+            return work() if work else None
+        finally:
+            self._done()
+
+    async def ahandle(self, work=None):
+        self._admit()
+        try:
+            await asyncio.sleep(self.latency)
+            return work() if work else None
+        finally:
+            self._done()
+
+
+class MockProviderChatModel(CountingFakeChatModel):
+    """每次调用先经过MockProvider的限额，超出时抛出429"""
+
+    provider: Any = None
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.provider.handle()
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.provider.handle()
+        yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await self.provider.ahandle()
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await self.provider.ahandle()
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
+
+
+class MockProviderEmbeddings(Embeddings):
+    """确定性的假向量模型：每次embed_documents算一次服务商请求，统计请求数和向量化的文本数"""
+
+    def __init__(self, provider: MockProvider, dim: int = 8):
+        self.provider = provider
+        self.dim = dim
+        self.calls = self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        return [float((hash(text) >> i) & 0xff) for i in range(self.dim)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return self.provider.handle(lambda: [self._vector(t) for t in texts])
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,186 @@
+"""媒体内容存储：消息中的base64媒体按内容摘要存成独立文件，聊天记录只保存引用"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+
+from config import get_settings, project_path
+from context import DEFAULT_PLACEHOLDER, MEDIA_PLACEHOLDERS
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+#引用格式：blob:<MIME类型>:<BLAKE2b摘要>，放在原来data URL的位置
+BLOB_SCHEME = "blob:"
+DATA_URL_PREFIX = "data:"
+DIGEST_SIZE = 20
+#摘要来自数据库中的消息，拼成文件路径之前必须是固定长度的小写十六进制
+DIGEST_PATTERN = re.compile(rf"[0-9a-f]{{{DIGEST_SIZE * 2}}}")
+
+
+class BlobNotFound(LookupError):
+    """blob引用的摘要不合法，或对应的文件不存在（被清理、在其他机器上）"""
+
+
+def is_blob_ref(url: str) -> bool:
+    return isinstance(url, str) and url.startswith(BLOB_SCHEME)
+
+
+def _parse_data_url(url: str) -> Optional[Tuple[str, str]]:
+    """拆出data URL的MIME类型和base64内容；不是base64 data URL时返回None"""
+    if not isinstance(url, str) or not url.startswith(DATA_URL_PREFIX):
+        return None
+    header, sep, data = url.partition(",")
+    if not sep or not header.endswith(";base64"):
+        return None
+    return header[len(DATA_URL_PREFIX):-len(";base64")], data
+
+
+def _part_url(part) -> Optional[str]:
+    """取出媒体片段中的url（image_url/audio_url/video_url）"""
+    if not isinstance(part, dict):
+        return None
+    body = part.get(part.get("type"))
+    if isinstance(body, dict):
+        return body.get("url")
+    return None
+
+
+def _urls(messages: List[BaseMessage]):
+    for message in messages:
+        if not isinstance(message.content, str):
+            yield from (_part_url(part) for part in message.content)
+
+
+def _with_url(part: dict, url: str) -> dict:
+    kind = part["type"]
+    return {**part, kind: {**part[kind], "url": url}}
+
+
+class BlobStore:
+    """
+    本地文件系统上的内容寻址存储（可替换为对象存储）：
+    1、按内容的BLAKE2b摘要命名，同一张图片/同一段录音只存一份
+    2、先写临时文件再重命名，并发写入同一内容时互不影响
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = project_path(root or settings.blob_store_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str) -> Path:
+        if not DIGEST_PATTERN.fullmatch(digest):
+            raise BlobNotFound(f"不合法的blob摘要：{digest[:64]!r}")
+        return self.root / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        """保存内容并返回摘要；已存在时不重复写入"""
+        digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """读取内容；摘要不合法或文件不存在时抛出BlobNotFound"""
+        try:
+            return self._path(digest).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFound(f"blob文件不存在：{digest}") from None
+
+    def locate(self, url: str) -> Optional[Tuple[Path, str]]:
+        """blob引用对应的（文件路径，MIME类型），不读取内容；不是blob引用、摘要不合法或文件不存在时返回None"""
+        if not is_blob_ref(url):
+            return None
+        mime, _, digest = url[len(BLOB_SCHEME):].rpartition(":")
+        try:
+            path = self._path(digest)
+        except BlobNotFound as e:
+            logger.warning("%s，按占位文字处理", e)
+            return None
+        if not path.exists():
+            logger.warning("blob文件不存在，按占位文字处理：%s", path)
+            return None
+        return path, mime
+
+    def externalize(self, message: BaseMessage) -> BaseMessage:
+        """把消息中媒体片段的base64 data URL存入blob，返回只含引用的消息副本；没有媒体时原样返回"""
+        if isinstance(message.content, str):
+            return message
+        content, changed = [], False
+        for part in message.content:
+            parsed = _parse_data_url(_part_url(part))
+            if parsed is None:
+                content.append(part)
+                continue
+            mime, data = parsed
+            digest = self.put(base64.b64decode(data))
+            content.append(_with_url(part, f"{BLOB_SCHEME}{mime}:{digest}"))
+            changed = True
+        return message.model_copy(update={"content": content}) if changed else message
+
+    def resolve(self, message: BaseMessage) -> BaseMessage:
+        """
+        把消息中的blob引用还原为data URL，只在本轮确实要重新发送媒体时调用
+        引用的文件不存在或摘要不合法时换成占位文字（与strip_media一致），不影响这个会话之后的每一轮
+        """
+        if isinstance(message.content, str):
+            return message
+        content, changed = [], False
+        for part in message.content:
+            url = _part_url(part)
+            if not is_blob_ref(url):
+                content.append(part)
+                continue
+            mime, _, digest = url[len(BLOB_SCHEME):].rpartition(":")
+            try:
+                data = base64.b64encode(self.get(digest)).decode("ascii")
+            except BlobNotFound as e:
+                logger.warning("%s，按占位文字发送", e)
+                content.append({"type": "text", "text": MEDIA_PLACEHOLDERS.get(part.get("type"), DEFAULT_PLACEHOLDER)})
+            else:
+                content.append(_with_url(part, f"{DATA_URL_PREFIX}{mime};base64,{data}"))
+            changed = True
+        return message.model_copy(update={"content": content}) if changed else message
+
+    def externalize_all(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        return [self.externalize(m) for m in messages]
+
+    def resolve_all(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        return [self.resolve(m) for m in messages]
+
+    async def aexternalize_all(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """异步路径：有媒体时在线程中读写文件，不阻塞事件循环"""
+        if not any(isinstance(url, str) and url.startswith(DATA_URL_PREFIX) for url in _urls(messages)):
+            return list(messages)
+        return await asyncio.to_thread(self.externalize_all, messages)
+
+    async def aresolve_all(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        if not any(is_blob_ref(url) for url in _urls(messages)):
+            return list(messages)
+        return await asyncio.to_thread(self.resolve_all, messages)
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """获取进程内共享的媒体内容存储"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+    return _store
@@ -1,20 +1,17 @@
 """配置管理模块"""
 
+import logging
 import os
 from pathlib import Path
 from typing import List
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
-from psycopg2 import connect
 
-# 加载环境变量
-# 首先尝试加载当前目录的.env
+# 加载环境变量：只加载当前目录的.env，导入时不再探测其他项目的目录
+# 需要额外的.env时通过EXTRA_ENV_FILE指定（不覆盖已有的环境变量）
 load_dotenv()
-
-# 然后尝试加载HelloAgents的.env(如果存在)
-helloagents_env = Path(__file__).parent.parent.parent.parent / "HelloAgents" / ".env"
-if helloagents_env.exists():
-    load_dotenv(helloagents_env, override=False)  # 不覆盖已有的环境变量
+if os.getenv("EXTRA_ENV_FILE"):
+    load_dotenv(os.environ["EXTRA_ENV_FILE"], override=False)
 
 
 class Settings(BaseSettings):
@@ -41,6 +38,25 @@ class Settings(BaseSettings):
 
     #智谱配置
     zai_api_key : str = ""
+    asr_model: str = "glm-asr"
+    asr_streaming: bool = True  # 流式识别：边识别边把文字填入输入框
+    asr_timeout: float = 60.0
+    asr_max_connections: int = 10  # 共享客户端的长连接池大小
+    asr_keepalive_expiry: float = 60.0  # 空闲长连接保留的秒数
+    asr_chunk_seconds: float = 25.0  # glm-asr单次最多识别30秒，更长的录音按该时长分段识别
+    asr_cut_search_seconds: float = 2.0  # 分段时在每段末尾这么长的范围内找最安静的位置切开
+
+    # 实时语音配置：麦克风音频块边到达边做语音活动检测，说完一句立即识别并自动发送
+    vad_frame_ms: int = 30  # 能量检测的帧长
+    vad_threshold_db: float = -45.0  # 语音能量阈值的下限(dBFS)
+    vad_noise_margin_db: float = 10.0  # 比背景噪声高出这么多dB才算语音
+    vad_noise_window_ms: int = 2000  # 背景噪声取这段时间内最安静一帧的能量
+    vad_start_ms: int = 90  # 连续这么长的语音才算开始说话
+    vad_end_ms: int = 700  # 连续这么长的静音算一句话结束
+    vad_preroll_ms: int = 300  # 每句话开头往前多保留的音频
+    vad_min_utterance_ms: int = 250  # 语音部分短于该时长的片段（咳嗽、敲击）丢弃
+    vad_stream_every: float = 0.25  # 浏览器发送音频块的间隔秒数
+    vad_time_limit: int = 600  # 一次实时语音的最长秒数
 
     #千问配置
     dashscope_api_key : str = ""
@@ -52,9 +68,112 @@ class Settings(BaseSettings):
     openai_base_url: str = "https://api.openai.com/v1"
     openai_model: str = "gpt-4"
 
+    # 音频预处理配置：上传前混为单声道、重采样、去掉首尾静音
+    audio_preprocess: bool = True
+    audio_target_rate: int = 16000  # 全模态大模型的音频采样率
+    asr_sample_rate: int = 16000  # ASR的音频采样率
+    audio_codec: str = "wav"  # wav/flac/mp3/opus，压缩编码需要安装ffmpeg
+    audio_silence_threshold_db: float = -40.0  # 低于该能量(dBFS)视为静音
+    audio_silence_padding: float = 0.2  # 去静音后两端保留的秒数
+
+    # 图片预处理配置：按"detail: low"的像素预算缩放后重新编码
+    image_max_edge: int = 512  # 长边像素上限
+    image_format: str = "JPEG"  # 重新编码的格式：JPEG/WEBP/PNG
+    image_quality: int = 80
+    image_passthrough_bytes: int = 200_000  # 不超过该字节数且尺寸合格的图片原样上传
+
+    # 媒体缓存配置：按文件内容缓存编码结果和识别结果
+    media_cache_memory_bytes: int = 64 * 1024 * 1024  # 内存LRU容量
+    media_cache_dir: str = ""  # 磁盘缓存目录（相对路径按项目根目录解析），为空时不启用
+    media_cache_disk_bytes: int = 1024 * 1024 * 1024  # 磁盘缓存容量
+    blob_store_dir: str = "media_blobs"  # 聊天记录中媒体内容的存储目录（相对路径按项目根目录解析），数据库只保存引用
+
+    # 媒体并行编码配置
+    media_process_workers: int = 2  # 图片编码进程池大小
+    media_thread_workers: int = 4  # 文件读取/音频处理线程池大小
+    media_timeout: float = 20.0  # 单条消息媒体编码的超时秒数，超时的文件直接发送原文件
+    media_long_timeout: float = 300.0  # 视频和长录音（需要抽帧、分段识别）的处理超时秒数
+
+    # 大文件配置：读取、base64编码、音频解码都按块流式进行，内存占用与文件大小无关
+    media_max_upload_bytes: int = 512 * 1024 * 1024  # 超过该大小的上传文件直接拒绝
+    media_max_payload_bytes: int = 10 * 1024 * 1024  # 发给大模型的单个媒体片段（base64后）的字节数上限
+    media_read_chunk_bytes: int = 3 * 256 * 1024  # 流式读取和base64编码的块大小
+    media_max_audio_seconds: float = 180.0  # 超过该时长的录音先分段识别为文字，再发给大模型
+    video_keyframes: int = 4  # 每个视频均匀抽取的关键帧数，连同音轨一起发给大模型（需要ffmpeg）
+
+    # 上下文窗口配置：按token预算保留最近的消息，超出预算的部分才折叠进摘要
+    context_token_budget: int = 4000  # 历史消息的token预算
+    context_summary_reserve: int = 500  # 需要摘要时为摘要文本预留的token数
+    context_media_tokens: int = 256  # 每个图片/音频片段按该token数计
+    context_keep_media_messages: int = 2  # 最近几条消息保留原始媒体，更早的替换为占位文字
+    context_encoding: str = "cl100k_base"  # tiktoken编码，加载失败时按字节数估算
+    context_token_cache_size: int = 4096  # 单条消息token数的缓存条目数
+
+    # 聊天记录后端：memory（仅内存）/postgres（每轮读写数据库，默认）/tiered（热会话在内存，写回Postgres）
+    history_backend: str = "postgres"
+    history_max_sessions: int = 1000  # 内存中最多保留的会话数，超出时淘汰最久未访问的
+    history_session_ttl: float = 1800.0  # 会话空闲超过该秒数后从内存淘汰，0表示不按时间淘汰
+    history_max_messages: int = 200  # 每个会话在内存中最多保留的消息条数
+    history_flush_interval: float = 1.0  # tiered模式下批量写回数据库的间隔秒数
+    history_page_size: int = 50  # 打开页面时回放到界面的历史消息条数，向上翻页时每次再加载这么多条
+
+    # 摘要配置：后台线程在每轮写入后更新摘要，回答前只读取已完成的摘要
+    summary_background: bool = True  # False时在回答前同步摘要
+    summary_workers: int = 2  # 后台摘要线程数
+    #移出窗口、还没折叠的消息攒够这么多token才折叠进摘要，不足时暂时留在上下文中，占用context_summary_reserve的一部分；
+    #应小于context_summary_reserve减去摘要本身的长度，否则提示词可能超出context_token_budget
+    summary_min_new_tokens: int = 200
+
+    # 回答缓存配置：摘要相同时，相同/相近的问题直接返回缓存的回答
+    response_cache_enabled: bool = False  # 开启后重复的问题直接返回缓存的回答，会改变回答的行为，默认关闭
+    response_cache_shared: bool = False  # 是否在不同会话/用户之间共享缓存的回答，关闭时只在同一会话内复用
+    response_cache_ttl: float = 3600.0  # 缓存条目的有效秒数，0表示不过期
+    response_cache_max_entries: int = 2000  # 超出时淘汰最久未用的条目
+    response_cache_embedding: str = ""  # 相似匹配的向量模型：空为只做精确匹配，hashing为本地向量，其余为OpenAI向量模型名
+    response_cache_threshold: float = 0.92  # 相似匹配的余弦相似度下限
+
+    # 长期记忆配置：移出窗口的消息建立向量索引，每轮取回与问题最相关的几条（需要向量模型，默认关闭）
+    memory_enabled: bool = False
+    memory_embedding: str = "text-embedding-3-small"  # 向量模型：hashing为本地向量，其余为OpenAI向量模型名
+    memory_store: str = "local"  # local（进程内NumPy索引）/pgvector（Postgres + pgvector扩展）
+    memory_top_k: int = 4  # 每轮最多取回的消息条数
+    memory_min_score: float = 0.2  # 取回消息的余弦相似度下限
+    memory_batch_size: int = 32  # 每次向量化的消息条数
+    memory_max_chars: int = 300  # 取回的每条消息最多保留的字数
+
+    # 并发配置：异步路径中同时进行的对话轮数上限
+    max_concurrent_turns: int = 32
+
+    # 外部调用调度：按服务商限制每秒请求数（令牌桶，0表示不限）和同时进行的请求数（0表示不限），
+    # 排队时回答优先于后台摘要；429/5xx/超时按带抖动的指数退避重试（客户端自带的重试随之关闭）
+    outbound_enabled: bool = True
+    openai_rate_limit: float = 8.0
+    openai_burst: int = 16
+    openai_max_in_flight: int = 16
+    dashscope_rate_limit: float = 5.0
+    dashscope_burst: int = 10
+    dashscope_max_in_flight: int = 8
+    zhipu_rate_limit: float = 5.0  # 智谱ASR
+    zhipu_burst: int = 5
+    zhipu_max_in_flight: int = 4
+    embeddings_rate_limit: float = 20.0  # OpenAI向量模型（回答缓存、长期记忆）
+    embeddings_burst: int = 20
+    embeddings_max_in_flight: int = 8
+    outbound_max_retries: int = 4
+    outbound_backoff_base: float = 0.5  # 第n次重试前最多等待base*2^n秒（在0到该值之间随机）
+    outbound_backoff_max: float = 20.0
+    embedding_batch_size: int = 64  # 向量化微批的最大条数
+    embedding_batch_wait: float = 0.005  # 凑批最多等待的秒数
+
     # 日志配置
     log_level: str = "INFO"
 
+    # 监控指标配置：与Gradio应用并列的Prometheus文本格式端点
+    metrics_enabled: bool = True
+    metrics_host: str = "127.0.0.1"  # 默认只在本机提供；需要由其他机器抓取时改为0.0.0.0
+    metrics_port: int = 9100
+    metrics_run_ttl: float = 900.0  # 开始后超过这么多秒仍未结束的运行（流被取消等）不再等待结束回调，直接丢弃
+
     #postgres配置
     postgres_myusername: str = "postgres"
     postgres_mypassword: str = "111111"
@@ -62,6 +181,12 @@ class Settings(BaseSettings):
     postgres_port: str = "5432"
     postgres_mydatabase: str = "postgres"
 
+    #postgres连接池配置
+    pg_pool_min_size: int = 1
+    pg_pool_max_size: int = 10
+    pg_pool_timeout: float = 30.0  # 池满时等待连接的秒数
+    pg_pool_health_check_interval: float = 30.0  # 连接空闲超过该秒数后借出前先做健康检查
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -81,6 +206,23 @@ def get_settings() -> Settings:
     return settings
 
 
+# 项目根目录：配置中的相对路径都相对于这里，与启动进程时的工作目录无关
+PROJECT_DIR = Path(__file__).resolve().parent
+
+
+def project_path(path: str) -> Path:
+    """配置中的目录 -> 绝对路径（相对路径按项目根目录解析）"""
+    return PROJECT_DIR / Path(path).expanduser()
+
+
+def setup_logging(level: str = None) -> None:
+    """按Settings.log_level配置日志格式和级别，DEBUG时输出每轮的详细信息"""
+    logging.basicConfig(
+        level=(level or settings.log_level).upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
 # 验证必要的配置
 def validate_config():
     """验证配置是否完整"""
@@ -0,0 +1,213 @@
+"""上下文窗口模块：按token预算挑选保留的最近消息，更早消息中的内联媒体替换为占位文字"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage
+
+from config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+#旧消息中的媒体片段替换成的占位文字
+MEDIA_PLACEHOLDERS = {
+    "image_url": "[图片]",
+    "audio_url": "[音频]",
+    "input_audio": "[音频]",
+    "video_url": "[视频]",
+}
+DEFAULT_PLACEHOLDER = "[文件]"
+
+#文本中直接粘贴的data URL（base64内容）
+DATA_URL_PATTERN = re.compile(r"data:[\w.+-]+/[\w.+-]+;base64,[A-Za-z0-9+/=]+")
+
+#每条消息除内容外的固定开销（角色、分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _is_media_part(part) -> bool:
+    return isinstance(part, dict) and part.get("type") != "text"
+
+
+def has_media_text(text: str) -> bool:
+    return "base64," in text and DATA_URL_PATTERN.search(text) is not None
+
+
+def has_media(message: BaseMessage) -> bool:
+    """消息中是否含有媒体片段或内联的data URL"""
+    if isinstance(message.content, str):
+        return has_media_text(message.content)
+    return any(_is_media_part(part) or has_media_text(part.get("text", "") if isinstance(part, dict) else part)
+               for part in message.content)
+
+
+def _strip_text(text: str) -> str:
+    return DATA_URL_PATTERN.sub(DEFAULT_PLACEHOLDER, text) if has_media_text(text) else text
+
+
+def strip_media(message: BaseMessage) -> BaseMessage:
+    """返回把媒体片段和内联data URL换成占位文字的消息副本；没有媒体时原样返回"""
+    if not has_media(message):
+        return message
+    if isinstance(message.content, str):
+        return message.model_copy(update={"content": _strip_text(message.content)})
+    content = []
+    for part in message.content:
+        if _is_media_part(part):
+            content.append({"type": "text", "text": MEDIA_PLACEHOLDERS.get(part.get("type"), DEFAULT_PLACEHOLDER)})
+        elif isinstance(part, dict):
+            content.append({**part, "text": _strip_text(part.get("text", ""))})
+        else:
+            content.append(_strip_text(part))
+    return message.model_copy(update={"content": content})
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(name: str):
+    """加载tiktoken编码；未安装或离线无法下载编码文件时返回None，改为按字节数估算"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning("无法加载tiktoken编码%s（%s），按字节数估算token", name, type(e).__name__)
+        return None
+
+
+class TokenCounter:
+    """
+    统计消息的token数：
+    1、文本用tiktoken编码计数（不可用时按UTF-8字节数/4估算）
+    2、图片/音频等媒体片段按固定的media_tokens计
+    3、按消息内容的摘要缓存结果，同一条历史消息每轮重新加载后不必重新编码
+    """
+
+    def __init__(self, encoding: Optional[str] = None, media_tokens: Optional[int] = None,
+                 cache_size: Optional[int] = None):
+        self.encoding_name = encoding or settings.context_encoding
+        self.media_tokens = settings.context_media_tokens if media_tokens is None else media_tokens
+        self.cache_size = cache_size or settings.context_token_cache_size
+        self._encoding = None
+        self._encoding_loaded = False
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count_text(self, text: str) -> int:
+        if not self._encoding_loaded:
+            self._encoding = _load_encoding(self.encoding_name)
+            self._encoding_loaded = True
+        if self._encoding is None:
+            return (len(text.encode("utf-8")) + 3) // 4
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    @staticmethod
+    def _parts(message: BaseMessage):
+        """拆出消息的文本片段和媒体片段数"""
+        if isinstance(message.content, str):
+            return [message.content], 0
+        texts, media = [], 0
+        for part in message.content:
+            if _is_media_part(part):
+                media += 1
+            elif isinstance(part, dict):
+                texts.append(part.get("text", ""))
+            else:
+                texts.append(part)
+        return texts, media
+
+    def count(self, message: BaseMessage) -> int:
+        texts, media = self._parts(message)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{message.type}:{media}".encode("utf-8"))
+        for text in texts:
+            digest.update(b"\0")
+            digest.update(text.encode("utf-8"))
+        key = digest.digest()
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = MESSAGE_OVERHEAD_TOKENS + sum(self.count_text(t) for t in texts) + media * self.media_tokens
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: List[BaseMessage]) -> int:
+        return sum(self.count(m) for m in messages)
+
+
+@dataclass
+class ContextSelection:
+    """窗口挑选结果：messages是已替换媒体的完整历史，从boundary开始的部分原样进入提示词，之前的需要摘要"""
+    messages: List[BaseMessage]
+    boundary: int
+    tokens: int
+
+    @property
+    def recent(self) -> List[BaseMessage]:
+        return self.messages[self.boundary:]
+
+    @property
+    def needs_summary(self) -> bool:
+        return self.boundary > 0
+
+
+class ContextWindow:
+    """
+    按token预算挑选最近的消息：
+    1、最近keep_media_messages条消息保留原始媒体，更早消息中的媒体换成占位文字
+    2、全部历史不超过budget时原样保留，不做摘要
+    3、超出时从最新的消息往前累加，在budget - summary_reserve内尽量多保留，之前的交给摘要
+    """
+
+    def __init__(self, budget: Optional[int] = None, summary_reserve: Optional[int] = None,
+                 keep_media_messages: Optional[int] = None, counter: Optional[TokenCounter] = None):
+        self.budget = budget or settings.context_token_budget
+        self.summary_reserve = settings.context_summary_reserve if summary_reserve is None else summary_reserve
+        self.keep_media_messages = (settings.context_keep_media_messages
+                                    if keep_media_messages is None else keep_media_messages)
+        self.counter = counter or TokenCounter()
+
+    def compact(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """把最近keep_media_messages条之前的消息中的媒体替换为占位文字"""
+        keep_from = max(len(messages) - self.keep_media_messages, 0)
+        return [strip_media(m) if i < keep_from else m for i, m in enumerate(messages)]
+
+    def select(self, messages: List[BaseMessage]) -> ContextSelection:
+        compacted = self.compact(messages)
+        sizes = [self.counter.count(m) for m in compacted]
+        total = sum(sizes)
+        if total <= self.budget:
+            return ContextSelection(messages=compacted, boundary=0, tokens=total)
+
+        #至少保留最新的一条消息，即使它本身已超出预算
+        limit = max(self.budget - self.summary_reserve, 0)
+        boundary, used = len(compacted), 0
+        while boundary > 0 and (used + sizes[boundary - 1] <= limit or boundary == len(compacted)):
+            boundary -= 1
+            used += sizes[boundary]
+        return ContextSelection(messages=compacted, boundary=boundary, tokens=used)
+
+
+_window: Optional[ContextWindow] = None
+
+
+def get_context_window() -> ContextWindow:
+    """获取进程内共享的上下文窗口（token计数缓存在各会话间共享）"""
+    global _window
+    if _window is None:
+        _window = ContextWindow()
+    return _window
@@ -0,0 +1,501 @@
+"""Postgres连接池与基于连接池的聊天记录存储"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, TypeVar
+
+import psycopg2.extensions
+import psycopg2.extras
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from blobstore import BlobStore, get_blob_store
+from config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+#实现Postgresql链接以持久化存储
+DB_URI = "postgresql://{}:{}@{}:{}/{}?sslmode=disable".format(
+settings.postgres_myusername,
+settings.postgres_mypassword,
+settings.postgres_host,
+settings.postgres_port,
+settings.postgres_mydatabase,
+)
+
+
+@dataclass
+class QueryStats:
+    """一次统计范围内的数据库开销：查询次数、发送的SQL字节数、读回的数据字节数"""
+    queries: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    def __str__(self):
+        return f"查询{self.queries}次，发送{self.bytes_sent}字节，接收{self.bytes_received}字节"
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries():
+    """统计with块内（包括LangChain派生的线程）经连接池发出的查询次数和字节数"""
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+T = TypeVar("T")
+
+
+def track_stream(stream: Iterable[T], stats: QueryStats) -> Iterator[T]:
+    """
+    逐块转发流式输出，并把整个流期间的数据库开销记到stats上
+    Gradio会在不同线程里驱动生成器，所以每一步都在同一个复制出的上下文中执行
+    """
+    ctx = copy_context()
+    ctx.run(_query_stats.set, stats)
+    iterator = ctx.run(iter, stream)
+    while True:
+        try:
+            chunk = ctx.run(next, iterator)
+        except StopIteration:
+            return
+        yield chunk
+
+
+async def atrack_stream(stream: AsyncIterable[T], stats: QueryStats) -> AsyncIterator[T]:
+    """track_stream的异步版本：每一步都作为同一上下文中的任务执行"""
+    ctx = copy_context()
+    ctx.run(_query_stats.set, stats)
+    iterator = stream.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.create_task(iterator.__anext__(), context=ctx)
+        except StopAsyncIteration:
+            return
+        yield chunk
+
+
+def record_query(sent: int = 0) -> None:
+    """记录一次查询（供psycopg 3异步路径等不经过计数游标的查询使用）"""
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.bytes_sent += sent
+
+
+def _count_received(value) -> None:
+    stats = _query_stats.get()
+    if stats is None:
+        return
+    if isinstance(value, str):
+        stats.bytes_received += len(value.encode("utf-8"))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        stats.bytes_received += len(value)
+
+
+def _counting_json_loads(value):
+    _count_received(value)
+    return json.loads(value)
+
+
+class _CountingCursor(psycopg2.extensions.cursor):
+    """统计查询次数与字节数的游标"""
+
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(len(self.query or b""))
+
+    def _count_rows(self, rows):
+        for row in rows:
+            for value in row:
+                _count_received(value)
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count_rows([row])
+        return row
+
+    def fetchmany(self, size=None):
+        return self._count_rows(super().fetchmany(size) if size is not None else super().fetchmany())
+
+    def fetchall(self):
+        return self._count_rows(super().fetchall())
+
+
+class _CountingConnection(psycopg2.extensions.connection):
+    """默认使用计数游标；JSONB在解码时计入接收字节数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = _CountingCursor
+        psycopg2.extras.register_default_jsonb(conn_or_curs=self, loads=_counting_json_loads)
+
+
+class PostgresPool:
+    """
+    有界的Postgres连接池
+    最多同时借出max_size个连接，池满时等待timeout秒；
+    连接空闲超过health_check_interval秒后，借出前先用SELECT 1做健康检查，失效则重建；
+    connection_pool可传入实现getconn/putconn/closeall的连接池（测试中用假连接代替数据库）
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 30.0, health_check_interval: float = 30.0, connection_pool=None):
+        self.dsn = dsn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        if connection_pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            connection_pool = ThreadedConnectionPool(min_size, max_size, dsn, connection_factory=_CountingConnection)
+        self._pool = connection_pool
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used: Dict[int, float] = {}
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0.0) < self.health_check_interval:
+            return True
+        try:
+            #用普通游标：健康检查不计入QueryStats
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _getconn(self):
+        conn = self._pool.getconn()
+        if not self._is_healthy(conn):
+            self._discard(conn)
+            conn = self._pool.getconn()
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接：正常结束时提交，异常时回滚，用完归还到池中"""
+        from psycopg2.pool import PoolError
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"等待Postgres连接超时（{self.timeout}秒）")
+        try:
+            conn = self._getconn()
+            try:
+                yield conn
+                if not conn.closed:
+                    conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    def _release(self, conn) -> None:
+        if conn.closed:
+            self._discard(conn)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+
+    def close(self) -> None:
+        self._pool.closeall()
+
+
+_pool: Optional[PostgresPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> PostgresPool:
+    """获取进程内共享的连接池，首次调用时创建"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PostgresPool(
+                    DB_URI,
+                    min_size=settings.pg_pool_min_size,
+                    max_size=settings.pg_pool_max_size,
+                    timeout=settings.pg_pool_timeout,
+                    health_check_interval=settings.pg_pool_health_check_interval,
+                )
+    return _pool
+
+
+#异步连接池和建池用的锁都绑定在创建它们的事件循环上，按事件循环各建一份：
+#同一进程中先后运行的多个事件循环（多次asyncio.run、后台线程中的循环）各用各的，已关闭的循环的条目随时清理；
+#连接池在它的事件循环结束时关闭（见_close_on_shutdown）
+_async_pools: Dict[asyncio.AbstractEventLoop, object] = {}
+_async_pool_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+_async_pool_guards: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+_async_pools_mutex = threading.Lock()
+_async_last_used: Dict[int, float] = {}
+
+
+async def _async_configure(conn) -> None:
+    from psycopg.types.json import set_json_loads
+    set_json_loads(_counting_json_loads, conn)
+
+
+async def _async_check(conn) -> None:
+    """与同步连接池一致：只对空闲超过health_check_interval秒的连接做健康检查"""
+    from psycopg_pool import AsyncConnectionPool
+    if time.monotonic() - _async_last_used.get(id(conn), 0.0) >= settings.pg_pool_health_check_interval:
+        await AsyncConnectionPool.check_connection(conn)
+
+
+async def _async_reset(conn) -> None:
+    _async_last_used[id(conn)] = time.monotonic()
+
+
+async def _close_on_shutdown(pool) -> None:
+    """
+    守护任务：一直等到事件循环结束。asyncio.run退出前会取消所有还在运行的任务并等它们结束，
+    这时在同一个事件循环中关闭连接池，断开连接
+    """
+    try:
+        await asyncio.Event().wait()
+    finally:
+        try:
+            await pool.close()
+        except Exception as e:
+            logger.warning("事件循环结束时关闭异步连接池失败：%r", e)
+
+
+def _close_orphaned_pool(pool) -> None:
+    """事件循环没有取消任务就关闭了（守护任务没来得及运行），尽力断开池中的空闲连接，不依赖事件循环"""
+    for conn in list(getattr(pool, "_pool", ())):
+        try:
+            conn.pgconn.finish()
+        except Exception as e:
+            logger.debug("断开连接失败：%r", e)
+
+
+def _async_pool_lock(loop: asyncio.AbstractEventLoop) -> asyncio.Lock:
+    with _async_pools_mutex:
+        for closed in [other for other in _async_pool_locks if other.is_closed()]:
+            del _async_pool_locks[closed]
+            _async_pool_guards.pop(closed, None)
+            pool = _async_pools.pop(closed, None)
+            if pool is not None:
+                _close_orphaned_pool(pool)
+        return _async_pool_locks.setdefault(loop, asyncio.Lock())
+
+
+async def get_async_pool():
+    """获取当前事件循环共享的异步连接池（psycopg 3），在该循环中首次调用时打开"""
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        async with _async_pool_lock(loop):
+            pool = _async_pools.get(loop)
+            if pool is None:
+                from psycopg_pool import AsyncConnectionPool
+                pool = AsyncConnectionPool(
+                    DB_URI,
+                    min_size=settings.pg_pool_min_size,
+                    max_size=settings.pg_pool_max_size,
+                    timeout=settings.pg_pool_timeout,
+                    configure=_async_configure,
+                    check=_async_check,
+                    reset=_async_reset,
+                    open=False,
+                )
+                await pool.open()
+                _async_pools[loop] = pool
+                #事件循环只保留任务的弱引用，守护任务要自己保存
+                _async_pool_guards[loop] = loop.create_task(_close_on_shutdown(pool))
+    return pool
+
+
+def history_index_name(table_name: str) -> str:
+    return f"{table_name}_session_id_id_idx"
+
+
+def migrate_history_table(pool: Optional[PostgresPool] = None, table_name: str = "message_store") -> bool:
+    """
+    迁移：为已有的聊天记录表建立(session_id, id)索引，返回是否新建了索引
+    使用CREATE INDEX CONCURRENTLY，建索引期间不阻塞对话写入；上次中断留下的无效索引先删除再重建
+    运行：python db.py
+    """
+    pool = pool or get_pool()
+    index = history_index_name(table_name)
+    with pool.connection() as conn:
+        #CONCURRENTLY不能在事务中执行
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass(%s);", (table_name,))
+                if cur.fetchone()[0] is None:
+                    return False
+                cur.execute("""SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+                               WHERE c.relname = %s;""", (index,))
+                row = cur.fetchone()
+                if row and row[0]:
+                    return False
+                if row:
+                    logger.warning("索引%s上次未建完，删除后重建", index)
+                    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index};")
+                cur.execute(f"CREATE INDEX CONCURRENTLY {index} ON {table_name} (session_id, id);")
+                return True
+        finally:
+            conn.autocommit = False
+
+
+class PooledPostgresChatMessageHistory(BaseChatMessageHistory):
+    """
+    与PostgresChatMessageHistory使用同一张message_store表，
+    但每次读写从共享连接池借用连接，不再为每个会话对象新建TCP连接；
+    异步方法（aget_messages/aadd_messages/aclear）使用psycopg 3的异步连接池，不占用线程；
+    消息中的base64媒体写入前存进blob存储，表中只保存引用，读取时不再还原（需要重新发送时再调用resolve）
+    """
+
+    _ready_tables = set()
+
+    def __init__(self, session_id: str, pool: Optional[PostgresPool] = None, table_name: str = "message_store",
+                 blob_store: Optional[BlobStore] = None, limit: Optional[int] = None):
+        self.session_id = session_id
+        self.limit = limit  # 只读取最近的limit条消息（内存后端冷加载时使用）
+        self._pool = pool
+        self.table_name = table_name
+        self.blob_store = blob_store or get_blob_store()
+
+    @property
+    def pool(self) -> PostgresPool:
+        #异步路径只用异步连接池，同步连接池在第一次同步读写时才创建
+        if self._pool is None:
+            self._pool = get_pool()
+        return self._pool
+
+    def _create_table_sql(self) -> str:
+        #(session_id, id)索引：按会话读取和分页时不再扫描全表
+        #只在新建表时一起建（空表上建索引不阻塞任何写入）；已有的表可能很大，普通CREATE INDEX会在建索引期间阻塞写入，
+        #这里不动，由migrate_history_table用CONCURRENTLY在线建
+        return f"""DO $$
+        BEGIN
+            IF to_regclass('{self.table_name}') IS NULL THEN
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    id SERIAL PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    message JSONB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {history_index_name(self.table_name)} ON {self.table_name} (session_id, id);
+            END IF;
+        END $$;"""
+
+    def _create_table_if_not_exists(self) -> None:
+        key = (id(self.pool), self.table_name)
+        if key in self._ready_tables:
+            return
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(self._create_table_sql())
+        self._ready_tables.add(key)
+
+    async def _acreate_table_if_not_exists(self, conn) -> None:
+        key = ("async", self.table_name)
+        if key in self._ready_tables:
+            return
+        await conn.execute(self._create_table_sql())
+        self._ready_tables.add(key)
+
+    def _select_sql(self) -> str:
+        if self.limit is None:
+            return f"SELECT message FROM {self.table_name} WHERE session_id = %s ORDER BY id;"
+        return f"""SELECT message FROM (
+            SELECT id, message FROM {self.table_name} WHERE session_id = %s ORDER BY id DESC LIMIT {int(self.limit)}
+        ) AS recent ORDER BY id;"""
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        """从Postgres读取当前会话的全部消息（设置了limit时只读最近的limit条）"""
+        self._create_table_if_not_exists()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(self._select_sql(), (self.session_id,))
+            items = [row[0] for row in cur.fetchall()]
+        return messages_from_dict(items)
+
+    def add_message(self, message: BaseMessage) -> None:
+        """追加一条消息"""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """批量追加消息：一轮对话的用户消息和AI回复用一条INSERT写入"""
+        if not messages:
+            return
+        messages = self.blob_store.externalize_all(messages)
+        self._create_table_if_not_exists()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                f"INSERT INTO {self.table_name} (session_id, message) VALUES %s;",
+                [(self.session_id, json.dumps(message_to_dict(m))) for m in messages],
+            )
+
+    def clear(self) -> None:
+        """清空当前会话的消息"""
+        self._create_table_if_not_exists()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table_name} WHERE session_id = %s;", (self.session_id,))
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        query = self._select_sql()
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            await self._acreate_table_if_not_exists(conn)
+            cur = await conn.execute(query, (self.session_id,))
+            items = [row[0] for row in await cur.fetchall()]
+        record_query(len(query))
+        return messages_from_dict(items)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        messages = await self.blob_store.aexternalize_all(messages)
+        #一条多行INSERT写入，与同步版本一样只需一次往返
+        rows = [json.dumps(message_to_dict(m)) for m in messages]
+        values = ", ".join(["(%s, %s)"] * len(rows))
+        query = f"INSERT INTO {self.table_name} (session_id, message) VALUES {values};"
+        params = [p for row in rows for p in (self.session_id, row)]
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            await self._acreate_table_if_not_exists(conn)
+            await conn.execute(query, params)
+        record_query(len(query) + sum(len(row.encode("utf-8")) for row in rows))
+
+    async def aclear(self) -> None:
+        query = f"DELETE FROM {self.table_name} WHERE session_id = %s;"
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            await self._acreate_table_if_not_exists(conn)
+            await conn.execute(query, (self.session_id,))
+        record_query(len(query))
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+    setup_logging()
+    created = migrate_history_table()
+    logger.info("聊天记录表索引%s", "已建立" if created else "已存在，无需迁移")
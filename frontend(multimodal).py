@@ -1,67 +1,50 @@
-import base64
-import io
+import logging
 
 import gradio as gr
-from PIL import Image
 from langchain_core.messages import HumanMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableWithMessageHistory
-from multipart import file_path
-from zai import ZhipuAiClient
-from langchain_openai import ChatOpenAI
-from main import get_final_chain, get_config
+from main import get_app, get_config
 from config import get_settings
-from langchain_community.chat_message_histories.postgres import PostgresChatMessageHistory
+from media import AUDIO_SUFFIXES, VIDEO_SUFFIXES, media_kind, prepare_media_groups
+from media_cache import get_media_cache
+from db import QueryStats, atrack_stream
+from metrics import start_metrics_server
+from sessions import assign_session_id, resolve_session_id
 
-final_chain = get_final_chain()
-config = get_config()
 settings = get_settings()
+logger = logging.getLogger(__name__)
 '''使用Gradio库创建一个简单的Web界面，允许用户通过文本和语音与聊天机器人进行交互。'''
-# TODO: 实现用户登录功能，为每一个用户赋予一个session_id，以便保存和区分不同用户的聊天记录
-# TODO：每次用户登录时，将历史记录加载到界面中显示出来
-
-#初始化全模态大模型
-llm = ChatOpenAI(
-    model=settings.dashscope_model,
-    api_key=settings.dashscope_api_key,
-    base_url=settings.dashscope_base_url,
-)
-
-#初始化prompt
-prompt = ChatPromptTemplate.from_messages([
-    ('system', '你是一个多模态AI助手，能够理解用户发送的文本、图片和音频消息，并进行有意义的回复。并根据用户的输入内容，结合上下文信息，生成准确且相关的回答。' ),
-    MessagesPlaceholder(variable_name="messages")
-])
-
-chain = prompt | llm
-
-DB_URI = "postgresql://{}:{}@{}:{}/{}?sslmode=disable".format(
-settings.postgres_myusername,
-settings.postgres_mypassword,
-settings.postgres_host,
-settings.postgres_port,
-settings.postgres_mydatabase,
-)
-
-def get_session_history_from_postgres(session_id: str):
-    # print(f"🧾 正在加载历史记录，session_id = {session_id}")
-    return PostgresChatMessageHistory(
-        session_id=session_id,
-        connection_string=DB_URI
-    )
-
-#配置带历史记录的处理链
-chain_history = RunnableWithMessageHistory(
-    chain,
-    get_session_history_from_postgres,
-)
-
-#配置config
-session_id = "KKZ"
-config = {"configurable": {"session_id": session_id}}
+# √已完成：为每一个用户（开启登录时）或浏览器赋予一个session_id，保存和区分不同用户的聊天记录；刷新页面后仍是同一个会话
+# √已完成：每次用户登录（打开页面）时，将历史记录分页加载到界面中显示出来
+# √已完成：大文件流式处理：视频抽取关键帧和音轨，长录音分段识别，发给模型的媒体片段有大小上限
+
+#全模态大模型和带历史记录的处理链由get_app()在第一次使用时创建（启动时在后台线程中预先创建）
+
+#配置config（带埋点回调）：每轮按本标签页的session_id生成，见get_config
+def init_session(stored_id, request: gr.Request):
+    """页面加载时分配session_id：沿用保存在浏览器中的id（gr.BrowserState），第一次打开时新生成并写回浏览器"""
+    return assign_session_id(stored_id, request)
+
+async def load_history(session_id):
+    """打开页面时回放最近一页历史；还有更早的消息时显示“加载更早的消息”按钮"""
+    page = await get_app().history_reader.apage(session_id)
+    return page.messages, page.before, gr.Button(visible=page.before is not None)
+
+async def load_older(chat_history, session_id, before):
+    """向上翻页：读取游标之前的一页，放到当前界面的最前面"""
+    if before is None:
+        return chat_history, None, gr.Button(visible=False)
+    page = await get_app().history_reader.apage(session_id, before=before)
+    return page.messages + (chat_history or []), page.before, gr.Button(visible=page.before is not None)
+
+def toggle_response_cache(skip, session_id, request: gr.Request):
+    """勾选“不使用回答缓存”后，本会话每次都重新生成回答（开启回答缓存时才显示这个开关）"""
+    cache = get_app().response_cache
+    if cache is not None:
+        session_id = resolve_session_id(session_id, request)
+        (cache.disable if skip else cache.enable)(session_id)
 
 # user_msg = HumanMessage([{'type': 'text', 'text': '你知道机器学习是什么东西吗？'}])
-# resp = chain_history.invoke({"messages":[user_msg]},config)
+# resp = get_app().multimodal_chain.invoke({"messages":[user_msg]},config)
 # print(resp)
 
 
@@ -93,125 +76,128 @@ def get_last_user_after_assistant(chat_history):
 '''
 def add_message(chat_history, user_messages):
     """将用户消息添加到聊天历史记录中"""
-    print(user_messages)
+    logger.debug("收到%d个文件，文字%s", len(user_messages['files']), "有" if user_messages['text'] else "无")
     for msg in user_messages['files']:
-        print(msg)
         chat_history.append({'role': "user", 'content': {'path': msg}})
     #处理文本消息
     if user_messages['text'] is not None:
         chat_history.append({'role': "user", 'content': user_messages['text']})#字典内的role对应的值必须是"user"或者"assistant"
     return chat_history, gr.MultimodalTextbox(value=None, interactive=False)
 
-#处理语音文件函数
-def transcribe_audio(audio_path):
-    """
-    使用base64处理语音转为
-    目前全模态大模型的两种传参方式：1、base64字符串（本地） 2、网络访问的url地址（外网服务器上）如https://xxx.com/xx.wav
-    """
-    try:
-        with open(audio_path,"rb") as audio_file:
-            audio_data = base64.b64encode(audio_file.read()).decode('utf-8')
-        audio_message = {
-            "type": "audio_url",
-            "audio_url": {
-                "url": f"data:audio/wav;base64,{audio_data}",
-                "duration": 30 #单位：秒（帮助模型优化处理）
-            }
-        }
-        return audio_message
-    except Exception as e:
-        return {}
-
-#处理图片文件函数
-def transcribe_image(image_path):
-    """
-    将任意格式的图片转换为base64编码的data URL
-    :param image_path: 图片文件的路径
-    :return: 包含base64编码的字典
-    """
-    with Image.open(image_path) as img:
-        #获取原始图片格式（如JPEG/PNG）
-        img_format = img.format if img.format else "JPEG"
-        buffered = io.BytesIO()
-        #保留原始格式保存图片到内存缓冲区
-        img.save(buffered, format=img_format)
-
-        image_data = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        return {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/{img_format.lower()};base64,{image_data}",#MIME类型标准
-                "detail": "low"
-            }
-        }
-
-def submit_message(chat_history):
-    """提交用户消息并获取聊天机器人的响应"""
+async def submit_message(chat_history, session_id, request: gr.Request):
+    """提交用户消息，并把聊天机器人的响应逐token推送到聊天界面"""
     user_messages = get_last_user_after_assistant(chat_history)
-    print(user_messages)
     content = [] #HumanMessage的内容
     if user_messages:
+        file_slots = [] #(在content中的位置, 文件路径)
         for x in user_messages:
             if isinstance(x['content'], str):#文字输入消息
                 content.append({'type': 'text', 'text': x['content']})
             elif isinstance(x['content'], tuple):#多模态输入消息
                 file_path = x['content'][0]#取得上传文件的路径
-                if file_path.endswith('.wav'):#是录音文件
-                    file_message = transcribe_audio(file_path)
-                elif file_path.endswith('.jpg') or file_path.endswith('.png') or file_path.endswith('.jpeg'):#是图片
-                   file_message = transcribe_image(file_path)
-                content.append(file_message)
+                if media_kind(file_path):#录音、图片或视频，先占位，稍后并行编码
+                    file_slots.append((len(content), file_path))
+                    content.append(None)
             else:
                 pass
+        #所有文件并行编码（图片在进程池、文件读取在线程池），按原顺序放回content；一个视频展开为多个片段
+        groups = await prepare_media_groups([path for _, path in file_slots])
+        for (index, _), group in zip(file_slots, groups):
+            content[index] = group
+        content = [part for item in content for part in (item if isinstance(item, list) else [item])]
         input_message = HumanMessage(content)
-        resp = chain_history.invoke(
-            {"messages": input_message},
+        chat_history.append({'role': "assistant", 'content': ""})
+        db_stats = QueryStats()
+        app = get_app()
+        config = get_config(resolve_session_id(session_id, request))
+        #同一会话的轮次依次进行，同时进行的总轮数由信号量限制
+        async with app.turn(config["configurable"]["session_id"]):
+            stream = app.multimodal_chain.astream(
+                {"messages": [input_message]},
+                config=config
+            )
+            async for chunk in atrack_stream(stream, db_stats):
+                chat_history[-1]['content'] += chunk.content
+                yield chat_history
+        logger.info("本轮数据库开销：%s", db_stats)
+        logger.debug("媒体缓存：%s", get_media_cache().snapshot())
+    else:
+        yield chat_history
+
+
+async def execute_chain(chat_history, session_id, request: gr.Request):
+    """执行聊天链，把大模型的回复逐token推送到聊天界面"""
+    input = chat_history[-1]
+    chat_history.append({'role': "assistant", 'content': ""})
+    db_stats = QueryStats()
+    app = get_app()
+    config = get_config(resolve_session_id(session_id, request))
+    #流式输出：每收到一个token就刷新一次界面，流结束后历史记录才会写入数据库
+    #异步执行：同一会话的轮次依次进行，同时进行的总轮数由信号量限制
+    async with app.turn(config["configurable"]["session_id"]):
+        stream = app.final_chain.astream(
+            {"input": input['content'], "config": config},
             config=config
         )
-        chat_history.append({'role': "assistant", 'content': resp.content})
-    return chat_history
+        async for chunk in atrack_stream(stream, db_stats):
+            chat_history[-1]['content'] += chunk.content
+            yield chat_history
+    logger.info("本轮数据库开销：%s", db_stats)
+
+
+def create_app() -> gr.Blocks:
+    """组装界面；大模型客户端和处理链不在这里创建，第一次提交消息时才创建"""
+    with gr.Blocks(title="多模态聊天机器人", theme = gr.themes.Soft()) as block:
+
+        #本浏览器的session_id，保存在浏览器本地存储中，页面加载时读取或分配；history_cursor是界面中最早一条历史的游标
+        session_state = gr.BrowserState(None, storage_key="chatbot_session_id")
+        history_cursor = gr.State()
+
+        #向上翻页加载更早的历史
+        older_btn = gr.Button("加载更早的消息", size="sm", visible=False)
+        #聊天历史记录的组件
+        chatbot = gr.Chatbot(type="messages", height=500, label = "聊天机器人", bubble_full_width=False)
+
+        #打开页面：分配session_id，再回放最近一页历史
+        block.load(init_session, [session_state], [session_state]).then(
+            load_history, [session_state], [chatbot, history_cursor, older_btn])
+        older_btn.click(load_older, [chatbot, session_state, history_cursor], [chatbot, history_cursor, older_btn])
+
+        #创建多模态输入框
+        chat_input = gr.MultimodalTextbox(
+            interactive=True, #可交互
+            file_types=['image', *AUDIO_SUFFIXES, *VIDEO_SUFFIXES], #支持的文件类型（与media_kind一致）
+            file_count="multiple",#允许多文件上传
+            placeholder="请给ChatBot输入信息或者上传文件...",#输入框体术文本
+            show_label=False,
+            sources=["microphone", "upload",]#支持的输入源:麦克风与上传文件
+        )
+        #按会话关闭回答缓存
+        skip_cache = gr.Checkbox(label="不使用回答缓存（每次重新生成）", value=False,
+                                 visible=settings.response_cache_enabled)
+        skip_cache.change(toggle_response_cache, [skip_cache, session_state], None)
+
+        chat_input.submit(
+            add_message,
+            [chatbot,chat_input],
+            [chatbot,chat_input]
+        ).then(
+            submit_message,
+            [chatbot, session_state],
+            [chatbot],
+        ).then( # 回复完成后激活输入框
+            lambda: gr.MultimodalTextbox(interactive=True),
+            None,#无输入
+            [chat_input]#输出到输入框
+        )
+    return block
 
 
-def execute_chain(chat_history):
-    """执行聊天链以获取响应"""
-    print(chat_history)
-    input = chat_history[-1]
-    result = final_chain.invoke(
-        {"input": input['content'], "config": config},
-        config=config
-    )
-    chat_history.append({'role': "assistant", 'content': result.content})
-    return chat_history
-
-with gr.Blocks(title="多模态聊天机器人", theme = gr.themes.Soft()) as block:
-
-    #聊天历史记录的组件
-    chatbot = gr.Chatbot(type="messages", height=500, label = "聊天机器人", bubble_full_width=False)
-
-    #创建多模态输入框
-    chat_input = gr.MultimodalTextbox(
-        interactive=True, #可交互
-        file_types=['image', '.wav', '.mp4'], #支持的文件类型
-        file_count="multiple",#允许多文件上传
-        placeholder="请给ChatBot输入信息或者上传文件...",#输入框体术文本
-        show_label=False,
-        sources=["microphone", "upload",]#支持的输入源:麦克风与上传文件
-    )
-
-    chat_input.submit(
-        add_message,
-        [chatbot,chat_input],
-        [chatbot,chat_input]
-    ).then(
-        submit_message,
-        [chatbot],
-        [chatbot],
-    ).then( # 回复完成后激活输入框
-        lambda: gr.MultimodalTextbox(interactive=True),
-        None,#无输入
-        [chat_input]#输出到输入框
-    )
-
-
-    if __name__ == "__main__":
-        block.launch()
\ No newline at end of file
+if __name__ == "__main__":
+    block = create_app()
+    #服务先开始监听，处理链在后台线程中预先创建
+    get_app().warm_up("multimodal_chain")
+    #Prometheus指标在独立端口的/metrics上提供
+    start_metrics_server()
+    #处理函数都是异步的，并发由app.turn控制（按会话排队 + 全局信号量），这里不再按事件限制并发数
+    block.queue(default_concurrency_limit=None).launch()
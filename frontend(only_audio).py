@@ -1,15 +1,45 @@
+import logging
+
 import gradio as gr
-from langgraph.graph import add_messages
-from zai import ZhipuAiClient
 
-from main import get_final_chain, get_config
+from main import get_app, get_config
+from db import QueryStats, atrack_stream
+from asr import astream_transcript
+from config import get_settings
+from metrics import start_metrics_server
+from sessions import assign_session_id, resolve_session_id
+from vad import StreamingTranscriber
 
-final_chain = get_final_chain()
-config = get_config()
+settings = get_settings()
+logger = logging.getLogger(__name__)
 '''使用Gradio库创建一个简单的Web界面，允许用户通过文本和语音与聊天机器人进行交互。'''
 # TODO: 优化界面，将语音输入与文字输入结合起来
-# TODO: 实现用户登录功能，为每一个用户赋予一个session_id，以便保存和区分不同用户的聊天记录
-# TODO：每次用户登录时，将历史记录加载到界面中显示出来
+# √已完成：为每一个用户（开启登录时）或浏览器赋予一个session_id，保存和区分不同用户的聊天记录；刷新页面后仍是同一个会话
+# √已完成：每次用户登录（打开页面）时，将历史记录分页加载到界面中显示出来
+# √已完成：实时语音模式：边说边做语音活动检测，说完一句立即识别，识别结果实时显示并自动发送
+
+def init_session(stored_id, request: gr.Request):
+    """页面加载时分配session_id：沿用保存在浏览器中的id（gr.BrowserState），第一次打开时新生成并写回浏览器"""
+    return assign_session_id(stored_id, request)
+
+async def load_history(session_id):
+    """打开页面时回放最近一页历史；还有更早的消息时显示“加载更早的消息”按钮"""
+    page = await get_app().history_reader.apage(session_id)
+    return page.messages, page.before, gr.Button(visible=page.before is not None)
+
+async def load_older(chat_history, session_id, before):
+    """向上翻页：读取游标之前的一页，放到当前界面的最前面"""
+    if before is None:
+        return chat_history, None, gr.Button(visible=False)
+    page = await get_app().history_reader.apage(session_id, before=before)
+    return page.messages + (chat_history or []), page.before, gr.Button(visible=page.before is not None)
+
+def toggle_response_cache(skip, session_id, request: gr.Request):
+    """勾选“不使用回答缓存”后，本会话每次都重新生成回答（开启回答缓存时才显示这个开关）"""
+    cache = get_app().response_cache
+    if cache is not None:
+        session_id = resolve_session_id(session_id, request)
+        (cache.disable if skip else cache.enable)(session_id)
 
 def get_last_user_after_assistant(chat_history):
     """反向便利找到最后一个assistant的位置，并返回后面的所有user消息"""
@@ -49,64 +79,156 @@ def add_message(chat_history, user_message):
         chat_history.append({'role': "user", 'content': user_message})
         return chat_history, ''
 
-def read_audio(audio_path):
-    """读取音频文件并将其转换为文本"""
+async def read_audio(audio_path):
+    """读取音频文件并将其转换为文本，流式识别时边识别边填入输入框"""
     if audio_path:
-        client = ZhipuAiClient()
-        with open(audio_path, "rb") as audio_data:
-            response = client.audio.transcriptions.create(
-                model="glm-asr",
-                file=audio_data,
-                stream=False
-            )
-        text = response.model_extra['text']
-        print(text)
-        return text
-    return ''
+        text = ''
+        async for text in astream_transcript(audio_path):
+            yield text
+        logger.debug("识别结果：%d个字", len(text))
+    else:
+        yield ''
+
+#待自动提交的句子(序号, 文字)以转写状态中的为准：几个事件并发时，不会把较早读到的旧值写回gr.State
+async def on_mic_chunk(chunk, transcriber):
+    """实时语音的每个音频块：只做VAD并排队识别，立即返回；识别中的文字显示在输入框，识别完成的句子交给自动提交"""
+    transcriber = transcriber or StreamingTranscriber()
+    if chunk is not None:
+        rate, data = chunk
+        transcriber.feed(rate, data)
+    ready = transcriber.take_ready()
+    #有新句子要提交时清空输入框；正在识别时显示识别中的文字；其余时候不动输入框（不覆盖用户打的字）
+    text = gr.update(value="") if ready else gr.update(value=transcriber.partial) if transcriber.partial else gr.update()
+    return transcriber, text, transcriber.sent
+
+async def on_mic_stop(transcriber):
+    """停止录音：结束正在说的这句话，等识别完成后提交"""
+    if transcriber is None:
+        return None, gr.update(), None
+    ready = await transcriber.finish()
+    return transcriber, gr.update(value="") if ready else gr.update(), transcriber.sent
+
+def add_utterance(chat_history, sent):
+    """一句话识别完成：作为用户消息加入聊天记录（取走句子时转写状态已进入提交中，回答结束前新的句子先不提交）"""
+    #没有待提交的句子（停止录音时还没开始说话等）：聊天记录不变
+    if sent is None:
+        return chat_history
+    chat_history.append({'role': "user", 'content': sent[1]})
+    return chat_history
+
+async def answer_utterance(chat_history, sent, session_id, request: gr.Request):
+    """对自动提交的句子执行聊天链；没有待提交的句子时不调用大模型"""
+    if sent is None:
+        yield chat_history
+        return
+    async for chat_history in execute_chain(chat_history, session_id, request):
+        yield chat_history
+
+def utterance_done(transcriber):
+    """回答结束：回答期间识别完成的句子合并成一条，接着提交"""
+    if transcriber is None:
+        return None
+    transcriber.submitting = False
+    transcriber.take_ready()
+    return transcriber.sent
 
 def submit_message(chat_history):
-    """提交用户消息并获取聊天机器人的响应"""
+    """提交用户消息，并把聊天机器人的响应逐token推送到聊天界面"""
     user_messages = get_last_user_after_assistant(chat_history)
-    print(user_messages)
+    logger.debug("待提交的用户消息：%d条", len(user_messages or []))
 
-def execute_chain(chat_history):
-    """执行聊天链以获取响应"""
+async def execute_chain(chat_history, session_id, request: gr.Request):
+    """执行聊天链，把大模型的回复逐token推送到聊天界面"""
     input = chat_history[-1]
-    result = final_chain.invoke(
-        {"input": input['content'], "config": config},
-        config=config
-    )
-    chat_history.append({'role': "assistant", 'content': result.content})
-    return chat_history
-
-with gr.Blocks(title="多模态聊天机器人", theme = gr.themes.Soft()) as block:
-
-    #聊天历史记录的组件
-    chatbot = gr.Chatbot(type="messages", height=500, label = "聊天机器人", bubble_full_width=False)
-
-    with gr.Row():
-        #文字输入的区域
-        with gr.Column(scale=4):
-            user_input = gr.Textbox(placeholder="请给ChatBot发送消息...", label="文字输入", max_lines=5)
-
-            submit_btn = gr.Button("发送",variant="primary")
-        #语音输入的区域
-        with gr.Column(scale=1):
-            audio_input = gr.Audio(sources="microphone", type="filepath", label="语音输入", format="wav")
-
-    #文本框提交的事件
-    chat_msg = user_input.submit(add_message, [chatbot, user_input], [chatbot, user_input])
-    chat_msg.then(execute_chain,chatbot,chatbot)
-
-    #语音输入框的改变事件
-    audio_input.change(read_audio, [audio_input], [user_input])
-
-    #按钮点击的事件
-    submit_btn.click(
-        add_message,
-        [chatbot, user_input],
-        [chatbot, user_input]
-    ).then(execute_chain,chatbot,chatbot)
-
-    if __name__ == "__main__":
-        block.launch()
\ No newline at end of file
+    chat_history.append({'role': "assistant", 'content': ""})
+    db_stats = QueryStats()
+    app = get_app()
+    config = get_config(resolve_session_id(session_id, request))
+    #流式输出：每收到一个token就刷新一次界面，流结束后历史记录才会写入数据库
+    #异步执行：同一会话的轮次依次进行，同时进行的总轮数由信号量限制
+    async with app.turn(config["configurable"]["session_id"]):
+        stream = app.final_chain.astream(
+            {"input": input['content'], "config": config},
+            config=config
+        )
+        async for chunk in atrack_stream(stream, db_stats):
+            chat_history[-1]['content'] += chunk.content
+            yield chat_history
+    logger.info("本轮数据库开销：%s", db_stats)
+
+def create_app() -> gr.Blocks:
+    """组装界面；大模型客户端和处理链不在这里创建，第一次提交消息时才创建"""
+    with gr.Blocks(title="多模态聊天机器人", theme = gr.themes.Soft()) as block:
+
+        #本浏览器的session_id，保存在浏览器本地存储中，页面加载时读取或分配；history_cursor是界面中最早一条历史的游标
+        session_state = gr.BrowserState(None, storage_key="chatbot_session_id")
+        history_cursor = gr.State()
+
+        #向上翻页加载更早的历史
+        older_btn = gr.Button("加载更早的消息", size="sm", visible=False)
+        #聊天历史记录的组件
+        chatbot = gr.Chatbot(type="messages", height=500, label = "聊天机器人", bubble_full_width=False)
+
+        #打开页面：分配session_id，再回放最近一页历史
+        block.load(init_session, [session_state], [session_state]).then(
+            load_history, [session_state], [chatbot, history_cursor, older_btn])
+        older_btn.click(load_older, [chatbot, session_state, history_cursor], [chatbot, history_cursor, older_btn])
+
+        with gr.Row():
+            #文字输入的区域
+            with gr.Column(scale=4):
+                user_input = gr.Textbox(placeholder="请给ChatBot发送消息...", label="文字输入", max_lines=5)
+
+                submit_btn = gr.Button("发送",variant="primary")
+                #按会话关闭回答缓存
+                skip_cache = gr.Checkbox(label="不使用回答缓存（每次重新生成）", value=False,
+                                         visible=settings.response_cache_enabled)
+            #语音输入的区域
+            with gr.Column(scale=1):
+                audio_input = gr.Audio(sources="microphone", type="filepath", label="语音输入", format="wav")
+                #实时语音：音频块边录边发送，说完一句自动识别并发送
+                live_input = gr.Audio(sources="microphone", type="numpy", streaming=True, label="实时语音")
+
+        #实时语音的转写状态（每个标签页一个StreamingTranscriber），以及待自动提交的句子(序号, 文字)
+        #标签页关闭时取消还在进行的识别
+        mic_state = gr.State(delete_callback=lambda transcriber: transcriber and transcriber.cancel())
+        utterance_state = gr.State()
+
+        skip_cache.change(toggle_response_cache, [skip_cache, session_state], None)
+
+        #文本框提交的事件
+        chat_msg = user_input.submit(add_message, [chatbot, user_input], [chatbot, user_input])
+        chat_msg.then(execute_chain,[chatbot, session_state],chatbot)
+
+        #语音输入框的改变事件
+        audio_input.change(read_audio, [audio_input], [user_input])
+
+        #实时语音：每个音频块只做VAD；一句话识别完成后加入聊天记录并执行聊天链，回答结束后再提交之后的句子
+        live_input.stream(on_mic_chunk, [live_input, mic_state], [mic_state, user_input, utterance_state],
+                          stream_every=settings.vad_stream_every, time_limit=settings.vad_time_limit)
+        live_input.stop_recording(on_mic_stop, [mic_state], [mic_state, user_input, utterance_state])
+        utterance_state.change(
+            add_utterance, [chatbot, utterance_state], [chatbot]
+        ).then(
+            answer_utterance, [chatbot, utterance_state, session_state], chatbot
+        ).then(
+            utterance_done, [mic_state], [utterance_state]
+        )
+
+        #按钮点击的事件
+        submit_btn.click(
+            add_message,
+            [chatbot, user_input],
+            [chatbot, user_input]
+        ).then(execute_chain,[chatbot, session_state],chatbot)
+    return block
+
+
+if __name__ == "__main__":
+    block = create_app()
+    #服务先开始监听，处理链在后台线程中预先创建
+    get_app().warm_up("final_chain")
+    #Prometheus指标在独立端口的/metrics上提供
+    start_metrics_server()
+    #处理函数都是异步的，并发由app.turn控制（按会话排队 + 全局信号量），这里不再按事件限制并发数
+    block.queue(default_concurrency_limit=None).launch()
@@ -0,0 +1,194 @@
+"""
+聊天记录的分页读取：登录/打开页面时把历史回放到聊天界面
+从最新的消息向前按页读取（键集分页：session_id相同且id小于上一页最小id），只取界面需要的字段，
+逐行转换为Gradio的消息字典；媒体只给出blob文件路径，不读取内容
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from blobstore import BlobStore, get_blob_store
+from config import get_settings
+from context import DEFAULT_PLACEHOLDER, MEDIA_PLACEHOLDERS
+from db import PooledPostgresChatMessageHistory, PostgresPool, get_async_pool, get_pool, record_query
+from history_store import MemoryChatMessageHistory, SessionStore
+
+settings = get_settings()
+
+#消息类型 -> 界面中的角色；系统消息、工具消息等不显示
+ROLES = {"human": "user", "ai": "assistant", "AIMessageChunk": "assistant"}
+
+
+@dataclass
+class HistoryPage:
+    """一页历史：按时间顺序的Gradio消息，以及读取更早一页的游标（None表示已经没有更早的消息）"""
+    messages: List[dict] = field(default_factory=list)
+    before: Optional[int] = None
+
+
+def to_gradio(kind: str, content, blob_store: Optional[BlobStore] = None) -> Iterator[dict]:
+    """
+    一条消息转换为Gradio的messages格式：文字合并为一条，每个媒体片段单独一条（文件路径）
+    媒体保存为blob引用时直接给出文件路径；其他情况（内联data URL等）显示占位文字
+    """
+    role = ROLES.get(kind)
+    if role is None:
+        return
+    if isinstance(content, str):
+        if content:
+            yield {"role": role, "content": content}
+        return
+    blob_store = blob_store or get_blob_store()
+    texts, files = [], []
+    for part in content or []:
+        if isinstance(part, str):
+            texts.append(part)
+        elif part.get("type") == "text":
+            texts.append(part.get("text", ""))
+        else:
+            body = part.get(part.get("type"))
+            located = blob_store.locate(body.get("url")) if isinstance(body, dict) else None
+            if located is None:
+                texts.append(MEDIA_PLACEHOLDERS.get(part.get("type"), DEFAULT_PLACEHOLDER))
+            else:
+                path, mime = located
+                files.append({"role": role, "content": {"path": str(path), "mime_type": mime}})
+    #与前端提交时的顺序一致：先文件，后文字
+    yield from files
+    text = "".join(texts)
+    if text:
+        yield {"role": role, "content": text}
+
+
+def rows_to_page(rows: Iterable[Tuple[int, str, object]], limit: int,
+                 blob_store: Optional[BlobStore] = None) -> HistoryPage:
+    """
+    按id倒序的(id, 类型, 内容)行 -> 一页历史；查询时多取一行（LIMIT limit + 1），
+    多出的那一行只用来判断是否还有更早的消息，不放进这一页：剩余消息恰好是limit条时不会多出一次空的翻页
+    """
+    rows = list(rows)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [m for _, kind, content in reversed(rows) for m in to_gradio(kind, content, blob_store)]
+    before = rows[-1][0] if more else None
+    return HistoryPage(messages=messages, before=before)
+
+
+class PostgresHistoryReader:
+    """
+    直接分页查询message_store表：
+    1、键集分页：WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?，配合(session_id, id)索引，
+       无论会话多长、翻到第几页都只扫描一页的行
+    2、只投影消息类型和内容，不取出additional_kwargs、response_metadata等界面用不到的字段
+    flush用于分层存储：读取前先把该会话尚未写回数据库的消息落库
+    """
+
+    def __init__(self, pool: Optional[PostgresPool] = None, table_name: str = "message_store",
+                 flush: Optional[Callable[[str], None]] = None, blob_store: Optional[BlobStore] = None):
+        self._pool = pool
+        self.table_name = table_name
+        self.flush = flush
+        self.blob_store = blob_store
+        self._history: Optional[PooledPostgresChatMessageHistory] = None
+
+    @property
+    def table(self) -> PooledPostgresChatMessageHistory:
+        """表和索引由聊天记录后端负责创建，这里借用它的建表逻辑"""
+        if self._history is None:
+            self._history = PooledPostgresChatMessageHistory("", pool=self._pool, table_name=self.table_name,
+                                                             blob_store=self.blob_store)
+        return self._history
+
+    @property
+    def pool(self) -> PostgresPool:
+        if self._pool is None:
+            self._pool = get_pool()
+        return self._pool
+
+    def _page_sql(self, first: bool) -> str:
+        keyset = "" if first else "AND id < %s "
+        return (f"SELECT id, message->>'type', message->'data'->'content' FROM {self.table_name} "
+                f"WHERE session_id = %s {keyset}ORDER BY id DESC LIMIT %s;")
+
+    @staticmethod
+    def _params(session_id: str, before: Optional[int], limit: int) -> tuple:
+        return (session_id, limit) if before is None else (session_id, before, limit)
+
+    def page(self, session_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> HistoryPage:
+        """读取id小于before的最近limit条消息；before为None时读取最新的一页"""
+        limit = limit or settings.history_page_size
+        if before is None and self.flush is not None:
+            self.flush(session_id)
+        self.table._create_table_if_not_exists()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(self._page_sql(before is None), self._params(session_id, before, limit + 1))
+            rows = cur.fetchall()
+        return rows_to_page(rows, limit, self.blob_store)
+
+    async def apage(self, session_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> HistoryPage:
+        """page的异步版本，使用psycopg 3的异步连接池"""
+        limit = limit or settings.history_page_size
+        if before is None and self.flush is not None:
+            await asyncio.to_thread(self.flush, session_id)
+        query = self._page_sql(before is None)
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            await self.table._acreate_table_if_not_exists(conn)
+            cur = await conn.execute(query, self._params(session_id, before, limit + 1))
+            rows = await cur.fetchall()
+        record_query(len(query))
+        return rows_to_page(rows, limit, self.blob_store)
+
+
+class MemoryHistoryReader:
+    """
+    内存后端：会话的全部消息本来就在内存中，按位置分页；
+    游标是消息的序号而不是列表下标：两次翻页之间超出上限的旧消息被丢弃时，列表下标会整体前移，
+    序号不变，"加载更早"既不会跳过也不会重复消息
+    """
+
+    def __init__(self, get_session_history: Callable[[str], BaseChatMessageHistory],
+                 blob_store: Optional[BlobStore] = None):
+        self.get_session_history = get_session_history
+        self.blob_store = blob_store
+
+    def _page(self, first: int, messages: List[BaseMessage], before: Optional[int], limit: int) -> HistoryPage:
+        #first是messages[0]的序号；游标指向的消息已被丢弃时没有更早的消息可读
+        end = len(messages) if before is None else min(max(before - first, 0), len(messages))
+        start = max(end - limit, 0)
+        rows = [(first + i, messages[i].type, messages[i].content) for i in range(end - 1, start - 1, -1)]
+        page = rows_to_page(rows, limit, self.blob_store)
+        page.before = first + start if start > 0 else None
+        return page
+
+    def page(self, session_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> HistoryPage:
+        history = self.get_session_history(session_id)
+        #其他聊天记录实现不丢弃旧消息，下标即序号
+        first, messages = history.numbered() if isinstance(history, MemoryChatMessageHistory) else (0, history.messages)
+        return self._page(first, messages, before, limit or settings.history_page_size)
+
+    async def apage(self, session_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> HistoryPage:
+        history = self.get_session_history(session_id)
+        if isinstance(history, MemoryChatMessageHistory):
+            first, messages = await history.anumbered()
+        else:
+            first, messages = 0, await history.aget_messages()
+        return self._page(first, messages, before, limit or settings.history_page_size)
+
+
+def build_history_reader(get_session_history: Callable[[str], BaseChatMessageHistory],
+                         backend: Optional[str] = None):
+    """
+    按聊天记录后端选择分页读取方式：postgres/tiered直接分页查询数据库（tiered先写回该会话待落库的消息），
+    memory从内存中分页
+    """
+    backend = backend or settings.history_backend
+    if backend == "memory":
+        return MemoryHistoryReader(get_session_history)
+    store = getattr(get_session_history, "__self__", None)
+    flush = store.flush if isinstance(store, SessionStore) else None
+    return PostgresHistoryReader(flush=flush)
@@ -0,0 +1,267 @@
+"""有界的内存聊天记录后端：热会话常驻内存，空闲会话按LRU/TTL淘汰，可选写回Postgres（分层存储）"""
+
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from blobstore import get_blob_store
+from config import get_settings
+from db import PooledPostgresChatMessageHistory
+from metrics import REGISTRY
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+HISTORY_BACKENDS = ("memory", "postgres", "tiered")
+
+
+@dataclass
+class _Session:
+    messages: List[BaseMessage] = field(default_factory=list)
+    last_access: float = field(default_factory=time.monotonic)
+    dropped: int = 0  # 从前部丢弃的消息数：messages[i]的序号是dropped + i
+
+
+@dataclass
+class SessionStoreStats:
+    """计数：内存命中、冷加载、淘汰的会话、写回批次、写回的消息"""
+    hits: int = 0
+    cold_loads: int = 0
+    evictions: int = 0
+    flushes: int = 0
+    flushed_messages: int = 0
+
+
+class SessionStore:
+    """
+    会话级的内存聊天记录：
+    1、最多保留max_sessions个会话，超出时淘汰最久未访问的；空闲超过ttl秒的会话也会被淘汰
+    2、每个会话在内存中最多保留max_messages条，超出时丢弃最早的消息（摘要通过锚点重新定位水位线）
+    3、设置了cold时为分层存储：未命中时从cold读取最近max_messages条，
+       新消息先写入内存，再由后台线程每flush_interval秒批量写回cold（write-behind）
+    """
+
+    def __init__(self, cold: Optional[Callable[[str], BaseChatMessageHistory]] = None,
+                 max_sessions: Optional[int] = None, ttl: Optional[float] = None,
+                 max_messages: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.cold = cold
+        self.max_sessions = max_sessions or settings.history_max_sessions
+        self.ttl = settings.history_session_ttl if ttl is None else ttl
+        self.max_messages = max_messages or settings.history_max_messages
+        self.flush_interval = settings.history_flush_interval if flush_interval is None else flush_interval
+        self.stats = SessionStoreStats()
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._pending: Dict[str, List[BaseMessage]] = {}  # 还没写回cold的消息
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 写回按顺序进行，同一会话的批次不会乱序
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _evict_locked(self, now: float) -> None:
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and (not self.ttl or now - session.last_access <= self.ttl):
+                break
+            #未写回的消息仍在_pending中，淘汰后由后台线程写回
+            del self._sessions[session_id]
+            self.stats.evictions += 1
+
+    def _lookup(self, session_id: str) -> Optional[Tuple[int, List[BaseMessage]]]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict_locked(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            self.stats.hits += 1
+            return session.dropped, list(session.messages)
+
+    def _install(self, session_id: str, messages: List[BaseMessage]) -> Tuple[int, List[BaseMessage]]:
+        with self._lock:
+            #并发加载同一会话时以先装入的为准
+            session = self._sessions.get(session_id)
+            if session is None:
+                #加载期间新写入、尚未写回的消息接在数据库读到的历史之后
+                messages = list(messages) + self._pending.get(session_id, [])
+                dropped = max(len(messages) - self.max_messages, 0)
+                session = _Session(messages=messages[dropped:], dropped=dropped)
+                self._sessions[session_id] = session
+                self._evict_locked(time.monotonic())
+            return session.dropped, list(session.messages)
+
+    def _cold_load(self, session_id: str) -> Tuple[int, List[BaseMessage]]:
+        #冷加载前先写回该会话未落库的消息；加载期间持有写回锁，后台写回不会与读取交错
+        with self._flush_lock:
+            self._flush_locked(session_id)
+            with self._lock:
+                self.stats.cold_loads += 1
+            return self._install(session_id, self.cold(session_id).messages)
+
+    def numbered(self, session_id: str) -> Tuple[int, List[BaseMessage]]:
+        """(第一条消息的序号, 消息)：序号随消息写入递增，前部的消息被丢弃后其余消息的序号不变"""
+        found = self._lookup(session_id)
+        if found is not None:
+            return found
+        if self.cold is None:
+            return self._install(session_id, [])
+        return self._cold_load(session_id)
+
+    async def anumbered(self, session_id: str) -> Tuple[int, List[BaseMessage]]:
+        found = self._lookup(session_id)
+        if found is not None:
+            return found
+        if self.cold is None:
+            return self._install(session_id, [])
+        return await asyncio.to_thread(self._cold_load, session_id)
+
+    def get(self, session_id: str) -> List[BaseMessage]:
+        return self.numbered(session_id)[1]
+
+    async def aget(self, session_id: str) -> List[BaseMessage]:
+        return (await self.anumbered(session_id))[1]
+
+    def add(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and self.cold is None:
+                session = self._sessions[session_id] = _Session()
+            if session is not None:
+                #会话不在内存中时（刚被淘汰）只写回cold，下次读取时重新加载
+                session.messages.extend(messages)
+                overflow = max(len(session.messages) - self.max_messages, 0)
+                del session.messages[:overflow]
+                session.dropped += overflow
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            if self.cold is not None:
+                self._pending.setdefault(session_id, []).extend(messages)
+            self._evict_locked(time.monotonic())
+        if self.cold is not None:
+            self._start_flusher()
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._pending.pop(session_id, None)
+        if self.cold is not None:
+            with self._flush_lock:
+                self.cold(session_id).clear()
+
+    def flush(self, session_id: Optional[str] = None) -> None:
+        """把未写回的消息批量写入cold：session_id为None时写回全部会话"""
+        with self._flush_lock:
+            self._flush_locked(session_id)
+
+    def _flush_locked(self, session_id: Optional[str] = None) -> None:
+        with self._lock:
+            if session_id is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {session_id: self._pending.pop(session_id)} if session_id in self._pending else {}
+        for sid, messages in batch.items():
+            try:
+                self.cold(sid).add_messages(messages)
+            except Exception as e:
+                logger.warning("聊天记录写回失败，稍后重试（session_id = %s）：%r", sid, e)
+                with self._lock:
+                    self._pending[sid] = messages + self._pending.get(sid, [])
+                continue
+            with self._lock:
+                self.stats.flushes += 1
+                self.stats.flushed_messages += len(messages)
+
+    def _start_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="history-flush", daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """停止后台写回线程，并写回剩余的消息"""
+        self._stop.set()
+        if self.cold is not None:
+            self.flush()
+
+    def history(self, session_id: str) -> "MemoryChatMessageHistory":
+        """某个会话的聊天记录视图（历史记录工厂）"""
+        return MemoryChatMessageHistory(session_id, self)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**asdict(self.stats), "sessions": len(self._sessions),
+                    "pending": sum(len(m) for m in self._pending.values())}
+
+
+class MemoryChatMessageHistory(BaseChatMessageHistory):
+    """SessionStore中某个会话的聊天记录视图，可直接交给RunnableWithMessageHistory"""
+
+    def __init__(self, session_id: str, store: SessionStore):
+        self.session_id = session_id
+        self.store = store
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        return self.store.get(self.session_id)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return await self.store.aget(self.session_id)
+
+    def numbered(self) -> Tuple[int, List[BaseMessage]]:
+        return self.store.numbered(self.session_id)
+
+    async def anumbered(self) -> Tuple[int, List[BaseMessage]]:
+        return await self.store.anumbered(self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        #内存中同样只保存媒体的blob引用
+        self.store.add(self.session_id, get_blob_store().externalize_all(list(messages)))
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        #只写内存，写回数据库由后台线程完成
+        self.store.add(self.session_id, await get_blob_store().aexternalize_all(list(messages)))
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
+
+    async def aclear(self) -> None:
+        await asyncio.to_thread(self.store.clear, self.session_id)
+
+
+def build_history_factory(backend: Optional[str] = None) -> Callable[[str], BaseChatMessageHistory]:
+    """
+    按配置选择聊天记录后端：
+    memory：只在内存中（进程重启后丢失）；postgres：每轮读写数据库；tiered：热会话在内存，冷会话与持久化在Postgres
+    """
+    backend = backend or settings.history_backend
+    if backend == "postgres":
+        return lambda session_id: PooledPostgresChatMessageHistory(session_id=session_id)
+    if backend == "memory":
+        store = SessionStore()
+    elif backend == "tiered":
+        store = SessionStore(cold=lambda session_id: PooledPostgresChatMessageHistory(
+            session_id=session_id, limit=settings.history_max_messages))
+    else:
+        raise ValueError(f"未知的聊天记录后端：{backend}，可选：{'/'.join(HISTORY_BACKENDS)}")
+    REGISTRY.register_stats("history_store", store.snapshot)
+    #工厂是store的绑定方法，分页读取历史时可以先写回该会话尚未落库的消息（见history_reader）
+    return store.history
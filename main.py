@@ -1,13 +1,27 @@
-from cProfile import label
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import TYPE_CHECKING, Optional
 
 from langchain_core.prompts import ChatPromptTemplate,MessagesPlaceholder
-from langchain_openai import ChatOpenAI
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories.postgres import PostgresChatMessageHistory
-from config import get_settings
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from config import get_settings, setup_logging
+
+#导入本模块时只定义提示词和组装函数，不创建任何客户端、连接池或处理链：
+#项目内的其他模块（摘要/数据库、回答缓存、长期记忆、外部调用调度、埋点等）和langchain_openai、
+#RunnableWithMessageHistory等较重的模块，都在第一次组装链或创建对象时才导入（见ChatApp）
+if TYPE_CHECKING:
+    from context import ContextWindow
+    from memory import LongTermMemory
+    from response_cache import ResponseCache
+    from summary import RollingSummarizer, SummaryWorker
 
 setting = get_settings()
+#日志级别由Settings.log_level控制
+setup_logging()
+logger = logging.getLogger(__name__)
 
 #提示词模板
 prompt = ChatPromptTemplate.from_messages([
@@ -16,121 +30,405 @@ prompt = ChatPromptTemplate.from_messages([
     ('human', '{input}')
 ])
 
-#实例化大模型对象
-llm = ChatOpenAI(
-    model = setting.openai_model,
-    streaming=True,
-)
-
-chain = prompt | llm
-
-#存储聊天记录：（内存，关系型数据库或者redis数据库、Postgresql）
-
-store = {} #用來保留所有所有历史消息，key: 会话ID session_id
-
-
-def get_session_history(session_id: str):
-    """从内存中的历史消息列表中，回复当前会话的所有历史消息"""
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
-    return store[session_id]
-
-#实现Postgresql链接以持久化存储
-DB_URI = "postgresql://{}:{}@{}:{}/{}?sslmode=disable".format(
-setting.postgres_myusername,
-setting.postgres_mypassword,
-setting.postgres_host,
-setting.postgres_port,
-setting.postgres_mydatabase,
-)
-def get_session_history_from_postgres(session_id: str):
-    # print(f"🧾 正在加载历史记录，session_id = {session_id}")
-    return PostgresChatMessageHistory(
-        session_id=session_id,
-        connection_string=DB_URI
-    )
-
 #langchain中所有消息类型：SystemMessage, HumanMessage, AIMessage, ToolMessage
 
-#创建带历史记录的处理链
-#√已完成:切分聊天上下文，形成摘要记忆以节省token
-chain_with_message_history = RunnableWithMessageHistory(
-    chain,
-    get_session_history= get_session_history_from_postgres,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-)
-'''
-关于history_messages_key参数
-告诉 LangChain 传入 chain 前，取得的历史消息要存在哪个字段里。
-注意：💬 如果你在 .invoke() 时手动传入了 "chat_history" 字段，LangChain 仍然会从数据库加载历史，但不会覆盖你传入的内容。
-'''
-
-#剪辑和摘要上下文历史记录：最近前k条数据，把之前的消息形成摘要 
-def summarize_messages(current_input, k: int =2):
+#剪辑和摘要上下文历史记录：按token预算保留最近的消息，把之前的消息形成摘要
+def summarize_messages(current_input, summarizer: "RollingSummarizer", window: "ContextWindow",
+                       background: bool = False, memory: Optional["LongTermMemory"] = None):
     """剪辑和摘要上下文，历史记录"""
+    from blobstore import get_blob_store
     session_id = current_input['config']['configurable']['session_id']
     if not session_id:
         raise ValueError("必须通过config参数提供session_id")
     
-    #获取当前会话id的历史聊天记录
-    chat_history = get_session_history_from_postgres(session_id)#返回的类型是：PostgresChatMessageHistory对象
-    stored_messages = chat_history.messages#通过history对象调取messages
-    print(f"🧾 正在加载历史记录，内容为：{stored_messages}")
-    if len(stored_messages)<=k:#保留最近k条历史记录
-        return {
-        "original_messages": stored_messages,
-        "summary": None
-    }
-    
-    #剪辑消息列表
-    last_k_messages = stored_messages[-k:]#保留的k条消息
-    messages_to_summarize = stored_messages[:-k]#需要总结的消息
-
-    summarization_prompt = ChatPromptTemplate.from_messages([
-        ("system", "请将下列历史对话压缩为一条保留关键消息的摘要信息，不丢失信息密度"),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human","请生成包含上述对话核心内容的摘要，保留重要事实和决策。")
-    ])
-    summarization_chain = summarization_prompt | llm
-    #生成摘要(AIMessage)
-    summary_message = summarization_chain.invoke({"chat_history": messages_to_summarize})
-
-    #重建历史记录：摘要+最后k条消息
+    #当前会话的历史聊天记录：由final_chain外层的RunnableWithMessageHistory每轮加载一次，不再重复查询数据库
+    stored_messages = current_input['stored_messages']
+    logger.debug("正在加载历史记录，共%d条", len(stored_messages))
+
+    #旧消息中的图片/音频替换成占位文字后按token计数，只有超出预算时才需要摘要
     #能否不影响数据库中存储的历史记录？已经解决＜（＾－＾）＞
-    '''
-    chat_history.clear()
-    chat_history.add_message(summary_message)
-    for msg in last_k_messages:
-        chat_history.add_message(msg)
-    return True
-    '''
+    selection = window.select(stored_messages)
+    if background:
+        #摘要由后台线程在上一轮写入后更新，这里只读取已完成的摘要，不等大模型
+        recent_messages, summary = summarizer.latest(session_id, selection.messages, selection.boundary)
+    else:
+        recent_messages, summary = summarizer.summarize_until(session_id, selection.messages, selection.boundary)
+    #长期记忆：移出窗口的消息增量建立索引（开启后台摘要时由后台线程完成），再按本轮问题取回最相关的几条
+    memories = ""
+    if memory is not None:
+        if not background:
+            memory.index(session_id, selection.messages, selection.boundary)
+        memories = memory.recall(session_id, current_input['input'], exclude=recent_messages)
+    #窗口内仍保留媒体的消息，此时才从blob存储还原为data URL
+    recent_messages = get_blob_store().resolve_all(recent_messages)
+
     #返回结构化结果（不调用chat_history.clear()）
     return {
-        "original_messages": last_k_messages,
-        "summary": summary_message 
+        "original_messages": recent_messages,
+        "summary": summary,
+        "memories": memories,
     }
 
-#最终的链,使用RunnablePassthrough方法，默认将输入数据原样传递到下游，而.assign()方法允许在保留原始输入的同时，通过指定键对（message_summarized=summarization）将Dict中新加一个键值对
-from langchain_core.runnables import RunnablePassthrough
-final_chain = (RunnablePassthrough.assign(messages_summaried=summarize_messages)
-               | RunnablePassthrough.assign(
-            input=lambda x: x['input'],
-            chat_history=lambda x: x['messages_summaried']['original_messages'],
-            system_message=lambda
-                x: f"你是一个乐于助人的助手：小秘。尽你所能回答所有问题。摘要：{x['messages_summaried']['summary']}"
-            if x['messages_summaried'].get("summary") else "无摘要")
-               | chain_with_message_history)
-
-#配置文件，使大模型识别会话id
-session_id = "KKZ"
-config = {"configurable": {"session_id": session_id}}
+async def asummarize_messages(current_input, summarizer: "RollingSummarizer", window: "ContextWindow",
+                              background: bool = False, memory: Optional["LongTermMemory"] = None):
+    """summarize_messages的异步版本，astream/ainvoke时使用"""
+    from blobstore import get_blob_store
+    session_id = current_input['config']['configurable']['session_id']
+    if not session_id:
+        raise ValueError("必须通过config参数提供session_id")
+    selection = window.select(current_input['stored_messages'])
+    if background:
+        recent_messages, summary = await summarizer.alatest(session_id, selection.messages, selection.boundary)
+    else:
+        recent_messages, summary = await summarizer.asummarize_until(session_id, selection.messages, selection.boundary)
+    memories = ""
+    if memory is not None:
+        if not background:
+            await asyncio.to_thread(memory.index, session_id, selection.messages, selection.boundary)
+        memories = await memory.arecall(session_id, current_input['input'], exclude=recent_messages)
+    recent_messages = await get_blob_store().aresolve_all(recent_messages)
+    return {
+        "original_messages": recent_messages,
+        "summary": summary,
+        "memories": memories,
+    }
 
-def get_final_chain():
-    return final_chain
-def get_config(session_id: str = "KKZ"):
-    return {"configurable": {"session_id": session_id}}
-# result3 = final_chain.invoke({"input":"我的名字叫什么？", "config":config}, config=config)
-# print(result3)
+def join_system(system_message: str, memories: str) -> str:
+    """把长期记忆取回的文字接在系统提示词后面（只有开头一条系统消息，部分兼容服务不接受中途的系统消息）"""
+    return f"{system_message}\n\n{memories}" if memories else system_message
+
+#每轮的处理链,使用RunnablePassthrough方法，默认将输入数据原样传递到下游，而.assign()方法允许在保留原始输入的同时，通过指定键对（message_summarized=summarization）将Dict中新加一个键值对
+def build_final_chain(llm, get_session_history, summarizer: "RollingSummarizer", window: Optional["ContextWindow"] = None,
+                      worker: Optional["SummaryWorker"] = None, cache: Optional["ResponseCache"] = None,
+                      memory: Optional["LongTermMemory"] = None):
+    """
+    用给定的大模型、历史记录工厂、摘要器和上下文窗口组装最终链（基准测试中可传入本地假模型）
+    传入worker时摘要在后台更新，worker应使用同一个历史记录工厂；传入cache时相同上下文中重复的问题直接返回缓存的回答
+    传入memory时每轮从长期记忆中取回与问题相关的较早消息，按时间顺序并入开头的系统提示词（摘要之后）
+    """
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    from context import get_context_window
+    window = window or get_context_window()
+    background = worker is not None
+    answer = prompt | llm
+    if cache is not None:
+        from response_cache import CachedChain, context_digest
+        #回答缓存放在“提示词 | 大模型”前面：问题是本轮输入，上下文是摘要（不含窗口内的历史，见context_digest）
+        answer = CachedChain(
+            answer, cache,
+            question=lambda x: x['input'] if isinstance(x['input'], str) else None,
+            context=lambda x: context_digest(x['messages_summaried'].get('summary')),
+            namespace="text",
+        )
+    summarize = RunnableLambda(
+        lambda x: summarize_messages(x, summarizer=summarizer, window=window, background=background, memory=memory),
+        afunc=lambda x: asummarize_messages(x, summarizer=summarizer, window=window, background=background,
+                                            memory=memory),
+    ).with_config(run_name="summarize_messages")
+    turn_chain = (RunnablePassthrough.assign(messages_summaried=summarize)
+                   | RunnablePassthrough.assign(
+                input=lambda x: x['input'],
+                chat_history=lambda x: x['messages_summaried']['original_messages'],
+                system_message=lambda x: join_system(
+                    f"你是一个乐于助人的助手：小秘。尽你所能回答所有问题。摘要：{x['messages_summaried']['summary']}"
+                    if x['messages_summaried'].get("summary") else "无摘要",
+                    x['messages_summaried']['memories']))
+                   | answer)
+
+    #创建带历史记录的最终链
+    #√已完成:切分聊天上下文，形成摘要记忆以节省token
+    return RunnableWithMessageHistory(
+        turn_chain,
+        get_session_history= worker.history_factory if background else get_session_history,
+        input_messages_key="input",
+        history_messages_key="stored_messages",
+    )
+
+#多模态对话的提示词模板：历史和本轮消息（文字、图片、音频片段）分别放在history和messages字段
+multimodal_prompt = ChatPromptTemplate.from_messages([
+    ('system', '你是一个多模态AI助手，能够理解用户发送的文本、图片和音频消息，并进行有意义的回复。并根据用户的输入内容，结合上下文信息，生成准确且相关的回答。摘要：{summary}{long_term_memory}' ),
+    MessagesPlaceholder(variable_name="history", optional=True),
+    MessagesPlaceholder(variable_name="messages")
+])
+
+def build_multimodal_chain(llm, get_session_history, summarizer: "RollingSummarizer", window: Optional["ContextWindow"] = None,
+                           worker: Optional["SummaryWorker"] = None, cache: Optional["ResponseCache"] = None,
+                           memory: Optional["LongTermMemory"] = None):
+    """组装多模态前端使用的带历史记录的处理链（基准测试中可传入本地假模型）"""
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    from blobstore import get_blob_store
+    from context import get_context_window
+    from memory import message_text
+    window = window or get_context_window()
+    background = worker is not None
+
+    #按token预算切分历史：旧消息中的图片/音频换成占位文字，超出预算的部分折叠进摘要
+    def fit_history(x, config):
+        session_id = config["configurable"]["session_id"]
+        selection = window.select(x.get("history", []))
+        #开启后台摘要时只读取已完成的摘要，不在回答前等待大模型
+        fold = summarizer.latest if background else summarizer.summarize_until
+        history, summary = fold(session_id, selection.messages, selection.boundary)
+        memories = ""
+        if memory is not None:
+            if not background:
+                memory.index(session_id, selection.messages, selection.boundary)
+            #本轮消息中的文字作为检索问题，图片/音频按占位文字计
+            query = "\n".join(message_text(m) for m in x["messages"])
+            memories = memory.recall(session_id, query, exclude=history)
+        #历史中的媒体只保存了blob引用，窗口内需要重新发送的才还原
+        history = get_blob_store().resolve_all(history)
+        return {**x, "history": history, "summary": summary or "无", "long_term_memory": join_system("", memories)}
+
+    async def afit_history(x, config):
+        session_id = config["configurable"]["session_id"]
+        selection = window.select(x.get("history", []))
+        fold = summarizer.alatest if background else summarizer.asummarize_until
+        history, summary = await fold(session_id, selection.messages, selection.boundary)
+        memories = ""
+        if memory is not None:
+            if not background:
+                await asyncio.to_thread(memory.index, session_id, selection.messages, selection.boundary)
+            query = "\n".join(message_text(m) for m in x["messages"])
+            memories = await memory.arecall(session_id, query, exclude=history)
+        history = await get_blob_store().aresolve_all(history)
+        return {**x, "history": history, "summary": summary or "无", "long_term_memory": join_system("", memories)}
+
+    answer = multimodal_prompt | llm
+    if cache is not None:
+        from response_cache import CachedChain, context_digest, message_question
+        #只有纯文字的消息使用回答缓存，带图片/音频的消息照常调用大模型
+        answer = CachedChain(answer, cache, question=lambda x: message_question(x['messages']),
+                             context=lambda x: context_digest(x['summary']),
+                             namespace="multimodal")
+    chain = RunnableLambda(fit_history, afunc=afit_history).with_config(run_name="fit_history") | answer
+    return RunnableWithMessageHistory(
+        chain,
+        worker.history_factory if background else get_session_history,
+        input_messages_key="messages",
+        history_messages_key="history",
+    )
+
+_UNSET = object()
 
 
+def _lazy(build):
+    """只在第一次访问时调用build创建，之后返回同一个对象；并发的第一次访问只创建一次"""
+    attr = f"_{build.__name__}"
+
+    @property
+    @wraps(build)
+    def getter(self):
+        value = self.__dict__.get(attr, _UNSET)
+        if value is _UNSET:
+            with self._lock:
+                value = self.__dict__.get(attr, _UNSET)
+                if value is _UNSET:
+                    value = self.__dict__[attr] = build(self)
+        return value
+    return getter
+
+
+class ChatApp:
+    """
+    应用工厂：大模型客户端、聊天记录后端、摘要器和处理链都在第一次使用时才创建，之后整个进程复用
+    前端导入时不再付出这些开销；启动后可调用warm_up在后台线程中提前创建，首个请求不必等待
+    """
+
+    def __init__(self, llm=None, multimodal_llm=None, get_session_history=None, summarizer=None):
+        from metrics import REGISTRY
+        from sessions import SessionLocks
+        #可传入现成的对象（基准测试中换成本地假模型/假历史记录/内存摘要），未传入的按配置创建
+        self._lock = threading.RLock()
+        if llm is not None:
+            self._llm = llm
+        if multimodal_llm is not None:
+            self._multimodal_llm = multimodal_llm
+        if get_session_history is not None:
+            self._get_session_history = get_session_history
+        if summarizer is not None:
+            self._summarizer = summarizer
+        #异步路径的并发上限：同时进行的对话轮数由信号量控制，而不是由线程数决定
+        #信号量绑定在第一次等待它的事件循环上，按事件循环各建一份，见turn_semaphore
+        self._turn_semaphores = {}
+        #同一会话的对话轮依次执行（例如同一用户开了两个标签页）
+        self.session_locks = SessionLocks()
+        REGISTRY.register_stats("sessions", self.session_locks.snapshot)
+
+    @property
+    def turn_semaphore(self) -> asyncio.Semaphore:
+        """当前事件循环的并发信号量（只能在事件循环中访问）；已关闭的循环的信号量随时清理"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._turn_semaphores.get(loop)
+            if semaphore is None:
+                for closed in [other for other in self._turn_semaphores if other.is_closed()]:
+                    del self._turn_semaphores[closed]
+                semaphore = self._turn_semaphores[loop] = asyncio.Semaphore(setting.max_concurrent_turns)
+        return semaphore
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        """
+        一轮对话的准入：先按会话排队，再占用全局并发名额
+        排队等待同一会话的轮次不占用并发名额；从加载历史到写入历史都在锁内，同一会话的两轮不会交错
+        """
+        async with self.session_locks.hold(session_id), self.turn_semaphore:
+            yield
+
+    @_lazy
+    def llm(self):
+        #实例化大模型对象（openai客户端导入较慢，放到这里按需导入）
+        #请求经过服务商调度（限速、限并发、退避重试），客户端自带的重试关闭，避免两层重试叠加
+        from langchain_openai import ChatOpenAI
+        from outbound import schedule_chat_model
+        return schedule_chat_model(ChatOpenAI(
+            model = setting.openai_model,
+            streaming=True,
+            stream_usage=True,  # 流式输出时也返回token用量，供埋点统计
+            max_retries=0 if setting.outbound_enabled else 2,
+        ), "openai")
+
+    @_lazy
+    def multimodal_llm(self):
+        #全模态大模型
+        from langchain_openai import ChatOpenAI
+        from outbound import schedule_chat_model
+        return schedule_chat_model(ChatOpenAI(
+            model=setting.dashscope_model,
+            api_key=setting.dashscope_api_key,
+            base_url=setting.dashscope_base_url,
+            stream_usage=True,
+            max_retries=0 if setting.outbound_enabled else 2,
+        ), "dashscope")
+
+    @_lazy
+    def get_session_history(self):
+        #存储聊天记录：（内存，关系型数据库或者redis数据库、Postgresql）
+        #由Settings.history_backend选择：memory（有界内存）、postgres（共享连接池，每轮读写数据库）、
+        #tiered（热会话常驻内存不再每轮查库，新消息批量写回Postgres）
+        from history_store import build_history_factory
+        return build_history_factory()
+
+    @_lazy
+    def history_reader(self):
+        #打开页面时分页回放历史：postgres/tiered按(session_id, id)键集分页查询，memory从内存中分页
+        from history_reader import build_history_reader
+        return build_history_reader(self.get_session_history)
+
+    @_lazy
+    def window(self):
+        #按token预算切分上下文：历史不超过预算时原样保留，超出时最近的消息放进窗口，更早的折叠进摘要
+        from context import get_context_window
+        from media_cache import get_media_cache
+        from metrics import REGISTRY
+        window = get_context_window()
+        #各组件已有的命中计数，在/metrics被请求时读取
+        REGISTRY.register_stats("media_cache", lambda: get_media_cache().snapshot())
+        REGISTRY.register_stats("token_cache", lambda: {"hits": window.counter.hits, "misses": window.counter.misses})
+        return window
+
+    @_lazy
+    def summarizer(self):
+        #滚动摘要：摘要与水位线按会话持久化在Postgres中，每轮只折叠新移出窗口的消息
+        #后台摘要没有外层config，埋点回调直接挂在摘要链上
+        #后台摘要与回答共用服务商的限额，排队时让回答先走；同步摘要在回答路径上，仍按交互优先级
+        from metrics import get_metrics_handler
+        from outbound import BACKGROUND, INTERACTIVE, with_priority
+        from summary import PostgresSummaryStore, RollingSummarizer
+        llm = with_priority(self.llm, BACKGROUND if setting.summary_background else INTERACTIVE)
+        return RollingSummarizer(llm, PostgresSummaryStore(), callbacks=[get_metrics_handler()])
+
+    @_lazy
+    def summary_worker(self):
+        #后台摘要：每轮写入数据库后由线程池更新摘要，同一会话的连续多轮只排一次
+        if not setting.summary_background:
+            return None
+        from metrics import REGISTRY
+        from summary import SummaryWorker
+        worker = SummaryWorker(self.summarizer, self.get_session_history, self.window, memory=self.memory)
+        REGISTRY.register_stats("summary_worker", lambda: {"runs": worker.runs, "skipped": worker.skipped})
+        return worker
+
+    @_lazy
+    def memory(self):
+        #长期记忆：移出窗口的消息建立向量索引，两条链共用；未开启时为None
+        from memory import build_memory
+        from metrics import REGISTRY
+        memory = build_memory()
+        if memory is not None:
+            REGISTRY.register_stats("memory", lambda: {"embedded": memory.embedded})
+        return memory
+
+    @_lazy
+    def response_cache(self):
+        #回答缓存：默认关闭；两条链共用，界面上的开关按会话调用disable/enable
+        if not setting.response_cache_enabled:
+            return None
+        from metrics import REGISTRY
+        from response_cache import ResponseCache, build_embeddings
+        cache = ResponseCache(build_embeddings())
+        REGISTRY.register_stats("response_cache", cache.snapshot)
+        return cache
+
+    @_lazy
+    def final_chain(self):
+        return build_final_chain(self.llm, self.get_session_history, self.summarizer, window=self.window,
+                                 worker=self.summary_worker, cache=self.response_cache, memory=self.memory)
+
+    @_lazy
+    def multimodal_chain(self):
+        #历史单独放在history字段，每轮只读一次数据库，结束后一问一答批量写入（写入后调度后台摘要）
+        return build_multimodal_chain(self.multimodal_llm, self.get_session_history, self.summarizer,
+                                      window=self.window, worker=self.summary_worker, cache=self.response_cache,
+                                      memory=self.memory)
+
+    def warm_up(self, *names: str, background: bool = True) -> Optional[threading.Thread]:
+        """提前创建names中的对象（如"final_chain"）；background为True时在后台线程中进行，服务可以先开始监听"""
+        def build():
+            for name in names:
+                try:
+                    getattr(self, name)
+                except Exception as e:
+                    logger.warning("预先创建%s失败，将在第一次使用时重试：%r", name, e)
+        if not background:
+            build()
+            return None
+        thread = threading.Thread(target=build, name="app-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+'''
+关于history_messages_key参数
+告诉 LangChain 传入 chain 前，取得的历史消息要存在哪个字段里。
+注意：💬 该字段会覆盖输入中同名的内容，所以历史快照放在stored_messages里，摘要后的窗口再放进chat_history。
+每轮只从数据库读取一次历史（摘要和回答两个阶段共用这份快照），
+结束后本轮的用户消息和AI回复通过add_messages一次批量写入。
+'''
+
+_app: Optional[ChatApp] = None
+_app_lock = threading.Lock()
+
+
+def get_app() -> ChatApp:
+    """获取进程内共享的应用实例，第一次调用时创建（此时还不会创建任何客户端）"""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = ChatApp()
+    return _app
+
+def get_final_chain():
+    return get_app().final_chain
+def get_turn_semaphore():
+    return get_app().turn_semaphore
+#配置文件，使大模型识别会话id；callbacks让每轮的各阶段进入监控指标（埋点回调：各阶段耗时、首token延迟、token用量）
+#session_id由前端在页面加载时按用户/浏览器分配（见sessions.assign_session_id），不再使用全局固定的会话
+def get_config(session_id: str):
+    from metrics import get_metrics_handler
+    return {"configurable": {"session_id": session_id}, "callbacks": [get_metrics_handler()]}
+# config = get_config("KKZ")
+# result3 = get_final_chain().invoke({"input":"我的名字叫什么？", "config":config}, config=config)
+# print(result3)
\ No newline at end of file
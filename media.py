@@ -0,0 +1,684 @@
+"""
+媒体预处理模块：上传给ASR或全模态大模型之前，先把音频和图片压缩到模型需要的大小
+大文件按块流式处理：base64编码、音频解码切段、视频抽音轨和关键帧都不会把整个文件读入内存
+"""
+
+import asyncio
+import base64
+import functools
+import io
+import logging
+import math
+import multiprocessing
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import get_settings
+from media_cache import content_hash, get_media_cache
+from metrics import timed
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+#可选的压缩编码：编码名 -> (ffmpeg容器格式, ffmpeg编码器, MIME类型)
+AUDIO_CODECS = {
+    "flac": ("flac", "flac", "audio/flac"),
+    "mp3": ("mp3", "libmp3lame", "audio/mpeg"),
+    "opus": ("ogg", "libopus", "audio/ogg"),
+}
+
+
+#MIME类型 -> 文件扩展名（上传时用作文件名）
+AUDIO_EXTENSIONS = {
+    "audio/wav": "wav",
+    "audio/mp4": "m4a",
+    "audio/mpeg": "mp3",
+    "audio/ogg": "ogg",
+    "audio/flac": "flac",
+    "audio/webm": "webm",
+}
+
+
+class MediaTooLarge(ValueError):
+    """文件超过上传上限，或编码后的片段超过发给模型的payload上限"""
+
+
+class AudioTooLong(MediaTooLarge):
+    """事先无法获取时长的录音，解码时发现超过media_max_audio_seconds"""
+
+
+def check_upload_size(path: str) -> int:
+    """读取内容之前先检查文件大小，超过media_max_upload_bytes时拒绝"""
+    size = Path(path).stat().st_size
+    if size > settings.media_max_upload_bytes:
+        raise MediaTooLarge(f"文件{size}字节，超过上传上限{settings.media_max_upload_bytes}字节")
+    return size
+
+
+def check_payload(encoded_bytes: int) -> None:
+    """base64编码后的单个媒体片段不超过media_max_payload_bytes"""
+    if encoded_bytes > settings.media_max_payload_bytes:
+        raise MediaTooLarge(f"编码后{encoded_bytes}字节，超过payload上限{settings.media_max_payload_bytes}字节")
+
+
+def base64_size(raw_bytes: int) -> int:
+    return (raw_bytes + 2) // 3 * 4
+
+
+def b64encode_file(path: str, chunk_size: Optional[int] = None) -> str:
+    """
+    流式base64：按3的倍数分块读取，逐块编码写入预先分配好的缓冲区，
+    原文件不会整个读入内存，也没有“原始字节 + 编码字节”两份同时存在
+    """
+    chunk_size = chunk_size or settings.media_read_chunk_bytes
+    chunk_size = max(3, chunk_size - chunk_size % 3)  # 3字节对齐，块之间不会出现填充符
+    out = bytearray(base64_size(Path(path).stat().st_size))
+    view, offset = memoryview(out), 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            encoded = base64.b64encode(chunk)
+            view[offset:offset + len(encoded)] = encoded
+            offset += len(encoded)
+    return out[:offset].decode("ascii") if offset != len(out) else out.decode("ascii")
+
+
+@dataclass
+class PreparedAudio:
+    """预处理后的音频：data是可直接上传的字节，duration为实际时长（秒，无法解码时为None）"""
+    data: bytes
+    mime: str
+    sample_rate: Optional[int]
+    duration: Optional[float]
+    original_bytes: int
+
+
+def sniff_audio_mime(data: bytes) -> str:
+    """根据文件头判断音频的真实格式（浏览器录音常常是扩展名为.wav的m4a）"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "audio/wav"
+    if data[4:8] == b"ftyp":
+        return "audio/mp4"
+    if data[:4] == b"OggS":
+        return "audio/ogg"
+    if data[:4] == b"fLaC":
+        return "audio/flac"
+    if data[:3] == b"ID3" or data[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if data[:4] == b"\x1aE\xdf\xa3":
+        return "audio/webm"
+    return "audio/wav"
+
+
+def _pcm_to_float(raw: bytes, width: int, channels: int) -> np.ndarray:
+    """PCM字节 -> 形状为(帧数, 声道数)、取值在[-1, 1]的float32数组"""
+    if width == 1:
+        samples = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, "<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(raw, "<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise wave.Error(f"不支持的采样位宽：{width}字节")
+    return samples.reshape(-1, channels)
+
+
+def _sniff_file(path: str) -> str:
+    """只读文件头判断音频格式"""
+    with open(path, "rb") as f:
+        return sniff_audio_mime(f.read(16))
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """不解码地获取时长（秒）：WAV读文件头，其它格式用ffprobe；都不行时返回None"""
+    try:
+        if _sniff_file(path) == "audio/wav":
+            with wave.open(path) as wav:
+                return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        pass
+    if not shutil.which("ffprobe"):
+        return None
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        capture_output=True, text=True,
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def iter_audio_chunks(path: str, seconds: float, target_rate: int) -> Iterator[np.ndarray]:
+    """
+    按seconds秒一块流式解码为target_rate的单声道float32，内存中同时只有一块
+    PCM WAV用wave逐块读取，其它格式用ffmpeg解码到管道后逐块读取；都不行时抛出wave.Error
+    """
+    if _sniff_file(path) == "audio/wav":
+        with wave.open(path) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            frames = max(1, int(seconds * rate))
+            while True:
+                raw = wav.readframes(frames)
+                if not raw:
+                    return
+                yield resample(downmix(_pcm_to_float(raw, width, channels)), rate, target_rate)
+    if not shutil.which("ffmpeg"):
+        raise wave.Error("不是PCM WAV，且没有安装ffmpeg，无法分段解码")
+    process = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-i", path, "-f", "f32le", "-ac", "1", "-ar", str(target_rate), "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    try:
+        size = max(1, int(seconds * target_rate)) * 4
+        for raw in iter(lambda: process.stdout.read(size), b""):
+            yield np.frombuffer(raw[:len(raw) - len(raw) % 4], "<f4")
+    finally:
+        process.kill()
+        process.wait()
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """多声道取平均混为单声道"""
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+@functools.lru_cache(maxsize=16)
+def lowpass_kernel(rate: int, target_rate: int) -> np.ndarray:
+    """
+    降采样前的抗混叠FIR：Blackman窗的sinc，截止频率取目标奈奎斯特频率的90%
+    抽头数随降采样倍数增加（48k->16k为97个），过渡带约为目标采样率的六分之一
+    """
+    ratio = rate / target_rate
+    taps = 2 * int(math.ceil(16 * ratio)) + 1
+    cutoff = 0.9 * 0.5 / ratio  # 相对输入采样率的归一化截止频率
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample(samples: np.ndarray, rate: int, target_rate: int) -> np.ndarray:
+    """
+    重采样：降采样先用lowpass_kernel低通（高于目标奈奎斯特频率的成分不会混叠回语音频段），
+    整数倍时直接抽取，其余情况线性插值；升采样直接线性插值
+    分块调用（iter_audio_chunks、实时语音）时每块单独滤波，块边缘有半个滤波器长度的过渡，对识别没有影响
+    """
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    if rate > target_rate:
+        samples = np.convolve(samples.astype(np.float32, copy=False), lowpass_kernel(rate, target_rate),
+                              mode="same")
+        if rate % target_rate == 0:
+            return samples[::rate // target_rate]
+    n_out = int(round(len(samples) * target_rate / rate))
+    positions = np.arange(n_out) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, rate: int, threshold_db: float, padding: float,
+                 frame_ms: float = 20.0) -> np.ndarray:
+    """按20ms帧计算能量，去掉首尾低于阈值的静音段，两端各保留padding秒；整段都是静音时原样返回"""
+    frame = max(1, int(rate * frame_ms / 1000))
+    n = len(samples) // frame
+    if n == 0:
+        return samples
+    rms = np.sqrt(np.mean(np.square(samples[:n * frame].reshape(n, frame)), axis=1))
+    voiced = np.flatnonzero(20 * np.log10(np.maximum(rms, 1e-10)) > threshold_db)
+    if voiced.size == 0:
+        return samples
+    pad = int(padding * rate)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def _to_pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    """编码为16位单声道PCM WAV"""
+    buffered = io.BytesIO()
+    with wave.open(buffered, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(_to_pcm16(samples))
+    return buffered.getvalue()
+
+
+def encode_audio(samples: np.ndarray, rate: int, codec: str = "wav") -> Tuple[bytes, str]:
+    """按codec编码，返回（字节，MIME）；压缩编码需要ffmpeg，没有时退回WAV"""
+    if codec in AUDIO_CODECS and shutil.which("ffmpeg"):
+        fmt, encoder, mime = AUDIO_CODECS[codec]
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+             "-c:a", encoder, "-f", fmt, "pipe:1"],
+            input=_to_pcm16(samples), capture_output=True, check=True,
+        )
+        return result.stdout, mime
+    return encode_wav(samples, rate), "audio/wav"
+
+
+def _decode_audio(path: str, mime: str, target_rate: int, max_seconds: float) -> Optional[Tuple[np.ndarray, int]]:
+    """
+    按块解码为单声道float32，内存中只保留混音后的单声道数据，不读入原文件；超过max_seconds时抛出AudioTooLong
+    PCM WAV保持原采样率（之后整段重采样），其它格式由ffmpeg直接解码为target_rate；没有ffmpeg时返回None
+    """
+    if mime == "audio/wav":
+        with wave.open(path) as wav:
+            channels, width, rate, total = wav.getnchannels(), wav.getsampwidth(), wav.getframerate(), wav.getnframes()
+            if total > max_seconds * rate:
+                raise AudioTooLong(f"录音{total / rate:.0f}秒，超过{max_seconds:.0f}秒")
+            samples = np.empty(total, np.float32)
+            frames, offset = max(1, settings.media_read_chunk_bytes // (width * channels)), 0
+            while offset < total:
+                raw = wav.readframes(frames)
+                if not raw:
+                    break
+                chunk = downmix(_pcm_to_float(raw, width, channels))
+                samples[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+        return samples[:offset], rate
+    if not shutil.which("ffmpeg"):
+        return None
+    chunks, total = [], 0
+    for chunk in iter_audio_chunks(path, settings.asr_chunk_seconds, target_rate):
+        total += len(chunk)
+        if total > max_seconds * target_rate:
+            raise AudioTooLong(f"录音超过{max_seconds:.0f}秒")
+        chunks.append(chunk)
+    return (np.concatenate(chunks) if chunks else np.zeros(0, np.float32)), target_rate
+
+
+def _passthrough(audio_path: str, mime: str, duration: Optional[float] = None) -> PreparedAudio:
+    """无法解码时原样上传：超过payload上限的文件在读取之前就拒绝"""
+    size = Path(audio_path).stat().st_size
+    check_payload(base64_size(size))
+    return PreparedAudio(Path(audio_path).read_bytes(), mime, None, duration, size)
+
+
+def preprocess_audio(audio_path: str, target_rate: Optional[int] = None, codec: Optional[str] = None,
+                     trim: bool = True, max_seconds: Optional[float] = None) -> PreparedAudio:
+    """
+    上传前的音频预处理：混为单声道 -> 去掉首尾静音 -> 重采样到模型需要的采样率 -> 编码，并计算实际时长
+    PCM WAV逐块读取后用NumPy处理，其它格式有ffmpeg时逐块解码，否则原样返回（只修正MIME）；
+    解码后超过max_seconds（默认media_max_audio_seconds）时抛出AudioTooLong，内存占用不随文件大小增长
+    """
+    target_rate = target_rate or settings.audio_target_rate
+    codec = codec or settings.audio_codec
+    max_seconds = max_seconds or settings.media_max_audio_seconds
+    original_bytes = check_upload_size(audio_path)
+    mime = _sniff_file(audio_path)
+
+    try:
+        decoded = _decode_audio(audio_path, mime, target_rate, max_seconds)
+    except (wave.Error, EOFError, subprocess.CalledProcessError):
+        decoded = None
+    if decoded is None:
+        return _passthrough(audio_path, mime)
+    samples, rate = decoded
+
+    original_duration = len(samples) / rate
+    if trim:
+        samples = trim_silence(samples, rate, settings.audio_silence_threshold_db, settings.audio_silence_padding)
+    samples = resample(samples, rate, target_rate)
+    encoded, encoded_mime = encode_audio(samples, target_rate, codec)
+    #原文件本身已是压缩格式且比处理结果还小时，直接上传原文件
+    if len(encoded) >= original_bytes:
+        return _passthrough(audio_path, mime, original_duration)
+    return PreparedAudio(encoded, encoded_mime, target_rate, len(samples) / target_rate, original_bytes)
+
+
+#图片格式 -> MIME类型
+IMAGE_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+@dataclass
+class PreparedImage:
+    """预处理后的图片：data是可直接上传的字节，size为(宽, 高)"""
+    data: bytes
+    mime: str
+    size: Tuple[int, int]
+    original_bytes: int
+
+
+def _needs_rotation(img) -> bool:
+    """EXIF方向标记不为1时需要先旋转"""
+    return img.getexif().get(0x0112, 1) != 1
+
+
+def preprocess_image(image_path: str, max_edge: Optional[int] = None, fmt: Optional[str] = None,
+                     quality: Optional[int] = None, passthrough_bytes: Optional[int] = None) -> PreparedImage:
+    """
+    上传前的图片预处理，按"detail: low"的像素预算压缩：
+    1、文件足够小、尺寸不超过max_edge、格式模型可直接识别且不需要旋转时，跳过解码和重新编码
+    2、JPEG用draft模式在解码时直接按DCT缩放，其它格式用reduce快速缩小
+    3、按EXIF方向旋转，缩放到长边不超过max_edge，再以fmt/quality重新编码
+    """
+    from PIL import Image, ImageOps
+
+    max_edge = max_edge or settings.image_max_edge
+    fmt = (fmt or settings.image_format).upper()
+    quality = quality or settings.image_quality
+    passthrough_bytes = settings.image_passthrough_bytes if passthrough_bytes is None else passthrough_bytes
+    original_bytes = Path(image_path).stat().st_size
+
+    with Image.open(image_path) as img:
+        src_format = img.format or "JPEG"
+        if (original_bytes <= passthrough_bytes and max(img.size) <= max_edge
+                and src_format in IMAGE_MIME and not _needs_rotation(img)):
+            return PreparedImage(Path(image_path).read_bytes(), IMAGE_MIME[src_format], img.size, original_bytes)
+
+        if src_format == "JPEG":
+            #draft只能按1/2、1/4、1/8缩小，且结果不小于请求尺寸，后面再精确缩放
+            img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        #reducing_gap：先用reduce整数倍快速缩小，再做高质量重采样
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        if fmt == "JPEG" and img.mode != "RGB":
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            else:
+                img = img.convert("RGB")
+
+        buffered = io.BytesIO()
+        img.save(buffered, format=fmt, quality=quality)
+        return PreparedImage(buffered.getvalue(), IMAGE_MIME.get(fmt, f"image/{fmt.lower()}"), img.size, original_bytes)
+
+
+def _audio_params() -> dict:
+    return {
+        "preprocess": settings.audio_preprocess,
+        "rate": settings.audio_target_rate,
+        "codec": settings.audio_codec,
+        "threshold": settings.audio_silence_threshold_db,
+        "padding": settings.audio_silence_padding,
+        "max_seconds": settings.media_max_audio_seconds,
+    }
+
+
+def _image_params() -> dict:
+    return {
+        "max_edge": settings.image_max_edge,
+        "format": settings.image_format,
+        "quality": settings.image_quality,
+        "passthrough": settings.image_passthrough_bytes,
+    }
+
+
+def transcript_part(audio_path: str) -> dict:
+    """长录音不直接发给大模型：分段识别为文字，作为文本片段发送"""
+    from asr import transcribe_file
+    return {"type": "text", "text": f"[录音转写] {transcribe_file(audio_path)}"}
+
+
+def encode_audio_part(audio_path: str) -> dict:
+    """
+    把录音编码为全模态大模型的audio_url消息片段
+    超过media_max_audio_seconds的长录音改为分段识别后的文字，编码后仍超过payload上限时抛出MediaTooLarge
+    """
+    duration = probe_duration(audio_path)
+    if duration is not None and duration > settings.media_max_audio_seconds:
+        return transcript_part(audio_path)
+    if settings.audio_preprocess:
+        try:
+            prepared = preprocess_audio(audio_path)
+        except AudioTooLong:
+            return transcript_part(audio_path)
+        check_payload(base64_size(len(prepared.data)))
+        audio_data = base64.b64encode(prepared.data).decode('utf-8')
+        mime, duration = prepared.mime, prepared.duration
+    else:
+        check_payload(base64_size(check_upload_size(audio_path)))
+        audio_data, mime = b64encode_file(audio_path), "audio/wav"
+    return {
+        "type": "audio_url",
+        "audio_url": {
+            "url": f"data:{mime};base64,{audio_data}",
+            "duration": math.ceil(duration) if duration else 30 #单位：秒（帮助模型优化处理）
+        }
+    }
+
+
+def encode_image_part(image_path: str) -> dict:
+    """把图片编码为image_url消息片段"""
+    prepared = preprocess_image(image_path)
+    image_data = base64.b64encode(prepared.data).decode('utf-8')
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:{prepared.mime};base64,{image_data}",#MIME类型标准
+            "detail": "low"
+        }
+    }
+
+
+def _has_audio_stream(video_path: str) -> bool:
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0",
+         video_path],
+        capture_output=True, text=True,
+    )
+    return bool(result.stdout.strip())
+
+
+def extract_audio_track(video_path: str, out_path: str, rate: Optional[int] = None) -> Optional[str]:
+    """ffmpeg把视频的音轨解码为单声道16位WAV，直接写入文件；视频没有音轨时返回None"""
+    if not _has_audio_stream(video_path):
+        return None
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", video_path, "-vn", "-ac", "1", "-ar", str(rate or settings.audio_target_rate),
+         "-c:a", "pcm_s16le", out_path],
+        capture_output=True, check=True,
+    )
+    return out_path
+
+
+def sample_keyframes(video_path: str, out_dir: str, count: Optional[int] = None,
+                     duration: Optional[float] = None) -> List[str]:
+    """
+    在视频中均匀取count个时间点，每个时间点取其后的第一个关键帧：
+    -ss放在-i之前按索引跳转，-skip_frame nokey只解码关键帧，抽帧时直接缩放到image_max_edge以内
+    """
+    count = count or settings.video_keyframes
+    duration = duration or probe_duration(video_path) or 0.0
+    edge = settings.image_max_edge
+    frames = []
+    for i in range(count):
+        out = str(Path(out_dir) / f"frame_{i}.jpg")
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-skip_frame", "nokey", "-ss", f"{duration * (i + 0.5) / count:.3f}",
+             "-i", video_path, "-frames:v", "1", "-vf",
+             f"scale={edge}:{edge}:force_original_aspect_ratio=decrease", "-q:v", "3", out],
+            capture_output=True, check=True,
+        )
+        #时间点之后没有关键帧时ffmpeg不输出文件
+        if Path(out).exists():
+            frames.append(out)
+    return frames
+
+
+def encode_video_parts(video_path: str) -> List[dict]:
+    """
+    视频拆成若干关键帧图片片段和一个音频片段（长音轨同样转为文字），需要ffmpeg
+    中间文件写在临时目录中，处理完即删除
+    """
+    if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        raise RuntimeError("处理视频需要安装ffmpeg")
+    check_upload_size(video_path)
+    with tempfile.TemporaryDirectory(prefix="video_") as tmp:
+        parts = [encode_image_part(frame) for frame in sample_keyframes(video_path, tmp)]
+        audio = extract_audio_track(video_path, str(Path(tmp) / "audio.wav"))
+        if audio is not None:
+            parts.append(encode_audio_part(audio))
+    return parts
+
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp")
+AUDIO_SUFFIXES = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".webm")
+VIDEO_SUFFIXES = (".mp4", ".mov", ".mkv", ".avi", ".m4v")
+
+
+def media_kind(path: str) -> Optional[str]:
+    """按扩展名判断上传文件的类型：image/audio/video，不支持的类型返回None"""
+    suffix = Path(path).suffix.lower()
+    if suffix in IMAGE_SUFFIXES:
+        return "image"
+    if suffix in AUDIO_SUFFIXES:
+        return "audio"
+    if suffix in VIDEO_SUFFIXES:
+        return "video"
+    return None
+
+
+def sniff_image_mime(data: bytes) -> str:
+    """根据文件头判断图片格式，不需要解码"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"GIF8":
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def raw_file_part(path: str) -> dict:
+    """编码失败或超时时的兜底：不做任何处理，直接把原文件流式base64后发送；超过payload上限时抛出MediaTooLarge"""
+    check_payload(base64_size(Path(path).stat().st_size))
+    with open(path, "rb") as f:
+        head = f.read(16)
+    encoded = b64encode_file(path)
+    kind = media_kind(path)
+    if kind == "image":
+        return {"type": "image_url", "image_url": {"url": f"data:{sniff_image_mime(head)};base64,{encoded}", "detail": "low"}}
+    if kind == "video":
+        return {"type": "video_url", "video_url": {"url": f"data:video/mp4;base64,{encoded}"}}
+    return {"type": "audio_url",
+            "audio_url": {"url": f"data:{sniff_audio_mime(head)};base64,{encoded}", "duration": 30}}
+
+
+def skipped_file_part(path: str, reason: str) -> dict:
+    """连原文件也发不出去时（过大、无法读取），用一段文字告诉模型有一个文件没有发送"""
+    return {"type": "text", "text": f"[文件{Path(path).name}未发送：{reason}]"}
+
+
+#图片解码/编码是CPU密集型，放到进程池；文件读取和音频处理放到线程池。两个池都有上限
+#进程池用spawn启动：此时服务已有事件循环、数据库连接池和其他线程，fork出的子进程会继承它们持有的锁
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_executors() -> Tuple[ProcessPoolExecutor, ThreadPoolExecutor]:
+    global _process_pool, _thread_pool
+    if _process_pool is None:
+        with _pool_lock:
+            if _process_pool is None:
+                _thread_pool = ThreadPoolExecutor(settings.media_thread_workers, thread_name_prefix="media-io")
+                _process_pool = ProcessPoolExecutor(settings.media_process_workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool, _thread_pool
+
+
+def _is_long(kind: str, path: str) -> bool:
+    """视频和需要分段识别的长录音，耗时取决于时长和ASR服务，使用media_long_timeout"""
+    if kind == "video":
+        return True
+    if kind == "audio":
+        duration = probe_duration(path)
+        return duration is not None and duration > settings.media_max_audio_seconds
+    return False
+
+
+async def _prepare_parts(kind: str, path: str) -> List[dict]:
+    """一个文件的消息片段：图片、录音各一个，视频拆成关键帧和音轨多个"""
+    loop = asyncio.get_running_loop()
+    process_pool, thread_pool = _get_executors()
+    #超过上传上限的文件连摘要都不计算
+    await loop.run_in_executor(thread_pool, check_upload_size, path)
+    cache = get_media_cache()
+    if kind == "image":
+        params = _image_params()
+    elif kind == "video":
+        params = {**_image_params(), **_audio_params(), "keyframes": settings.video_keyframes}
+    else:
+        params = _audio_params()
+    key = cache.make_key(f"{kind}_parts", await loop.run_in_executor(thread_pool, content_hash, path), params)
+    parts = cache.get(key)
+    if parts is None:
+        if kind == "image":
+            parts = [await loop.run_in_executor(process_pool, encode_image_part, path)]
+        elif kind == "video":
+            parts = await loop.run_in_executor(thread_pool, encode_video_parts, path)
+        else:
+            parts = [await loop.run_in_executor(thread_pool, encode_audio_part, path)]
+        cache.set(key, parts)
+    return parts
+
+
+def _fallback_parts(path: str) -> List[dict]:
+    try:
+        return [raw_file_part(path)]
+    except MediaTooLarge as e:
+        return [skipped_file_part(path, str(e))]
+    except OSError as e:
+        return [skipped_file_part(path, f"无法读取（{type(e).__name__}）")]
+
+
+async def prepare_media_groups(paths: List[str], timeout: Optional[float] = None) -> List[List[dict]]:
+    """
+    并行准备一条消息中的所有媒体片段，每个文件一组，按paths的原顺序返回
+    图片和短录音共用media_timeout，视频和长录音用media_long_timeout；
+    超时或编码失败的文件退回为原文件，原文件超过payload上限时换成一段说明文字
+    """
+    timeout = settings.media_timeout if timeout is None else timeout
+    if not paths:
+        return []
+    loop = asyncio.get_running_loop()
+    _, thread_pool = _get_executors()
+    kinds = [media_kind(path) for path in paths]
+    long = await asyncio.gather(*(loop.run_in_executor(thread_pool, _is_long, kind, path)
+                                  for kind, path in zip(kinds, paths)))
+    tasks = [asyncio.wait_for(_prepare_parts(kind, path), settings.media_long_timeout if is_long else timeout)
+             for kind, path, is_long in zip(kinds, paths, long)]
+    with timed("media_encode"):
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    groups = []
+    for path, result in zip(paths, results):
+        if not isinstance(result, BaseException):
+            groups.append(result)
+            continue
+        if isinstance(result, MediaTooLarge):
+            logger.warning("媒体文件过大（%s），不发送：%s", result, path)
+            groups.append([skipped_file_part(path, str(result))])
+            continue
+        reason = "超时" if isinstance(result, asyncio.TimeoutError) else repr(result)
+        logger.warning("媒体编码失败（%s），改为发送原文件：%s", reason, path)
+        groups.append(await loop.run_in_executor(thread_pool, _fallback_parts, path))
+    return groups
+
+
+async def prepare_media_parts(paths: List[str], timeout: Optional[float] = None) -> List[dict]:
+    """prepare_media_groups按顺序展开为一个片段列表"""
+    return [part for group in await prepare_media_groups(paths, timeout) for part in group]
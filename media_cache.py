@@ -0,0 +1,169 @@
+"""按内容寻址的媒体缓存：编码好的data URL消息片段和ASR识别结果，重复的图片/录音不再重复编码和识别"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from config import get_settings, project_path
+
+settings = get_settings()
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """流式读取文件计算BLAKE2b摘要，大文件也不会一次读入内存"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def value_size(value: Any) -> int:
+    """估算值序列化后的字节数，内存层按它计算容量，不必为此先序列化（data URL是ASCII，按字符数计）"""
+    if isinstance(value, str):
+        return (len(value) if value.isascii() else len(value.encode("utf-8"))) + 2
+    if isinstance(value, dict):
+        return sum(value_size(k) + value_size(v) + 4 for k, v in value.items()) + 2
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(v) + 2 for v in value) + 2
+    return 8
+
+
+@dataclass
+class CacheStats:
+    """缓存计数：内存命中、磁盘命中、未命中、内存淘汰、磁盘淘汰"""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    memory_evictions: int = 0
+    disk_evictions: int = 0
+
+
+class MediaCache:
+    """
+    两级缓存：
+    1、内存LRU，直接保存值本身（命中时不再反序列化几MB的data URL），按估算的字节数计算容量，
+       超过memory_bytes时淘汰最久未用的条目；取回的值与缓存共用，调用方不要原地修改
+    2、可选的磁盘目录，超过disk_bytes时按最近访问时间淘汰；内存淘汰的条目仍可从磁盘取回
+    值必须能序列化为JSON（消息片段dict、识别文本str），只在写入磁盘时序列化
+    """
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str] = None, disk_bytes: int = 0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_bytes = disk_bytes
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()  # 键 -> (值, 估算字节数)
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(namespace: str, digest: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """缓存键：命名空间 + 内容摘要 + 影响输出的参数（如缩放尺寸、编码格式）"""
+        return f"{namespace}:{digest}:{json.dumps(params or {}, sort_keys=True)}"
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _put_memory(self, key: str, value: Any, size: int) -> None:
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= self._memory.pop(key)[1]
+            if size > self.memory_bytes:
+                return
+            self._memory[key] = (value, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_used -= evicted
+                self.stats.memory_evictions += 1
+
+    def _put_disk(self, key: str, blob: bytes) -> None:
+        if not self.disk_dir or len(blob) > self.disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(blob)
+        os.replace(tmp, path)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for path in self.disk_dir.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if used <= self.disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            used -= size
+            with self._lock:
+                self.stats.disk_evictions += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return entry[0]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                blob = path.read_bytes()
+            except FileNotFoundError:
+                blob = None
+            if blob is not None:
+                os.utime(path)  # 更新访问时间，磁盘淘汰按最近访问排序
+                with self._lock:
+                    self.stats.disk_hits += 1
+                value = json.loads(blob)
+                self._put_memory(key, value, len(blob))
+                return value
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        if self.disk_dir:
+            blob = json.dumps(value, ensure_ascii=False).encode("utf-8")
+            self._put_memory(key, value, len(blob))
+            self._put_disk(key, blob)
+        else:
+            self._put_memory(key, value, value_size(value))
+
+    def snapshot(self) -> Dict[str, int]:
+        """当前计数与占用，用于日志和监控"""
+        with self._lock:
+            return {**asdict(self.stats), "memory_entries": len(self._memory), "memory_bytes": self._memory_used}
+
+
+_cache: Optional[MediaCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_media_cache() -> MediaCache:
+    """获取进程内共享的媒体缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MediaCache(
+                    memory_bytes=settings.media_cache_memory_bytes,
+                    disk_dir=str(project_path(settings.media_cache_dir)) if settings.media_cache_dir else None,
+                    disk_bytes=settings.media_cache_disk_bytes,
+                )
+    return _cache
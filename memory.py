@@ -0,0 +1,284 @@
+"""长期记忆模块：移出上下文窗口的消息增量地向量化并建立索引，每轮只取回与当前问题最相关的几条"""
+
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from config import get_settings
+from context import strip_media
+from db import get_pool
+from summary import fingerprint, realign
+
+settings = get_settings()
+
+ROLE_NAMES = {"human": "用户", "ai": "助手", "system": "系统"}
+
+
+def message_text(message: BaseMessage) -> str:
+    """消息的文字内容，媒体换成占位文字"""
+    content = strip_media(message).content
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+
+def _document(message: BaseMessage) -> str:
+    """用于向量化的文本：角色 + 文字内容"""
+    return f"{ROLE_NAMES.get(message.type, message.type)}：{message_text(message)}"
+
+
+def _unit(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+@dataclass
+class MemoryState:
+    """索引进度：历史消息中的前watermark条已建立索引，anchor是其中最后一条的指纹"""
+    watermark: int = 0
+    anchor: str = ""
+
+
+@dataclass
+class MemoryRecord:
+    fingerprint: str
+    message: BaseMessage
+    vector: np.ndarray
+
+
+class InMemoryMemoryStore:
+    """进程内的向量索引（pgvector的本地替代）：每个会话一个NumPy矩阵，暴力计算余弦相似度"""
+
+    def __init__(self):
+        self._sessions: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _session(self, session_id: str) -> dict:
+        return self._sessions.setdefault(session_id, {
+            "state": MemoryState(), "vectors": None, "messages": [], "fingerprints": set()})
+
+    def state(self, session_id: str) -> MemoryState:
+        with self._lock:
+            return self._session(session_id)["state"]
+
+    def add(self, session_id: str, records: Sequence[MemoryRecord], state: MemoryState) -> None:
+        with self._lock:
+            session = self._session(session_id)
+            #同一条消息（按指纹）只保存一次：锚点丢失后从头重建索引时不会重复
+            records = [r for r in records if r.fingerprint not in session["fingerprints"]]
+            if records:
+                vectors = np.stack([r.vector for r in records])
+                session["vectors"] = vectors if session["vectors"] is None else np.vstack([session["vectors"], vectors])
+                session["messages"].extend(r.message for r in records)
+                session["fingerprints"].update(r.fingerprint for r in records)
+            session["state"] = state
+
+    def search(self, session_id: str, vector: np.ndarray, k: int) -> List[Tuple[float, int, BaseMessage]]:
+        """按相似度从高到低返回(相似度, 写入顺序, 消息)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if not session or session["vectors"] is None:
+                return []
+            vectors, messages = session["vectors"], list(session["messages"])
+        scores = vectors @ vector
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), int(i), messages[i]) for i in top]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class PgVectorMemoryStore:
+    """
+    Postgres + pgvector中的向量索引：每条被索引的消息一行，索引进度每个会话一行
+    向量维度在第一次写入或查询时确定，之后建表并建立HNSW余弦索引
+    """
+
+    def __init__(self, pool=None, table_name: str = "chat_memory"):
+        self.pool = pool
+        self.table_name = table_name
+        self._state_ready = False
+        self._table_ready = False
+
+    @contextmanager
+    def _cursor(self, dim: Optional[int] = None):
+        """从共享连接池借用连接，首次使用时建进度表，知道向量维度后再建向量表"""
+        if self.pool is None:
+            self.pool = get_pool()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            if not self._state_ready:
+                cur.execute(self._create_state_table_sql())
+                self._state_ready = True
+            if not self._table_ready and dim is not None:
+                cur.execute(self._create_table_sql(dim))
+                self._table_ready = True
+            yield cur
+
+    def _create_state_table_sql(self) -> str:
+        return f"""CREATE TABLE IF NOT EXISTS {self.table_name}_state (
+            session_id TEXT PRIMARY KEY,
+            watermark INTEGER NOT NULL,
+            anchor TEXT NOT NULL
+        );"""
+
+    def _create_table_sql(self, dim: int) -> str:
+        return f"""CREATE EXTENSION IF NOT EXISTS vector;
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id BIGSERIAL PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            message JSONB NOT NULL,
+            embedding vector({dim}) NOT NULL,
+            UNIQUE (session_id, fingerprint)
+        );
+        CREATE INDEX IF NOT EXISTS {self.table_name}_embedding_idx
+            ON {self.table_name} USING hnsw (embedding vector_cosine_ops);"""
+
+    @staticmethod
+    def _vector(vector: np.ndarray) -> str:
+        return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+    def state(self, session_id: str) -> MemoryState:
+        with self._cursor() as cur:
+            cur.execute(f"SELECT watermark, anchor FROM {self.table_name}_state WHERE session_id = %s;",
+                        (session_id,))
+            row = cur.fetchone()
+        return MemoryState(watermark=row[0], anchor=row[1]) if row else MemoryState()
+
+    def add(self, session_id: str, records: Sequence[MemoryRecord], state: MemoryState) -> None:
+        dim = len(records[0].vector) if records else None
+        with self._cursor(dim) as cur:
+            if records:
+                cur.executemany(
+                    f"""INSERT INTO {self.table_name} (session_id, fingerprint, message, embedding)
+                        VALUES (%s, %s, %s, %s::vector) ON CONFLICT (session_id, fingerprint) DO NOTHING;""",
+                    [(session_id, r.fingerprint, json.dumps(message_to_dict(r.message)), self._vector(r.vector))
+                     for r in records],
+                )
+            cur.execute(
+                f"""INSERT INTO {self.table_name}_state (session_id, watermark, anchor) VALUES (%s, %s, %s)
+                    ON CONFLICT (session_id) DO UPDATE SET watermark = EXCLUDED.watermark, anchor = EXCLUDED.anchor;""",
+                (session_id, state.watermark, state.anchor),
+            )
+
+    def search(self, session_id: str, vector: np.ndarray, k: int) -> List[Tuple[float, int, BaseMessage]]:
+        """按相似度从高到低返回(相似度, 写入顺序, 消息)，写入顺序即自增id"""
+        with self._cursor(len(vector)) as cur:
+            cur.execute(
+                f"""SELECT 1 - (embedding <=> %s::vector) AS score, id, message FROM {self.table_name}
+                    WHERE session_id = %s ORDER BY embedding <=> %s::vector LIMIT %s;""",
+                (self._vector(vector), session_id, self._vector(vector), k),
+            )
+            rows = cur.fetchall()
+        return [(float(score), id_, messages_from_dict([message])[0]) for score, id_, message in rows]
+
+    def delete(self, session_id: str) -> None:
+        with self._cursor() as cur:
+            #向量表可能还没建（维度未知），存在时才删除
+            cur.execute("SELECT to_regclass(%s);", (self.table_name,))
+            if cur.fetchone()[0] is not None:
+                cur.execute(f"DELETE FROM {self.table_name} WHERE session_id = %s;", (session_id,))
+            cur.execute(f"DELETE FROM {self.table_name}_state WHERE session_id = %s;", (session_id,))
+
+
+class LongTermMemory:
+    """
+    长期记忆：
+    1、index：把水位线之后、窗口之前新移出的消息分批向量化后写入索引，已索引的消息不再重复计算
+    2、recall：用本轮问题检索最相关的top_k条（相似度不低于min_score），按时间顺序整理成一段文字，
+       由调用方并入开头的系统提示词（有的OpenAI兼容服务不接受不在开头的系统消息）
+    取回的条数和每条的字数都有上限，会话再长提示词也不会变大
+    """
+
+    def __init__(self, embeddings: Embeddings, store=None, top_k: Optional[int] = None,
+                 min_score: Optional[float] = None, batch_size: Optional[int] = None,
+                 max_chars: Optional[int] = None):
+        self.embeddings = embeddings
+        self.store = store if store is not None else InMemoryMemoryStore()
+        self.top_k = top_k or settings.memory_top_k
+        self.min_score = settings.memory_min_score if min_score is None else min_score
+        self.batch_size = batch_size or settings.memory_batch_size
+        self.max_chars = max_chars or settings.memory_max_chars
+        self.embedded = 0  # 累计向量化的消息条数
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def index(self, session_id: str, stored_messages: List[BaseMessage], boundary: int) -> int:
+        """为boundary之前尚未索引的消息建立索引，返回本次新索引的条数"""
+        if boundary <= 0:
+            return 0
+        #同一会话的索引串行进行（后台摘要线程与前台可能同时触发）
+        with self._session_lock(session_id):
+            state = self.store.state(session_id)
+            #历史被截断或改写导致锚点丢失时从头重建，已索引的消息按指纹去重
+            start = (realign(state.watermark, state.anchor, stored_messages) or 0) if state.anchor else 0
+            if start >= boundary:
+                return 0
+            pending = [strip_media(m) for m in stored_messages[start:boundary]]
+            for offset in range(0, len(pending), self.batch_size):
+                batch = pending[offset:offset + self.batch_size]
+                vectors = _unit(self.embeddings.embed_documents([_document(m) for m in batch]))
+                end = start + offset + len(batch)
+                #每批写入后推进水位线，中途失败时下次从失败的批次继续
+                self.store.add(session_id,
+                               [MemoryRecord(fingerprint(m), m, v) for m, v in zip(batch, vectors)],
+                               MemoryState(watermark=end, anchor=fingerprint(stored_messages[end - 1])))
+                self.embedded += len(batch)
+            return len(pending)
+
+    def recall(self, session_id: str, query: str, exclude: Sequence[BaseMessage] = ()) -> str:
+        """检索与query最相关的历史消息，返回并入系统提示词的文字（没有相关内容时为空字符串）"""
+        if not query.strip():
+            return ""
+        vector = _unit(self.embeddings.embed_query(query))
+        excluded = {fingerprint(m) for m in exclude}
+        hits = [(score, seq, m) for score, seq, m in self.store.search(session_id, vector, self.top_k + len(excluded))
+                if score >= self.min_score and fingerprint(m) not in excluded][:self.top_k]
+        return self.render(hits)
+
+    async def arecall(self, session_id: str, query: str, exclude: Sequence[BaseMessage] = ()) -> str:
+        """recall的异步版本：向量化和查询都可能走网络，放到线程中执行"""
+        return await asyncio.to_thread(self.recall, session_id, query, exclude)
+
+    def render(self, hits: List[Tuple[float, int, BaseMessage]]) -> str:
+        """按写入顺序（即对话中的先后）排列取回的消息，每条截断到max_chars"""
+        if not hits:
+            return ""
+        lines = []
+        for _, _, message in sorted(hits, key=lambda hit: hit[1]):
+            text = message_text(message)
+            if len(text) > self.max_chars:
+                text = text[:self.max_chars] + "…"
+            lines.append(f"{ROLE_NAMES.get(message.type, message.type)}：{text}")
+        return "以下是与当前问题相关的较早对话，仅供参考：\n" + "\n".join(lines)
+
+
+MEMORY_STORES = ("local", "pgvector")
+
+
+def build_memory(embeddings: Optional[Embeddings] = None) -> Optional[LongTermMemory]:
+    """按配置创建长期记忆；未开启时返回None"""
+    if not settings.memory_enabled:
+        return None
+    from response_cache import build_embeddings
+    embeddings = embeddings or build_embeddings(settings.memory_embedding)
+    if settings.memory_store == "pgvector":
+        store = PgVectorMemoryStore()
+    elif settings.memory_store == "local":
+        store = InMemoryMemoryStore()
+    else:
+        raise ValueError(f"未知的长期记忆存储：{settings.memory_store}，可选：{'/'.join(MEMORY_STORES)}")
+    return LongTermMemory(embeddings, store)
@@ -0,0 +1,340 @@
+"""运行指标模块：按阶段记录耗时直方图、大模型token用量和缓存命中，以Prometheus文本格式对外提供"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+#秒级延迟的桶上限：覆盖几毫秒的缓存命中到几十秒的长回答
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """按标签分组的累积直方图（Prometheus的histogram类型）"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # 标签值 -> [各桶计数, 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Counter:
+    """按标签分组的累加计数（Prometheus的counter类型）"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表：
+    1、直方图和计数器在运行中累加
+    2、各组件已有的计数（媒体缓存、token缓存、会话存储等）以snapshot函数注册，导出时才读取
+    """
+
+    def __init__(self, prefix: str = "chatbot"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._stats: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        name = f"{self.prefix}_{name}"
+        return self._get_or_create(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        name = f"{self.prefix}_{name}_total"
+        return self._get_or_create(name, lambda: Counter(name, help, labelnames))
+
+    def register_stats(self, source: str, snapshot: Callable[[], Dict[str, float]]) -> None:
+        """注册一个组件的计数快照，每个数值字段导出为一个gauge；同名来源重复注册时以最后一次为准"""
+        with self._lock:
+            self._stats[source] = snapshot
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            stats = dict(self._stats)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        for source, snapshot in sorted(stats.items()):
+            try:
+                values = snapshot()
+            except Exception as e:
+                logger.warning("读取%s的计数失败：%r", source, e)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{self.prefix}_{source}_{key}"
+                    lines.extend([f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "各阶段耗时（秒）", ["stage"])
+LLM_SECONDS = REGISTRY.histogram("llm_seconds", "大模型调用总耗时（秒）", ["model"])
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram("llm_first_token_seconds", "大模型首token延迟（秒）", ["model"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens", "大模型token用量", ["model", "kind"])
+LLM_CALLS = REGISTRY.counter("llm_calls", "大模型调用次数", ["model"])
+ERRORS = REGISTRY.counter("errors", "各阶段的异常次数", ["stage"])
+
+
+@contextmanager
+def timed(stage: str):
+    """记录不经过LangChain的阶段（ASR、媒体编码）的耗时，异常时同时计数"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+#LangChain运行（run_name）-> 阶段名
+STAGES = {
+    "load_history": "history_load",
+    "summarize_messages": "summarize",
+    "fit_history": "summarize",
+    "fold_summary": "summary_fold",
+    "insert_history": "history_write",
+}
+#摘要器中大模型调用外层的run_name，用来区分摘要模型和回答模型
+SUMMARY_RUN = "fold_summary"
+
+
+def _usage(response) -> Tuple[int, int]:
+    """从LLMResult中取出（输入token，输出token）：优先usage_metadata，其次llm_output中的token_usage"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    基于LangChain回调的埋点：
+    1、按run_name识别加载历史、摘要/窗口、写入历史等阶段，最外层的运行计为一整轮（turn）
+    2、大模型按是否在摘要链内分为answer/summary两类，分别记录首token延迟、总耗时和token用量
+    同一个处理器可能经由config和with_config被挂两次，开始/结束都按run_id去重
+    回调来自多个线程（同步链在线程池中运行），状态的读写都在锁内；被取消的流可能收不到结束回调，
+    开始超过ttl秒（默认metrics_run_ttl）的运行在下一次开始时被清理
+    """
+
+    run_inline = True  # 异步链中也在当前线程直接回调，计时不受线程池排队影响
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl or settings.metrics_run_ttl
+        self._stages: Dict[object, Tuple[str, float]] = {}
+        self._llms: Dict[object, list] = {}  # run_id -> [模型类别, 开始时间, 是否已收到首token]
+        self._summary_runs: Dict[object, float] = {}  # run_id -> 开始时间
+        self._lock = threading.Lock()
+        self._next_sweep = time.perf_counter() + self.ttl
+
+    def _sweep(self, now: float) -> None:
+        """丢弃超过ttl仍未结束的运行（调用方持有锁），最多每ttl秒扫描一次"""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.ttl
+        deadline = now - self.ttl
+        expired = [run_id for run_id, (_, started) in self._stages.items() if started < deadline]
+        for run_id in expired:
+            del self._stages[run_id]
+        stale_llms = [run_id for run_id, llm in self._llms.items() if llm[1] < deadline]
+        for run_id in stale_llms:
+            del self._llms[run_id]
+        for run_id in [run_id for run_id, started in self._summary_runs.items() if started < deadline]:
+            del self._summary_runs[run_id]
+        if expired or stale_llms:
+            logger.debug("丢弃%d个未结束的阶段和%d个未结束的大模型调用", len(expired), len(stale_llms))
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, name=None, **kwargs):
+        name = name or (serialized or {}).get("name")
+        stage = STAGES.get(name) or ("turn" if parent_run_id is None else None)
+        now = time.perf_counter()
+        with self._lock:
+            self._sweep(now)
+            if name == SUMMARY_RUN:
+                self._summary_runs[run_id] = now
+            if stage and run_id not in self._stages:
+                self._stages[run_id] = (stage, now)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            self._summary_runs.pop(run_id, None)
+            started = self._stages.pop(run_id, None)
+        if started:
+            STAGE_SECONDS.observe(time.perf_counter() - started[1], stage=started[0])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._summary_runs.pop(run_id, None)
+            started = self._stages.pop(run_id, None)
+        if started:
+            ERRORS.inc(stage=started[0])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        now = time.perf_counter()
+        with self._lock:
+            self._sweep(now)
+            if run_id not in self._llms:
+                model = "summary" if parent_run_id in self._summary_runs else "answer"
+                self._llms[run_id] = [model, now, False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, parent_run_id=parent_run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            llm = self._llms.get(run_id)
+            first = llm is not None and not llm[2]
+            if first:
+                llm[2] = True
+        if first:
+            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - llm[1], model=llm[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            llm = self._llms.pop(run_id, None)
+        if llm is None:
+            return
+        model = llm[0]
+        LLM_SECONDS.observe(time.perf_counter() - llm[1], model=model)
+        LLM_CALLS.inc(model=model)
+        input_tokens, output_tokens = _usage(response)
+        LLM_TOKENS.inc(input_tokens, model=model, kind="input")
+        LLM_TOKENS.inc(output_tokens, model=model, kind="output")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            llm = self._llms.pop(run_id, None)
+        if llm:
+            ERRORS.inc(stage=f"llm_{llm[0]}")
+
+
+_handler: Optional[MetricsCallbackHandler] = None
+_handler_lock = threading.Lock()
+
+
+def get_metrics_handler() -> MetricsCallbackHandler:
+    """获取进程内共享的埋点回调"""
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                _handler = MetricsCallbackHandler()
+    return _handler
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics请求：" + format, *args)
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(host: Optional[str] = None, port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """在后台线程中启动/metrics端点（与Gradio应用并列的独立端口），已启动或未开启时直接返回"""
+    global _server
+    if not settings.metrics_enabled or _server is not None:
+        return _server
+    host = host or settings.metrics_host
+    port = settings.metrics_port if port is None else port
+    _server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("指标端点已启动：http://%s:%s/metrics", host, _server.server_port)
+    return _server
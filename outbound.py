@@ -0,0 +1,461 @@
+"""
+外部调用调度：所有发往大模型、向量模型和ASR服务的请求按服务商排队
+1、每个服务商一个令牌桶（每秒请求数 + 突发量）和同时进行的请求数上限
+2、排队时按优先级放行：交互式回答优先于后台摘要/索引
+3、可批量的调用（向量化）把同一时刻的多个请求合成一次
+4、429、5xx、超时等可重试的错误按带抖动的指数退避重试，每次重试重新排队
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from config import get_settings
+from metrics import REGISTRY
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+#优先级：数值越小越先放行
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PROVIDERS = ("openai", "dashscope", "zhipu", "embeddings")
+
+#可重试的HTTP状态码：请求超时、冲突、限流，以及服务端错误（>=500）
+RETRYABLE_STATUS = {408, 409, 429}
+#没有状态码时按异常类名判断的网络错误（openai/httpx/zai客户端）
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+                    "ReadError", "RemoteProtocolError", "TimeoutException", "PoolTimeout"}
+
+
+def _status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = _status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, (TimeoutError, ConnectionError))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """服务端通过Retry-After告知的等待秒数"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多积攒burst个；rate不大于0时不限速"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """还需要等多少秒才有令牌（0表示现在就有）"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class _Waiter:
+    """排队中的一个请求：同步调用方用Event等待，异步调用方用事件循环中的future等待"""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self) -> bool:
+        """放行；调用方的事件循环已经关闭时返回False"""
+        if self.loop is None:
+            self.granted = True
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+        except RuntimeError:
+            return False
+        self.granted = True
+        return True
+
+
+@dataclass
+class LimiterStats:
+    """计数：调用次数、排队次数、重试次数、被限流（429）次数、最终失败次数"""
+    calls: int = 0
+    queued: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failures: int = 0
+
+
+class ProviderLimiter:
+    """
+    单个服务商的调度器：
+    请求同时拿到并发名额和令牌后才发出；拿不到时进入按（优先级，到达顺序）排序的队列，
+    由调度线程在名额和令牌都就绪时放行队首，高优先级的请求后到也排在前面
+    同一个调度器同时服务同步调用（线程中阻塞等待）和异步调用（不占线程）
+    """
+
+    def __init__(self, name: str, rate: float = 0.0, burst: int = 1, max_in_flight: int = 0,
+                 max_retries: Optional[int] = None, backoff_base: Optional[float] = None,
+                 backoff_max: Optional[float] = None):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self.max_retries = settings.outbound_max_retries if max_retries is None else max_retries
+        self.backoff_base = settings.outbound_backoff_base if backoff_base is None else backoff_base
+        self.backoff_max = settings.outbound_backoff_max if backoff_max is None else backoff_max
+        self.stats = LimiterStats()
+        self._in_flight = 0
+        self._queue: List[tuple] = []  # (优先级, 序号, _Waiter)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    #---------- 放行 ----------
+
+    def _slot_free_locked(self) -> bool:
+        return self.max_in_flight <= 0 or self._in_flight < self.max_in_flight
+
+    def _enqueue(self, priority: int, loop: Optional[asyncio.AbstractEventLoop]) -> _Waiter:
+        waiter = _Waiter(loop)
+        with self._cond:
+            self.stats.calls += 1
+            #队列为空、名额和令牌都有时直接放行，不经过调度线程
+            if not self._queue and self._slot_free_locked() and self.bucket.wait_time() == 0:
+                self.bucket.take()
+                self._in_flight += 1
+                waiter.granted = True
+                return waiter
+            self.stats.queued += 1
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name=f"outbound-{self.name}", daemon=True)
+                self._dispatcher.start()
+            self._cond.notify()
+        return waiter
+
+    def _dispatch(self) -> None:
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][2].cancelled:
+                    heapq.heappop(self._queue)
+                if not self._queue or not self._slot_free_locked():
+                    self._cond.wait()
+                    continue
+                wait = self.bucket.wait_time()
+                if wait > 0:
+                    #等令牌期间可能有更高优先级的请求到达，醒来后重新看队首
+                    self._cond.wait(wait)
+                    continue
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.grant():
+                    self.bucket.take()
+                    self._in_flight += 1
+
+    def acquire(self, priority: int = INTERACTIVE) -> None:
+        """同步等待放行（阻塞当前线程）"""
+        waiter = self._enqueue(priority, None)
+        if not waiter.granted:
+            waiter.event.wait()
+
+    async def aacquire(self, priority: int = INTERACTIVE) -> None:
+        """异步等待放行；等待中被取消时退出队列，已放行则归还名额"""
+        waiter = self._enqueue(priority, asyncio.get_running_loop())
+        if waiter.granted:
+            return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._cond:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    #---------- 重试 ----------
+
+    def _backoff(self, attempt: int, error: BaseException) -> Optional[float]:
+        """第attempt次失败后的等待秒数；不可重试或次数用完时返回None"""
+        if _status(error) == 429:
+            self.stats.throttled += 1
+        if attempt >= self.max_retries or not is_retryable(error):
+            self.stats.failures += 1
+            return None
+        self.stats.retries += 1
+        #full jitter：在[0, min(上限, 基数*2^attempt)]中随机，避免同一批被限流的请求同时重试
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        hinted = retry_after(error)
+        if hinted is not None:
+            delay = min(self.backoff_max, hinted) + delay * 0.1
+        logger.debug("%s调用失败（%r），%.2f秒后第%d次重试", self.name, error, delay, attempt + 1)
+        return delay
+
+    def call(self, fn: Callable[[], T], priority: int = INTERACTIVE) -> T:
+        """排队后调用fn，可重试的错误退避后重新排队"""
+        for attempt in itertools.count():
+            self.acquire(priority)
+            try:
+                return fn()
+            except Exception as e:
+                delay = self._backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            time.sleep(delay)
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], priority: int = INTERACTIVE) -> T:
+        """call的异步版本"""
+        for attempt in itertools.count():
+            await self.aacquire(priority)
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self._backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            await asyncio.sleep(delay)
+
+    def stream(self, fn: Callable[[], Iterator[T]], priority: int = INTERACTIVE) -> Iterator[T]:
+        """流式调用：整个流期间占用一个名额；还没产出任何内容前失败才重试，已经输出的内容不会重复"""
+        for attempt in itertools.count():
+            self.acquire(priority)
+            started = False
+            try:
+                for item in fn():
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                delay = None if started else self._backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            time.sleep(delay)
+
+    async def astream(self, fn: Callable[[], AsyncIterator[T]], priority: int = INTERACTIVE) -> AsyncIterator[T]:
+        """stream的异步版本"""
+        for attempt in itertools.count():
+            await self.aacquire(priority)
+            started = False
+            try:
+                async for item in fn():
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                delay = None if started else self._backoff(attempt, e)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return {**asdict(self.stats), "in_flight": self._in_flight, "waiting": len(self._queue)}
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    包装聊天模型：每次调用先经过服务商的调度器
+    直接调用内层模型的_generate/_stream，回调（埋点、逐token输出）仍挂在外层这一次运行上
+    with_priority返回共用同一调度器、优先级不同的副本（摘要器使用BACKGROUND）
+    """
+
+    inner: BaseChatModel
+    limiter: Any
+    priority: int = INTERACTIVE
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def with_priority(self, priority: int) -> "ScheduledChatModel":
+        return self.model_copy(update={"priority": priority})
+
+    def _should_stream(self, *, async_api: bool, run_manager=None, **kwargs) -> bool:
+        #是否走流式接口由内层模型决定（内层没有实现流式时退回_generate）
+        return self.inner._should_stream(async_api=async_api, run_manager=run_manager, **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return self.limiter.call(
+            lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs), self.priority)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await self.limiter.acall(
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs), self.priority)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        yield from self.limiter.stream(
+            lambda: self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs), self.priority)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for chunk in self.limiter.astream(
+                lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs), self.priority):
+            yield chunk
+
+
+class _Pending:
+    def __init__(self, text: str):
+        self.text = text
+        self.done = threading.Event()
+        self.vector: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    包装向量模型：
+    1、embed_query做微批：max_wait秒内（或凑满max_batch条）到达的问题合成一次embed_documents，
+       第一个到达的调用方负责发请求并把结果分给其他调用方
+    2、embed_documents按max_batch分批，作为后台任务排队（索引历史消息不应挤占回答路径）
+    """
+
+    def __init__(self, embeddings: Embeddings, limiter: ProviderLimiter, max_batch: Optional[int] = None,
+                 max_wait: Optional[float] = None):
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.max_batch = max_batch or settings.embedding_batch_size
+        self.max_wait = settings.embedding_batch_wait if max_wait is None else max_wait
+        self.batches = 0
+        self._pending: List[_Pending] = []
+        self._cond = threading.Condition()
+
+    def _embed(self, texts: List[str], priority: int) -> List[List[float]]:
+        self.batches += 1
+        return self.limiter.call(lambda: self.embeddings.embed_documents(texts), priority)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.max_batch):
+            vectors.extend(self._embed(texts[start:start + self.max_batch], BACKGROUND))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        pending = _Pending(text)
+        with self._cond:
+            self._pending.append(pending)
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        if leader:
+            self._drain()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vector
+
+    def _drain(self) -> None:
+        """由批次中第一个到达的调用方执行：等凑批后发请求，直到没有待处理的问题"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.max_wait)
+        while True:
+            with self._cond:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if not batch:
+                return
+            try:
+                vectors = self._embed([p.text for p in batch], INTERACTIVE)
+                for p, vector in zip(batch, vectors):
+                    p.vector = vector
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+            for p in batch:
+                p.done.set()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """获取服务商的共享调度器，限额来自Settings中的<provider>_rate_limit/_burst/_max_in_flight"""
+    if provider not in PROVIDERS:
+        raise ValueError(f"未知的服务商：{provider}，可选：{'/'.join(PROVIDERS)}")
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = _limiters[provider] = ProviderLimiter(
+                provider,
+                rate=getattr(settings, f"{provider}_rate_limit"),
+                burst=getattr(settings, f"{provider}_burst"),
+                max_in_flight=getattr(settings, f"{provider}_max_in_flight"),
+            )
+            REGISTRY.register_stats(f"outbound_{provider}", limiter.snapshot)
+    return limiter
+
+
+def schedule_chat_model(llm: BaseChatModel, provider: str, priority: int = INTERACTIVE) -> BaseChatModel:
+    """按配置给聊天模型套上服务商调度；未开启时原样返回"""
+    if not settings.outbound_enabled:
+        return llm
+    return ScheduledChatModel(inner=llm, limiter=get_limiter(provider), priority=priority)
+
+
+def schedule_embeddings(embeddings: Embeddings) -> Embeddings:
+    """按配置给向量模型套上调度和微批；未开启时原样返回"""
+    if not settings.outbound_enabled:
+        return embeddings
+    return ScheduledEmbeddings(embeddings, get_limiter("embeddings"))
+
+
+def with_priority(llm: BaseChatModel, priority: int) -> BaseChatModel:
+    """同一个模型的另一优先级版本；没有经过调度（未开启或基准测试中的假模型）时原样返回"""
+    return llm.with_priority(priority) if isinstance(llm, ScheduledChatModel) else llm
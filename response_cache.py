@@ -0,0 +1,369 @@
+"""回答缓存模块：相同或相近的问题在相同上下文下直接返回缓存的回答，不再调用大模型"""
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig, ensure_config
+
+from config import get_settings
+from summary import fingerprint
+
+settings = get_settings()
+
+#归一化时去掉的句末标点：“什么是机器学习？”与“什么是机器学习”视为同一个问题
+_TRAILING_PUNCTUATION = "?？!！.。~～…,，;；:："
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """全角转半角、转小写、合并空白、去掉句末标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _WHITESPACE.sub(" ", text).strip().rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+def context_digest(summary: Optional[str], history: Sequence[BaseMessage] = ()) -> str:
+    """
+    回答所依赖的上下文：摘要，以及（可选的）历史消息（媒体按占位文字计）
+    链中只按摘要计算：窗口内的历史每轮都在变化，计入后同一会话中几乎不会再命中，相似匹配也形同虚设；
+    代价是摘要之后、窗口之内的对话变化时，同一个问题仍可能返回之前的回答（由ttl限制时效）
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((summary or "").encode("utf-8"))
+    for message in history:
+        digest.update(fingerprint(message).encode("ascii"))
+    return digest.hexdigest()
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    确定性的本地向量：字符n-gram哈希到固定维度后归一化
+    不访问任何服务，离线测试和基准测试中代替真实的向量模型；对字面相近的问题也有不错的区分度
+    """
+
+    def __init__(self, dim: int = 256, ngrams: Sequence[int] = (1, 2, 3)):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = normalize_question(text)
+        for n in self.ngrams:
+            for i in range(len(text) - n + 1):
+                h = int.from_bytes(hashlib.blake2b(text[i:i + n].encode("utf-8"), digest_size=8).digest(), "little")
+                vector[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+@dataclass
+class ResponseCacheStats:
+    """计数：精确命中、相似命中、未命中、按容量淘汰、过期"""
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+@dataclass
+class CacheKey:
+    question: str  # 归一化后的问题
+    context: str  # context_digest
+    digest: str  # 精确匹配的键
+    vector: Optional[np.ndarray] = None  # 开启相似匹配时问题的向量
+
+
+@dataclass
+class _Entry:
+    answer: str
+    context: str
+    created: float
+    slot: int = -1  # 在向量矩阵中的行号，-1表示没有向量
+
+
+class VectorIndex:
+    """NumPy暴力检索的向量索引：按行保存单位向量，删除的行留作空位复用"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._contexts: List[Optional[str]] = []
+        self._keys: List[Optional[str]] = []
+        self._free: List[int] = []
+
+    def add(self, key: str, context: str, vector: np.ndarray) -> int:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._keys)
+            if slot == len(self._vectors):
+                grown = np.zeros((max(16, 2 * len(self._vectors)), self.dim), dtype=np.float32)
+                grown[:len(self._vectors)] = self._vectors
+                self._vectors = grown
+            self._keys.append(None)
+            self._contexts.append(None)
+        self._vectors[slot] = vector
+        self._keys[slot] = key
+        self._contexts[slot] = context
+        return slot
+
+    def remove(self, slot: int) -> None:
+        self._vectors[slot] = 0.0
+        self._keys[slot] = None
+        self._contexts[slot] = None
+        self._free.append(slot)
+
+    def search(self, vector: np.ndarray, context: str, threshold: float) -> Optional[str]:
+        """返回同一上下文中余弦相似度最高且不低于threshold的键"""
+        if not self._keys:
+            return None
+        scores = self._vectors[:len(self._keys)] @ vector
+        mask = np.fromiter((c == context for c in self._contexts), dtype=bool, count=len(self._contexts))
+        scores = np.where(mask, scores, -np.inf)
+        best = int(np.argmax(scores))
+        return self._keys[best] if scores[best] >= threshold else None
+
+
+class ResponseCache:
+    """
+    两级回答缓存：
+    1、精确匹配：归一化后的问题 + 上下文（会话范围 + 摘要，见CachedChain）作为键
+    2、相似匹配（传入embeddings时开启）：同一上下文中问题向量的余弦相似度不低于threshold时复用回答
+    条目超过ttl秒过期，超过max_entries条时淘汰最久未用的；disable(session_id)的会话不读也不写缓存
+    （界面上的“不使用回答缓存”开关）；shared为False（默认，见response_cache_shared）时条目只在同一会话内复用，
+    不同用户之间不共享回答
+    """
+
+    def __init__(self, embeddings: Optional[Embeddings] = None, threshold: Optional[float] = None,
+                 ttl: Optional[float] = None, max_entries: Optional[int] = None, shared: Optional[bool] = None):
+        self.embeddings = embeddings
+        self.shared = settings.response_cache_shared if shared is None else shared
+        self.threshold = settings.response_cache_threshold if threshold is None else threshold
+        self.ttl = settings.response_cache_ttl if ttl is None else ttl
+        self.max_entries = max_entries or settings.response_cache_max_entries
+        self.stats = ResponseCacheStats()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._index: Optional[VectorIndex] = None
+        self._disabled: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def disable(self, session_id: str) -> None:
+        """该会话不使用缓存（例如用户希望每次都重新生成回答）"""
+        with self._lock:
+            self._disabled.add(session_id)
+
+    def enable(self, session_id: str) -> None:
+        with self._lock:
+            self._disabled.discard(session_id)
+
+    def enabled_for(self, session_id: Optional[str]) -> bool:
+        with self._lock:
+            return session_id not in self._disabled
+
+    def _key(self, question: str, context: str, vector=None) -> CacheKey:
+        question = normalize_question(question)
+        digest = hashlib.blake2b(f"{context}\n{question}".encode("utf-8"), digest_size=16).hexdigest()
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else vector
+        return CacheKey(question=question, context=context, digest=digest, vector=vector)
+
+    def key(self, question: str, context: str) -> CacheKey:
+        vector = self.embeddings.embed_query(normalize_question(question)) if self.embeddings else None
+        return self._key(question, context, vector)
+
+    async def akey(self, question: str, context: str) -> CacheKey:
+        vector = await self.embeddings.aembed_query(normalize_question(question)) if self.embeddings else None
+        return self._key(question, context, vector)
+
+    def _drop_locked(self, digest: str) -> None:
+        entry = self._entries.pop(digest)
+        if entry.slot >= 0:
+            self._index.remove(entry.slot)
+
+    def _live_locked(self, digest: str, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        if self.ttl and now - entry.created > self.ttl:
+            self._drop_locked(digest)
+            self.stats.expirations += 1
+            return None
+        self._entries.move_to_end(digest)
+        return entry
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live_locked(key.digest, now)
+            if entry is not None:
+                self.stats.exact_hits += 1
+                return entry.answer
+            if key.vector is not None and self._index is not None:
+                match = self._index.search(key.vector, key.context, self.threshold)
+                entry = self._live_locked(match, now) if match else None
+                if entry is not None:
+                    self.stats.semantic_hits += 1
+                    return entry.answer
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: CacheKey, answer: str) -> None:
+        if not answer:
+            return
+        with self._lock:
+            if key.digest in self._entries:
+                self._drop_locked(key.digest)
+            entry = _Entry(answer=answer, context=key.context, created=time.monotonic())
+            if key.vector is not None:
+                if self._index is None:
+                    self._index = VectorIndex(len(key.vector))
+                entry.slot = self._index.add(key.digest, key.context, key.vector)
+            self._entries[key.digest] = entry
+            while len(self._entries) > self.max_entries:
+                self._drop_locked(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._index = None
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**asdict(self.stats), "entries": len(self._entries)}
+
+
+class CachedChain(Runnable):
+    """
+    放在“提示词 | 大模型”前面的缓存层：命中时直接返回缓存的回答（流式时作为一个片段返回），未命中时照常调用并写入缓存
+    question从链的输入中取出问题文本（返回None表示本轮不使用缓存，例如带图片的消息），context取出回答依赖的上下文
+    多条链共用一个缓存时用namespace区分（不同的提示词和大模型）；缓存不共享时上下文中还包含session_id
+    """
+
+    def __init__(self, chain: Runnable, cache: ResponseCache, question: Callable[[Any], Optional[str]],
+                 context: Callable[[Any], str], namespace: str = ""):
+        self.chain = chain
+        self.cache = cache
+        self.question = question
+        self.context = context
+        self.namespace = namespace
+
+    def _context(self, x, config: RunnableConfig) -> str:
+        scope = "*" if self.cache.shared else config.get("configurable", {}).get("session_id", "")
+        return f"{self.namespace}:{scope}:{self.context(x)}"
+
+    def _usable(self, x, config: RunnableConfig) -> Optional[str]:
+        session_id = config.get("configurable", {}).get("session_id")
+        if not self.cache.enabled_for(session_id):
+            return None
+        return self.question(x)
+
+    def invoke(self, x, config: Optional[RunnableConfig] = None, **kwargs) -> BaseMessage:
+        config = ensure_config(config)
+        question = self._usable(x, config)
+        if question is None:
+            return self.chain.invoke(x, config, **kwargs)
+        key = self.cache.key(question, self._context(x, config))
+        answer = self.cache.get(key)
+        if answer is not None:
+            return AIMessage(content=answer)
+        output = self.chain.invoke(x, config, **kwargs)
+        if isinstance(output.content, str):
+            self.cache.put(key, output.content)
+        return output
+
+    async def ainvoke(self, x, config: Optional[RunnableConfig] = None, **kwargs) -> BaseMessage:
+        config = ensure_config(config)
+        question = self._usable(x, config)
+        if question is None:
+            return await self.chain.ainvoke(x, config, **kwargs)
+        key = await self.cache.akey(question, self._context(x, config))
+        answer = self.cache.get(key)
+        if answer is not None:
+            return AIMessage(content=answer)
+        output = await self.chain.ainvoke(x, config, **kwargs)
+        if isinstance(output.content, str):
+            self.cache.put(key, output.content)
+        return output
+
+    def stream(self, x, config: Optional[RunnableConfig] = None, **kwargs) -> Iterator[BaseMessage]:
+        config = ensure_config(config)
+        question = self._usable(x, config)
+        if question is None:
+            yield from self.chain.stream(x, config, **kwargs)
+            return
+        key = self.cache.key(question, self._context(x, config))
+        answer = self.cache.get(key)
+        if answer is not None:
+            yield AIMessageChunk(content=answer)
+            return
+        #只有完整生成的回答才写入缓存，中途断开的流不写
+        pieces = []
+        for chunk in self.chain.stream(x, config, **kwargs):
+            pieces.append(chunk.content if isinstance(chunk.content, str) else None)
+            yield chunk
+        if None not in pieces:
+            self.cache.put(key, "".join(pieces))
+
+    async def astream(self, x, config: Optional[RunnableConfig] = None, **kwargs) -> AsyncIterator[BaseMessage]:
+        config = ensure_config(config)
+        question = self._usable(x, config)
+        if question is None:
+            async for chunk in self.chain.astream(x, config, **kwargs):
+                yield chunk
+            return
+        key = await self.cache.akey(question, self._context(x, config))
+        answer = self.cache.get(key)
+        if answer is not None:
+            yield AIMessageChunk(content=answer)
+            return
+        pieces = []
+        async for chunk in self.chain.astream(x, config, **kwargs):
+            pieces.append(chunk.content if isinstance(chunk.content, str) else None)
+            yield chunk
+        if None not in pieces:
+            self.cache.put(key, "".join(pieces))
+
+
+def message_question(messages: Sequence[BaseMessage]) -> Optional[str]:
+    """多模态链中本轮消息的问题文本；含图片/音频等非文字片段时返回None，不使用缓存"""
+    texts = []
+    for message in messages:
+        if isinstance(message.content, str):
+            texts.append(message.content)
+            continue
+        for part in message.content:
+            if isinstance(part, str):
+                texts.append(part)
+            elif isinstance(part, dict) and part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            else:
+                return None
+    return "\n".join(texts) or None
+
+
+def build_embeddings(name: Optional[str] = None) -> Optional[Embeddings]:
+    """按配置创建相似匹配使用的向量模型：空字符串表示不开启，hashing为本地确定性向量，其余为OpenAI向量模型名"""
+    name = settings.response_cache_embedding if name is None else name
+    if not name:
+        return None
+    if name == "hashing":
+        return HashingEmbeddings()
+    #经过服务商调度：同一时刻的多个问题合成一次请求，限速限并发，退避重试
+    from langchain_openai import OpenAIEmbeddings
+    from outbound import schedule_embeddings
+    return schedule_embeddings(OpenAIEmbeddings(model=name, max_retries=0 if settings.outbound_enabled else 2))
@@ -0,0 +1,71 @@
+"""会话管理：为每个用户/浏览器分配session_id，同一会话的对话轮依次执行"""
+
+import asyncio
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+
+def new_session_id() -> str:
+    """新会话的id：随机生成，不同浏览器之间不会重复"""
+    return uuid.uuid4().hex
+
+
+def _user_session_id(request) -> Optional[str]:
+    username = getattr(request, "username", None) if request is not None else None
+    return f"user:{username}" if username else None
+
+
+def assign_session_id(stored_id: Optional[str] = None, request=None) -> str:
+    """
+    页面加载时确定本页面的session_id：
+    1、开启登录（launch(auth=...)）时按用户名区分，同一用户在不同浏览器中看到同一份历史
+    2、否则沿用保存在浏览器中（gr.BrowserState）的id，刷新页面、重新打开后仍是同一个会话；第一次打开时新生成一个
+    """
+    return _user_session_id(request) or stored_id or new_session_id()
+
+
+def resolve_session_id(session_id: Optional[str] = None, request=None) -> str:
+    """
+    确定本轮对话的session_id：开启登录时按用户名，否则使用页面加载时分配的id
+    没有id时报错，不悄悄新建一个会话（那样本轮对话会写进一份看不到的新历史）
+    """
+    resolved = _user_session_id(request) or session_id
+    if not resolved:
+        raise ValueError("缺少session_id：页面加载时应已分配，请刷新页面")
+    return resolved
+
+
+class SessionLocks:
+    """
+    按会话的锁：同一会话的对话轮依次进行，两个标签页不会交错读取和写入同一份历史与摘要，不同会话之间互不等待
+    只为正在进行或排队的会话保留锁对象，会话数再多也不会累积
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}  # session_id -> (锁, 持有和等待的轮数)
+        self._mutex = threading.Lock()
+        self.waits = 0  # 因同一会话已有对话轮在进行而排队的次数
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        with self._mutex:
+            lock, users = self._locks.get(session_id) or (asyncio.Lock(), 0)
+            self._locks[session_id] = (lock, users + 1)
+            if users:
+                self.waits += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            with self._mutex:
+                lock, users = self._locks[session_id]
+                if users == 1:
+                    del self._locks[session_id]
+                else:
+                    self._locks[session_id] = (lock, users - 1)
+
+    def snapshot(self) -> dict:
+        with self._mutex:
+            return {"active_sessions": len(self._locks), "waits": self.waits}
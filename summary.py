@@ -0,0 +1,378 @@
+"""滚动摘要模块：按会话缓存摘要与水位线，每轮只把新移出窗口的消息折叠进摘要"""
+
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from config import get_settings
+from context import ContextWindow, TokenCounter, get_context_window, strip_media
+from db import get_async_pool, get_pool, record_query
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RollingSummary:
+    """
+    会话摘要：content 覆盖了历史消息中的前 watermark 条
+    anchor是最后一条被折叠消息的指纹，历史前部被截断（内存后端的条数上限）后用它重新定位水位线
+    """
+    content: str = ""
+    watermark: int = 0
+    anchor: str = ""
+
+
+def fingerprint(message: BaseMessage) -> str:
+    """消息指纹：媒体换成占位文字后再计算，blob引用和data URL得到同一个指纹"""
+    content = strip_media(message).content
+    payload = f"{message.type}:{json.dumps(content, ensure_ascii=False, sort_keys=True)}"
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def realign(watermark: int, anchor: str, stored_messages: Sequence[BaseMessage]) -> Optional[int]:
+    """
+    按锚点校验水位线：第watermark条消息的指纹与anchor一致时原样返回；
+    历史前部被截断后向前查找锚点，返回新的水位线；找不到锚点时返回None
+    """
+    total = len(stored_messages)
+    if 0 < watermark <= total and fingerprint(stored_messages[watermark - 1]) == anchor:
+        return watermark
+    for index in range(min(watermark, total) - 1, -1, -1):
+        if fingerprint(stored_messages[index]) == anchor:
+            return index + 1
+    return None
+
+
+class InMemorySummaryStore:
+    """内存中的摘要存储，key: 会话ID session_id"""
+
+    def __init__(self):
+        self._data: Dict[str, RollingSummary] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[RollingSummary]:
+        with self._lock:
+            return self._data.get(session_id)
+
+    def set(self, session_id: str, summary: RollingSummary) -> None:
+        with self._lock:
+            self._data[session_id] = summary
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    async def aget(self, session_id: str) -> Optional[RollingSummary]:
+        return self.get(session_id)
+
+    async def aset(self, session_id: str, summary: RollingSummary) -> None:
+        self.set(session_id, summary)
+
+
+class PostgresSummaryStore:
+    """Postgres中的摘要存储，每个会话一行（摘要 + 水位线）"""
+
+    def __init__(self, pool=None, table_name: str = "chat_summary"):
+        self.pool = pool
+        self.table_name = table_name
+        self._table_ready = False
+        self._atable_ready = False
+
+    @contextmanager
+    def _cursor(self):
+        """从共享连接池借用连接，首次使用时建表"""
+        if self.pool is None:
+            self.pool = get_pool()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            if not self._table_ready:
+                self._create_table_if_not_exists(cur)
+                self._table_ready = True
+            yield cur
+
+    def _create_table_if_not_exists(self, cur) -> None:
+        cur.execute(self._create_table_sql())
+
+    def _create_table_sql(self) -> str:
+        return f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            watermark INTEGER NOT NULL,
+            anchor TEXT NOT NULL DEFAULT '',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS anchor TEXT NOT NULL DEFAULT '';"""
+
+    def _get_sql(self) -> str:
+        return f"SELECT summary, watermark, anchor FROM {self.table_name} WHERE session_id = %s;"
+
+    def _set_sql(self) -> str:
+        return f"""INSERT INTO {self.table_name} (session_id, summary, watermark, anchor)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (session_id) DO UPDATE
+            SET summary = EXCLUDED.summary, watermark = EXCLUDED.watermark, anchor = EXCLUDED.anchor,
+                updated_at = now();"""
+
+    def get(self, session_id: str) -> Optional[RollingSummary]:
+        with self._cursor() as cur:
+            cur.execute(self._get_sql(), (session_id,))
+            row = cur.fetchone()
+        return RollingSummary(content=row[0], watermark=row[1], anchor=row[2]) if row else None
+
+    def set(self, session_id: str, summary: RollingSummary) -> None:
+        with self._cursor() as cur:
+            cur.execute(self._set_sql(), (session_id, summary.content, summary.watermark, summary.anchor))
+
+    def delete(self, session_id: str) -> None:
+        with self._cursor() as cur:
+            cur.execute(f"DELETE FROM {self.table_name} WHERE session_id = %s;", (session_id,))
+
+    @asynccontextmanager
+    async def _acursor(self):
+        """异步路径：从psycopg 3的异步连接池借用连接"""
+        pool = await get_async_pool()
+        async with pool.connection() as conn:
+            if not self._atable_ready:
+                await conn.execute(self._create_table_sql())
+                self._atable_ready = True
+            async with conn.cursor() as cur:
+                yield cur
+
+    async def aget(self, session_id: str) -> Optional[RollingSummary]:
+        async with self._acursor() as cur:
+            await cur.execute(self._get_sql(), (session_id,))
+            row = await cur.fetchone()
+        record_query(len(self._get_sql()))
+        return RollingSummary(content=row[0], watermark=row[1], anchor=row[2]) if row else None
+
+    async def aset(self, session_id: str, summary: RollingSummary) -> None:
+        async with self._acursor() as cur:
+            await cur.execute(self._set_sql(), (session_id, summary.content, summary.watermark, summary.anchor))
+        record_query(len(self._set_sql()) + len(summary.content.encode("utf-8")))
+
+
+#增量摘要的提示词：已有摘要 + 新移出窗口的消息 -> 新摘要
+fold_prompt = ChatPromptTemplate.from_messages([
+    ("system", "请将下列历史对话压缩为一条保留关键消息的摘要信息，不丢失信息密度。已有摘要：{summary}"),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "请把已有摘要与上述新对话合并，生成包含核心内容的摘要，保留重要事实和决策。")
+])
+
+
+class RollingSummarizer:
+    """
+    滚动摘要器：只折叠水位线之后、窗口之前的消息
+    移出窗口的新消息不足min_new_tokens个token时不调用大模型，这些消息暂时留在上下文中，占用窗口为摘要预留的token；
+    攒够后一次折叠，几轮短对话只摘要一次，一条长消息移出窗口时立即折叠
+    """
+
+    def __init__(self, llm, store=None, callbacks=None, min_new_tokens: Optional[int] = None,
+                 counter: Optional[TokenCounter] = None):
+        #run_name让埋点回调把这里的大模型调用计为摘要模型；后台线程中没有外层config，回调直接挂在链上
+        self.chain = (fold_prompt | llm).with_config(run_name="fold_summary", callbacks=callbacks)
+        self.store = store if store is not None else InMemorySummaryStore()
+        self.min_new_tokens = max(1, settings.summary_min_new_tokens if min_new_tokens is None else min_new_tokens)
+        #与上下文窗口共用token计数缓存，窗口刚数过的消息不必重新编码
+        self.counter = counter or get_context_window().counter
+
+    def _due(self, rolling: RollingSummary, stored_messages: List[BaseMessage], boundary: int) -> bool:
+        """水位线与boundary之间的消息攒够了min_new_tokens个token"""
+        pending = stored_messages[rolling.watermark:boundary]
+        return bool(pending) and self.counter.count_messages(pending) >= self.min_new_tokens
+
+    @staticmethod
+    def _valid(rolling: Optional[RollingSummary], stored_messages: List[BaseMessage]) -> RollingSummary:
+        """校验水位线：指纹对不上时向前查找锚点（历史前部被截断），找不到时保留摘要、从头折叠当前历史"""
+        if rolling is None:
+            return RollingSummary()
+        if not rolling.anchor:
+            #旧数据没有锚点：历史被清空或截断过，水位线失效，从头重建
+            return rolling if rolling.watermark <= len(stored_messages) else RollingSummary()
+        watermark = realign(rolling.watermark, rolling.anchor, stored_messages)
+        if watermark is None:
+            return RollingSummary(content=rolling.content)
+        if watermark == rolling.watermark:
+            return rolling
+        return RollingSummary(content=rolling.content, watermark=watermark, anchor=rolling.anchor)
+
+    @staticmethod
+    def _folded(summary_message, stored_messages: List[BaseMessage], boundary: int) -> RollingSummary:
+        return RollingSummary(content=summary_message.content, watermark=boundary,
+                              anchor=fingerprint(stored_messages[boundary - 1]))
+
+    @staticmethod
+    def _fold_input(rolling: RollingSummary, stored_messages: List[BaseMessage], boundary: int) -> dict:
+        return {
+            "summary": rolling.content or "无",
+            #摘要只需要文字，媒体片段一律换成占位文字
+            "chat_history": [strip_media(m) for m in stored_messages[rolling.watermark:boundary]],
+        }
+
+    def summarize(self, session_id: str, stored_messages: List[BaseMessage], k: int = 2) -> Tuple[List[BaseMessage], Optional[str]]:
+        """返回（最近k条消息，摘要文本）；消息不超过k条时摘要为None"""
+        return self.summarize_until(session_id, stored_messages, len(stored_messages) - k)
+
+    def summarize_until(self, session_id: str, stored_messages: List[BaseMessage], boundary: int) -> Tuple[List[BaseMessage], Optional[str]]:
+        """
+        把boundary之前的消息折叠进摘要，返回（boundary之后的消息，摘要文本）
+        boundary不大于0时不需要摘要，也不查询摘要存储；已折叠过的消息不会再放回窗口；
+        新移出窗口的消息不足min_new_tokens个token时不调用大模型，返回水位线之后的消息和已有摘要
+        """
+        if boundary <= 0:
+            return stored_messages, None
+
+        rolling = self._valid(self.store.get(session_id), stored_messages)
+        boundary = max(boundary, rolling.watermark)
+        if not self._due(rolling, stored_messages, boundary):
+            return stored_messages[rolling.watermark:], rolling.content or None
+        summary_message = self.chain.invoke(self._fold_input(rolling, stored_messages, boundary))
+        rolling = self._folded(summary_message, stored_messages, boundary)
+        self.store.set(session_id, rolling)
+
+        return stored_messages[boundary:], rolling.content
+
+    async def asummarize(self, session_id: str, stored_messages: List[BaseMessage], k: int = 2) -> Tuple[List[BaseMessage], Optional[str]]:
+        """summarize的异步版本"""
+        return await self.asummarize_until(session_id, stored_messages, len(stored_messages) - k)
+
+    async def asummarize_until(self, session_id: str, stored_messages: List[BaseMessage], boundary: int) -> Tuple[List[BaseMessage], Optional[str]]:
+        """summarize_until的异步版本"""
+        if boundary <= 0:
+            return stored_messages, None
+
+        rolling = self._valid(await self.store.aget(session_id), stored_messages)
+        boundary = max(boundary, rolling.watermark)
+        if not self._due(rolling, stored_messages, boundary):
+            return stored_messages[rolling.watermark:], rolling.content or None
+        summary_message = await self.chain.ainvoke(self._fold_input(rolling, stored_messages, boundary))
+        rolling = self._folded(summary_message, stored_messages, boundary)
+        await self.store.aset(session_id, rolling)
+
+        return stored_messages[boundary:], rolling.content
+
+    def latest(self, session_id: str, stored_messages: List[BaseMessage], boundary: int) -> Tuple[List[BaseMessage], Optional[str]]:
+        """
+        不调用大模型，直接使用最近一次已完成的摘要：
+        摘要覆盖到窗口之后时从水位线开始保留；新消息还没攒够、不会被折叠时也从水位线开始保留；
+        攒够了但后台摘要还没跟上时退回原始窗口（水位线与boundary之间的消息暂时不在上下文中）
+        """
+        if boundary <= 0:
+            return stored_messages, None
+        rolling = self._valid(self.store.get(session_id), stored_messages)
+        return stored_messages[self._keep_from(rolling, stored_messages, boundary):], rolling.content or None
+
+    async def alatest(self, session_id: str, stored_messages: List[BaseMessage], boundary: int) -> Tuple[List[BaseMessage], Optional[str]]:
+        """latest的异步版本"""
+        if boundary <= 0:
+            return stored_messages, None
+        rolling = self._valid(await self.store.aget(session_id), stored_messages)
+        return stored_messages[self._keep_from(rolling, stored_messages, boundary):], rolling.content or None
+
+    def _keep_from(self, rolling: RollingSummary, stored_messages: List[BaseMessage], boundary: int) -> int:
+        if self._due(rolling, stored_messages, boundary):
+            return max(boundary, rolling.watermark)
+        return rolling.watermark
+
+
+class _NotifyingHistory(BaseChatMessageHistory):
+    """包装聊天记录：一轮对话写入数据库后通知后台摘要"""
+
+    def __init__(self, history: BaseChatMessageHistory, notify: Callable[[], None]):
+        self.history = history
+        self.notify = notify
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        return self.history.messages
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return await self.history.aget_messages()
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.history.add_messages(messages)
+        self.notify()
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        await self.history.aadd_messages(messages)
+        self.notify()
+
+    def clear(self) -> None:
+        self.history.clear()
+
+    async def aclear(self) -> None:
+        await self.history.aclear()
+
+
+class SummaryWorker:
+    """
+    后台摘要：摘要的大模型调用不再放在回答之前
+    1、一轮对话写入数据库后，把该会话的摘要任务交给线程池，回答路径只读取已完成的摘要
+    2、按会话去重：同一会话同时最多一个任务在跑，期间再来的通知只标记一次重跑，连续多轮只多摘要一次
+    3、任务执行时重新加载历史，按上下文窗口算出需要折叠的范围
+    4、传入memory时，摘要之后顺便为同一范围的消息建立长期记忆索引
+    """
+
+    def __init__(self, summarizer: RollingSummarizer, get_session_history: Callable[[str], BaseChatMessageHistory],
+                 window: ContextWindow, max_workers: Optional[int] = None, memory=None):
+        self.summarizer = summarizer
+        self.memory = memory
+        self.get_session_history = get_session_history
+        self.window = window
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or settings.summary_workers,
+                                            thread_name_prefix="summary")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, bool] = {}  # 正在摘要的会话 -> 是否需要再跑一次
+        self._futures = set()
+        self.runs = 0
+        self.skipped = 0
+
+    def history_factory(self, session_id: str) -> BaseChatMessageHistory:
+        """交给RunnableWithMessageHistory的历史记录工厂：写入后自动调度摘要"""
+        return _NotifyingHistory(self.get_session_history(session_id), lambda: self.schedule(session_id))
+
+    def schedule(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._pending:
+                self._pending[session_id] = True
+                self.skipped += 1
+                return
+            self._pending[session_id] = False
+            future = self._executor.submit(self._run, session_id)
+            self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def _run(self, session_id: str) -> None:
+        while True:
+            try:
+                stored_messages = self.get_session_history(session_id).messages
+                selection = self.window.select(stored_messages)
+                self.summarizer.summarize_until(session_id, selection.messages, selection.boundary)
+                self.runs += 1
+                if self.memory is not None:
+                    self.memory.index(session_id, selection.messages, selection.boundary)
+            except Exception as e:
+                logger.warning("后台摘要失败（session_id = %s）：%r", session_id, e)
+            with self._lock:
+                if not self._pending.get(session_id):
+                    self._pending.pop(session_id, None)
+                    return
+                self._pending[session_id] = False
+
+    def wait_idle(self, timeout: Optional[float] = None) -> None:
+        """等待已调度的摘要全部完成（基准测试和退出前使用）"""
+        while self._futures:
+            wait(list(self._futures), timeout=timeout)
+            if timeout is not None:
+                break
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,6 @@
+"""测试与benchmarks一样直接导入项目根目录下的模块"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
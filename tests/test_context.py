@@ -0,0 +1,96 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.fakes import CountingFakeChatModel
+from context import ContextWindow, TokenCounter
+from history_store import MemoryChatMessageHistory, SessionStore
+from summary import RollingSummarizer
+
+
+class CharCounter(TokenCounter):
+    """按字符数计token，结果不依赖tiktoken能否加载"""
+
+    def count_text(self, text: str) -> int:
+        return len(text)
+
+
+def make_window(budget: int, reserve: int = 0, keep_media: int = 0) -> ContextWindow:
+    return ContextWindow(budget=budget, summary_reserve=reserve, keep_media_messages=keep_media,
+                         counter=CharCounter(media_tokens=100))
+
+
+def test_history_within_budget_is_kept_whole():
+    messages = [HumanMessage("a" * 10), AIMessage("b" * 10)]
+    selection = make_window(budget=28).select(messages)
+    assert selection.boundary == 0 and not selection.needs_summary
+    assert selection.tokens == 28  # 每条消息另加4个token的开销
+
+
+def test_boundary_keeps_newest_messages_within_budget_minus_reserve():
+    messages = [HumanMessage(str(i) * 6) for i in range(6)]  # 每条10个token
+    selection = make_window(budget=40, reserve=10).select(messages)
+    assert selection.boundary == 3
+    assert selection.recent == messages[3:]
+    assert selection.tokens == 30
+
+
+def test_newest_message_kept_even_when_over_budget():
+    messages = [HumanMessage("短"), HumanMessage("长" * 500)]
+    selection = make_window(budget=50).select(messages)
+    assert selection.boundary == 1 and selection.recent == messages[1:]
+
+
+def test_media_outside_keep_window_becomes_placeholder():
+    image = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA"}}
+    messages = [HumanMessage([image]), HumanMessage([image])]
+    selection = make_window(budget=10_000, keep_media=1).select(messages)
+    assert selection.messages[0].content == [{"type": "text", "text": "[图片]"}]
+    assert selection.messages[1].content == [image]
+
+
+def test_pasted_data_url_becomes_placeholder():
+    pasted = "data:image/png;base64," + "A" * 4000
+    messages = [HumanMessage(pasted), HumanMessage([{"type": "text", "text": f"看看这个：{pasted}"}]), AIMessage("收到")]
+    selection = make_window(budget=10_000).select(messages)
+    assert selection.messages[0].content == "[文件]"
+    assert selection.messages[1].content == [{"type": "text", "text": "看看这个：[文件]"}]
+    #替换后很短，不需要摘要；原消息（数据库中的历史）不受影响
+    assert not selection.needs_summary and messages[0].content == pasted
+
+
+def test_oversized_newest_message_folds_everything_before_it():
+    messages = [HumanMessage("早先的问题"), AIMessage("早先的回答"), HumanMessage("长文档：" + "内容" * 2000)]
+    selection = make_window(budget=500, reserve=100).select(messages)
+    assert selection.boundary == 2 and selection.recent == messages[2:]
+    assert selection.tokens == 4 + len(messages[2].content)  # 只有最新这一条，超出预算也保留
+
+
+class RecordingSummarizer(RollingSummarizer):
+    """记录每次交给大模型折叠的消息"""
+
+    def __init__(self, llm, **kwargs):
+        super().__init__(llm, **kwargs)
+        self.folded = []
+
+    def _fold_input(self, rolling, stored_messages, boundary):
+        fold_input = super()._fold_input(rolling, stored_messages, boundary)
+        self.folded.extend(m.content for m in fold_input["chat_history"])
+        return fold_input
+
+
+def test_capped_history_folds_each_message_exactly_once():
+    """内存中只保留最近10条：历史前部被截断后，每条消息恰好被折叠一次，不重复也不遗漏"""
+    #折叠阈值与窗口的摘要预留一致（默认阈值按默认预算设置）
+    summarizer = RecordingSummarizer(CountingFakeChatModel(), min_new_tokens=10, counter=CharCounter())
+    window = ContextWindow(budget=60, summary_reserve=20, keep_media_messages=0, counter=CharCounter())
+    history = MemoryChatMessageHistory("capped", SessionStore(max_messages=10))
+    sent = []
+    for turn in range(40):
+        selection = window.select(history.messages)
+        summarizer.summarize_until("capped", selection.messages, selection.boundary)
+        turn_messages = [HumanMessage(f"第{turn}轮：数字{turn}"), AIMessage(f"记住了{turn}")]
+        sent.extend(m.content for m in turn_messages)
+        history.add_messages(turn_messages)
+    assert len(history.messages) == 10
+    assert summarizer.folded
+    assert len(summarizer.folded) == len(set(summarizer.folded))
+    assert summarizer.folded == sent[:len(summarizer.folded)]
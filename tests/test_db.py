@@ -0,0 +1,230 @@
+"""PostgresPool：用假连接代替数据库，检查借出超时、失效连接的替换、异常时的回滚与归还"""
+
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+from psycopg2.pool import PoolError
+
+from db import PostgresPool, track_queries
+
+
+class FakeCursor:
+    def __init__(self, conn, cursor_factory):
+        self.conn = conn
+        self.cursor_factory = cursor_factory
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, vars=None):
+        self.conn.executed.append((query, self.cursor_factory))
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    def __init__(self, index):
+        self.index = index
+        self.closed = 0
+        self.broken = False
+        self.commits = self.rollbacks = 0
+        self.executed = []
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self, cursor_factory)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConnectionPool:
+    """ThreadedConnectionPool的接口：空闲连接复用，不够时新建"""
+
+    def __init__(self):
+        self.created = []
+        self.idle = []
+        self.discarded = []
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        with self._lock:
+            if self.idle:
+                return self.idle.pop()
+            conn = FakeConnection(len(self.created))
+            self.created.append(conn)
+            return conn
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            if close:
+                conn.close()
+                self.discarded.append(conn)
+            else:
+                self.idle.append(conn)
+
+    def closeall(self):
+        for conn in self.created:
+            conn.close()
+
+
+def make_pool(max_size=2, timeout=1.0, health_check_interval=30.0):
+    fake = FakeConnectionPool()
+    pool = PostgresPool("postgresql://fake", max_size=max_size, timeout=timeout,
+                        health_check_interval=health_check_interval, connection_pool=fake)
+    return pool, fake
+
+
+def test_checkout_waits_at_most_timeout():
+    pool, _ = make_pool(max_size=1, timeout=0.2)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with pool.connection():
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    start = time.monotonic()
+    with pytest.raises(PoolError):
+        with pool.connection():
+            pass
+    elapsed = time.monotonic() - start
+    release.set()
+    thread.join()
+    assert 0.15 <= elapsed < 1.0
+    #占用的连接归还后可以再次借出
+    with pool.connection():
+        pass
+
+
+def test_broken_idle_connection_is_replaced():
+    pool, fake = make_pool(health_check_interval=0.0)
+    with pool.connection() as conn:
+        first = conn
+    first.broken = True
+    with pool.connection() as conn:
+        assert conn is not first
+    assert fake.discarded == [first] and first.closed
+
+
+def test_recently_used_connection_skips_health_check():
+    pool, _ = make_pool(health_check_interval=60.0)
+    with pool.connection() as conn:
+        first = conn
+    first.executed.clear()
+    with pool.connection() as conn:
+        assert conn is first
+    assert first.executed == []
+
+
+def test_closed_connection_is_discarded_on_release():
+    pool, fake = make_pool()
+    with pool.connection() as conn:
+        conn.close()
+    assert fake.discarded == [conn] and fake.idle == []
+
+
+def test_exception_rolls_back_and_releases():
+    pool, fake = make_pool(max_size=1, timeout=0.2)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            rollbacks = conn.rollbacks
+            raise RuntimeError("boom")
+    assert conn.rollbacks == rollbacks + 1 and conn.commits == 0
+    assert fake.idle == [conn]
+    #名额也已归还：池大小为1时仍能立即借出
+    with pool.connection() as again:
+        assert again is conn
+    assert conn.commits == 1
+
+
+def test_health_check_is_not_counted():
+    pool, _ = make_pool(health_check_interval=0.0)
+    with pool.connection():
+        pass
+    with track_queries() as stats:
+        with pool.connection() as conn:
+            pass
+    query, cursor_factory = conn.executed[-1]
+    assert query == "SELECT 1;" and cursor_factory is psycopg2.extensions.cursor
+    assert stats.queries == 0
+
+
+def test_async_pool_is_opened_once_per_event_loop(monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+
+    import psycopg_pool
+
+    import db
+
+    class FakeAsyncPool:
+        opened = []
+        closed = []
+        finished = []
+
+        def __init__(self, *args, **kwargs):
+            #池中的空闲连接，断开时记录
+            self._pool = [SimpleNamespace(pgconn=SimpleNamespace(finish=lambda: self.finished.append(self)))]
+
+        async def open(self):
+            await asyncio.sleep(0.001)
+            self.opened.append(asyncio.get_running_loop())
+
+        async def close(self):
+            self.closed.append((self, asyncio.get_running_loop()))
+            self._pool = []
+
+    monkeypatch.setattr(psycopg_pool, "AsyncConnectionPool", FakeAsyncPool)
+    monkeypatch.setattr(db, "_async_pools", {})
+    monkeypatch.setattr(db, "_async_pool_locks", {})
+    monkeypatch.setattr(db, "_async_pool_guards", {})
+
+    async def main():
+        pools = await asyncio.gather(*(db.get_async_pool() for _ in range(3)))
+        assert all(pool is pools[0] for pool in pools)
+        return pools[0], asyncio.get_running_loop()
+
+    #第二个事件循环打开自己的连接池，不复用上一个循环的池和锁
+    (first, first_loop), (second, second_loop) = asyncio.run(main()), asyncio.run(main())
+    assert first is not second and len(FakeAsyncPool.opened) == 2
+    #asyncio.run结束时在各自的事件循环中关闭连接池
+    assert FakeAsyncPool.closed == [(first, first_loop), (second, second_loop)]
+    assert len(db._async_pool_locks) == 1  # 已关闭的循环的锁已清理
+
+    #没有取消任务就关闭了的事件循环（守护任务没有运行）：下次查找时断开它的连接池中的空闲连接
+    class ClosedLoop:
+        def is_closed(self):
+            return True
+
+    loop, orphan = ClosedLoop(), FakeAsyncPool()
+    db._async_pools[loop], db._async_pool_locks[loop] = orphan, None
+    asyncio.run(main())
+    assert FakeAsyncPool.finished == [orphan]
+    assert loop not in db._async_pools and loop not in db._async_pool_locks
+
+
+def test_history_index_is_only_created_with_a_new_table():
+    """已有的表不在首次请求时建索引（普通CREATE INDEX会阻塞写入），交给migrate_history_table在线建"""
+    from db import PooledPostgresChatMessageHistory, history_index_name
+    pool, fake = make_pool()
+    history = PooledPostgresChatMessageHistory("s", pool=pool, table_name="test_history_ddl")
+    history.clear()
+    ddl = next(query for query, _ in fake.created[0].executed if "test_history_ddl (" in query)
+    branch = ddl[ddl.index("IF to_regclass('test_history_ddl') IS NULL THEN"):ddl.index("END IF;")]
+    assert f"CREATE INDEX IF NOT EXISTS {history_index_name('test_history_ddl')}" in branch
+    assert "CONCURRENTLY" not in ddl and ddl.count("CREATE INDEX") == 1
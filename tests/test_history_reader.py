@@ -0,0 +1,131 @@
+"""分页回放历史：键集分页的边界（剩余恰好一页、空会话、其他会话交错写入）"""
+
+from contextlib import contextmanager
+
+import pytest
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from history_reader import MemoryHistoryReader, PostgresHistoryReader
+from history_store import SessionStore
+
+PAGE = 4
+
+
+class FakeTable:
+    """按id递增追加的message_store；cursor只实现分页查询（按_page_sql的参数顺序取值）"""
+
+    def __init__(self):
+        self.rows = []  # (id, session_id, 类型, 内容)
+        self.queries = []
+
+    def insert(self, session_id, messages):
+        for message in messages:
+            self.rows.append((len(self.rows) + 1, session_id, message.type, message.content))
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, params=()):
+        self.result = []
+        if not query.startswith("SELECT"):
+            return
+        self.queries.append(params)
+        if "id < %s" in query:
+            session_id, before, limit = params
+        else:
+            (session_id, limit), before = params, None
+        rows = [r for r in self.rows if r[1] == session_id and (before is None or r[0] < before)]
+        self.result = [(row_id, kind, content) for row_id, _, kind, content in reversed(rows)][:limit]
+
+    def fetchall(self):
+        return self.result
+
+
+def turns(n, prefix="问"):
+    return [m for i in range(n) for m in (HumanMessage(f"{prefix}{i}"), AIMessage(f"答{i}"))]
+
+
+def read_all(reader, session_id):
+    pages, before = [], None
+    while True:
+        page = reader.page(session_id, before=before, limit=PAGE)
+        pages.append(page)
+        if page.before is None:
+            return pages
+        before = page.before
+
+
+@pytest.fixture
+def table():
+    """测试会话s有12条消息，与其他会话交错写入，id不连续"""
+    table = FakeTable()
+    for i in range(3):
+        table.insert("s", turns(2, prefix=f"第{i}批问"))
+        table.insert("other", turns(3))
+    return table
+
+
+def postgres_reader(table):
+    return PostgresHistoryReader(pool=table, table_name="fake_history")
+
+
+def contents(pages):
+    return [m["content"] for page in reversed(pages) for m in page.messages]
+
+
+def test_exact_multiple_of_page_size_has_no_empty_tail(table):
+    pages = read_all(postgres_reader(table), "s")
+    #12条消息、每页4条：恰好3页，最后一页就标记为没有更早的消息，不会再翻出一页空的
+    assert [len(p.messages) for p in pages] == [4, 4, 4]
+    assert contents(pages) == [r[3] for r in table.rows if r[1] == "s"]
+    #每次查询多取一行，用来判断是否还有更早的消息
+    assert all(params[-1] == PAGE + 1 for params in table.queries)
+
+
+def test_cursor_is_smallest_id_of_page(table):
+    reader = postgres_reader(table)
+    first = reader.page("s", limit=PAGE)
+    ids = [r[0] for r in table.rows if r[1] == "s"]
+    assert first.before == ids[-PAGE]
+    second = reader.page("s", before=first.before, limit=PAGE)
+    assert contents([first, second]) == [r[3] for r in table.rows if r[1] == "s"][-2 * PAGE:]
+
+
+def test_last_page_shorter_than_limit(table):
+    table.insert("s", [HumanMessage("最新")])
+    pages = read_all(postgres_reader(table), "s")
+    assert [len(p.messages) for p in pages] == [4, 4, 4, 1]
+    assert pages[0].messages[-1]["content"] == "最新"
+
+
+def test_empty_session_has_no_cursor(table):
+    page = postgres_reader(table).page("nobody", limit=PAGE)
+    assert page.messages == [] and page.before is None
+
+
+@pytest.mark.parametrize("count, sizes", [(8, [4, 4]), (9, [4, 4, 1]), (3, [3])])
+def test_memory_reader_pages(count, sizes):
+    history = InMemoryChatMessageHistory()
+    history.add_messages(turns(count)[:count])
+    pages = read_all(MemoryHistoryReader(lambda _: history), "s")
+    assert [len(p.messages) for p in pages] == sizes
+    assert contents(pages) == [m.content for m in history.messages]
+
+
+def test_memory_reader_cursor_survives_trimming():
+    store = SessionStore(max_messages=10)
+    store.add("s", turns(5))
+    reader = MemoryHistoryReader(store.history)
+    first = reader.page("s", limit=PAGE)
+    #两次翻页之间又写入4条，最早的4条超出上限被丢弃：下标前移，序号不变
+    store.add("s", turns(2, prefix="新"))
+    second = reader.page("s", before=first.before, limit=PAGE)
+    #接着第一页往前读，既不重复第一页的消息，也不跳过仍在内存中的更早消息
+    assert contents([first, second]) == [m.content for m in turns(5)][4:]
+    assert second.before is None  # 更早的消息已被丢弃
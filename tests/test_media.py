@@ -0,0 +1,125 @@
+"""媒体：重采样抗混叠、流式base64、长录音分段识别、payload上限与编码失败时的兜底片段、识别结果的缓存键"""
+
+import asyncio
+import base64
+import os
+import wave
+from pathlib import Path
+
+import numpy as np
+
+import pytest
+
+import asr
+from benchmarks.fakes import FakeASR, SegmentASR, write_long_wav
+from config import get_settings
+from media import (MediaTooLarge, _pcm_to_float, b64encode_file, encode_audio_part, prepare_media_groups, raw_file_part,
+                   resample)
+from media_cache import MediaCache
+
+settings = get_settings()
+
+#真实的48kHz语音录音，叠加了12kHz的高频噪声
+SPEECH_48K = Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures" / "speech_48k_mono.wav"
+
+
+def band_db(samples: np.ndarray, rate: int, freq: float, width: float = 100.0) -> float:
+    """freq附近±width Hz的能量(dB)"""
+    spectrum = np.abs(np.fft.rfft(samples)) ** 2
+    freqs = np.fft.rfftfreq(len(samples), 1 / rate)
+    return 10 * np.log10(spectrum[np.abs(freqs - freq) < width].sum() + 1e-12)
+
+
+def test_resample_filters_out_aliasing():
+    with wave.open(str(SPEECH_48K)) as wav:
+        rate = wav.getframerate()
+        samples = _pcm_to_float(wav.readframes(wav.getnframes()), wav.getsampwidth(), wav.getnchannels()).ravel()
+    #按块取平均（不做低通）时12kHz噪声混叠到4kHz，旁边3.5kHz只有底噪
+    box = samples[:len(samples) // 3 * 3].reshape(-1, 3).mean(axis=1)
+    filtered = resample(samples, rate, 16000)
+    floor_db = band_db(filtered, 16000, 3500)
+    assert band_db(box, 16000, 4000) > floor_db + 10  # 样本中确实有可测的混叠
+    assert band_db(filtered, 16000, 4000) < floor_db + 3
+    assert abs(len(filtered) - len(samples) // 3) <= 1
+    #语音频段不受低通影响
+    assert band_db(filtered, 16000, 160) > band_db(box, 16000, 160) - 1
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 1000, 10_001])
+def test_streamed_base64_matches_b64encode(tmp_path, size):
+    path = tmp_path / "blob.bin"
+    path.write_bytes(os.urandom(size))
+    #块大小不是3的倍数时按3对齐，块之间不能出现填充符
+    assert b64encode_file(str(path), chunk_size=100) == base64.b64encode(path.read_bytes()).decode("ascii")
+
+
+def test_long_recording_is_cut_in_pauses(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "asr_chunk_seconds", 5.0)
+    path = tmp_path / "long.wav"
+    write_long_wav(path, 32, rate=16000)
+    backend = SegmentASR()
+    text = asr.transcribe_file(str(path), backend=backend)
+    assert backend.calls > 1 and text == "段" * backend.calls
+    assert max(backend.durations) <= settings.asr_chunk_seconds + 1e-6
+    assert abs(sum(backend.durations) - 32) < 0.1  # 分段没有丢失音频
+    #最后一段的结尾是录音结尾，不算切点
+    assert backend.clean_cuts >= backend.calls - 1
+
+
+def test_long_audio_is_sent_as_transcript(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "media_max_audio_seconds", 8.0)
+    monkeypatch.setattr(asr, "_backend", SegmentASR())
+    short, long = tmp_path / "short.wav", tmp_path / "long.wav"
+    write_long_wav(short, 3, rate=16000)
+    write_long_wav(long, 12, rate=16000)
+    short_part = encode_audio_part(str(short))
+    assert short_part["type"] == "audio_url"
+    assert len(short_part["audio_url"]["url"]) <= settings.media_max_payload_bytes
+    assert encode_audio_part(str(long))["type"] == "text"
+
+
+def test_raw_file_over_payload_cap_is_not_sent(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "media_max_payload_bytes", 10_000)
+    big = tmp_path / "big.m4a"
+    big.write_bytes(os.urandom(10_000))  # base64后超过上限
+    with pytest.raises(MediaTooLarge):
+        raw_file_part(str(big))
+
+
+def test_failed_files_fall_back_without_affecting_others(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "media_max_payload_bytes", 200_000)
+    short, big, video = tmp_path / "short.wav", tmp_path / "big.m4a", tmp_path / "clip.mp4"
+    write_long_wav(short, 2, rate=16000)
+    with open(big, "wb") as f:
+        f.truncate(settings.media_max_payload_bytes)  # 无法解码，原文件base64后又超过上限
+    video.write_bytes(os.urandom(2_000))  # 无法抽帧（或没有ffmpeg），原文件不大
+    groups = asyncio.run(prepare_media_groups([str(short), str(big), str(video)]))
+    assert [[part["type"] for part in group] for group in groups] == [["audio_url"], ["text"], ["video_url"]]
+    assert "big.m4a" in groups[1][0]["text"]
+    for group in groups:
+        for part in group:
+            url = part[part["type"]]["url"] if part["type"] != "text" else ""
+            assert len(url) <= settings.media_max_payload_bytes + 100  # data URL前缀
+
+
+def test_asr_cache_key_follows_preprocessing_settings(tmp_path, monkeypatch):
+    cache = MediaCache(memory_bytes=1 << 20)
+    monkeypatch.setattr(asr, "get_media_cache", lambda: cache)
+    path = tmp_path / "short.wav"
+    write_long_wav(path, 2, rate=16000)
+    backend = FakeASR(text="好")
+
+    async def transcribe():
+        text = ""
+        async for text in asr.astream_transcript(str(path), backend=backend):
+            pass
+        return text
+
+    assert asyncio.run(transcribe()) == "好" and asyncio.run(transcribe()) == "好"
+    assert backend.calls == 1  # 同一段录音只识别一次
+    #改了送去识别的音频的处理参数后重新识别，不返回旧的结果
+    monkeypatch.setattr(settings, "audio_silence_threshold_db", -30.0)
+    asyncio.run(transcribe())
+    monkeypatch.setattr(settings, "asr_sample_rate", 8000)
+    asyncio.run(transcribe())
+    assert backend.calls == 3
@@ -0,0 +1,33 @@
+import json
+
+from media_cache import MediaCache, value_size
+
+
+def test_memory_hit_returns_stored_object():
+    cache = MediaCache(memory_bytes=1 << 20)
+    part = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + "A" * 1000}}
+    cache.set("k", part)
+    assert cache.get("k") is part
+    assert cache.stats.memory_hits == 1
+
+
+def test_memory_capacity_uses_estimated_size():
+    value = {"type": "text", "text": "识别结果" * 10}
+    assert value_size(value) >= len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    cache = MediaCache(memory_bytes=3 * value_size(value))
+    for i in range(5):
+        cache.set(f"k{i}", value)
+    assert cache.get("k0") is None
+    assert cache.get("k4") is value
+    assert cache.stats.memory_evictions == 2
+
+
+def test_disk_roundtrip_after_memory_eviction(tmp_path):
+    cache = MediaCache(memory_bytes=1 << 20, disk_dir=str(tmp_path), disk_bytes=1 << 20)
+    cache.set("k", ["第一句", "第二句"])
+    cache._memory.clear()
+    assert cache.get("k") == ["第一句", "第二句"]
+    assert cache.stats.disk_hits == 1
+    #从磁盘取回后进入内存层，下次直接返回同一个对象
+    assert cache.get("k") is cache.get("k")
+    assert cache.stats.memory_hits == 2
@@ -0,0 +1,110 @@
+"""长期记忆：按时间顺序取回、按水位线/锚点增量索引不重复向量化、取回内容并入开头的系统提示词"""
+
+import asyncio
+from typing import List
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.fakes import CountingFakeChatModel, message_text
+from context import ContextWindow
+from memory import InMemoryMemoryStore, LongTermMemory
+from response_cache import HashingEmbeddings
+from summary import RollingSummarizer
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """统计向量化的文本条数"""
+
+    def __init__(self):
+        super().__init__()
+        self.documents = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.documents += len(texts)
+        return super().embed_documents(texts)
+
+
+def make_memory(**kwargs) -> LongTermMemory:
+    return LongTermMemory(CountingEmbeddings(), InMemoryMemoryStore(), **kwargs)
+
+
+def turns(n: int, start: int = 0):
+    messages = []
+    for i in range(start, start + n):
+        messages += [HumanMessage(f"第{i}轮：我的第{i}个爱好是集邮"), AIMessage(f"记住了，第{i}个爱好是集邮")]
+    return messages
+
+
+def test_recall_keeps_chronological_order():
+    memory = make_memory(top_k=6, min_score=0.0, batch_size=3)
+    history = turns(3)
+    memory.index("s", history, len(history))
+    text = memory.recall("s", "第2个爱好 第0个爱好 第1个爱好")
+    lines = text.splitlines()[1:]
+    assert len(lines) == 6
+    #相似度高低不影响顺序，按对话中的先后排列
+    assert [line.split("：", 1)[1] for line in lines] == [message_text(m) for m in history]
+
+
+def test_recall_skips_messages_still_in_the_window():
+    memory = make_memory(top_k=4, min_score=0.0)
+    history = turns(2)
+    memory.index("s", history, len(history))
+    text = memory.recall("s", "爱好", exclude=history[2:])
+    assert message_text(history[0]) in text and message_text(history[2]) not in text
+
+
+def test_index_is_incremental():
+    memory = make_memory(batch_size=3)
+    history = turns(4)
+    assert memory.index("s", history, 4) == 4
+    assert memory.index("s", history, 4) == 0  # 已索引的消息不再向量化
+    assert memory.index("s", history, 8) == 4
+    assert memory.embeddings.documents == 8 and memory.embedded == 8
+
+
+def test_index_realigns_after_history_is_truncated():
+    memory = make_memory()
+    history = turns(4)
+    memory.index("s", history, 6)
+    #历史前部被截断4条：按锚点找到新的水位线，只为新移出窗口的消息向量化
+    truncated = history[4:] + turns(2, start=4)
+    assert memory.index("s", truncated, 6) == 4
+    assert memory.embeddings.documents == 10
+
+
+class PromptRecordingModel(CountingFakeChatModel):
+    """记录最近一次收到的提示词"""
+
+    last_messages: list = []
+
+    def _reply(self, messages):
+        self.last_messages = list(messages)
+        return super()._reply(messages)
+
+
+def test_recalled_text_is_merged_into_the_leading_system_message():
+    from main import build_final_chain
+    histories = {}
+    llm = PromptRecordingModel(reply_chars=20)
+    memory = make_memory(top_k=2)
+    chain = build_final_chain(llm, lambda s: histories.setdefault(s, InMemoryChatMessageHistory()),
+                              RollingSummarizer(CountingFakeChatModel(reply_chars=20), min_new_tokens=1),
+                              window=ContextWindow(budget=300, summary_reserve=100), memory=memory)
+    config = {"configurable": {"session_id": "long"}}
+
+    async def ask(question: str):
+        async for _ in chain.astream({"input": question, "config": config}, config=config):
+            pass
+
+    async def main():
+        await ask("我的车牌号是京A7K3Q9，记一下")
+        for turn in range(20):
+            await ask(f"第{turn}轮：随便聊聊天气")
+        await ask("我的车牌号是多少？")
+
+    asyncio.run(main())
+    systems = [i for i, m in enumerate(llm.last_messages) if m.type == "system"]
+    assert systems == [0]  # 提示词中只有开头一条系统消息
+    assert "京A7K3Q9" in message_text(llm.last_messages[0])
@@ -0,0 +1,43 @@
+import threading
+import uuid
+
+from metrics import MetricsCallbackHandler
+
+
+def test_unfinished_runs_expire_after_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("metrics.time.perf_counter", lambda: clock[0])
+    handler = MetricsCallbackHandler(ttl=60)
+    #流被取消：只有开始回调，没有结束回调
+    handler.on_chain_start({}, {}, run_id=uuid.uuid4(), name="load_history")
+    handler.on_chat_model_start({}, [], run_id=uuid.uuid4())
+    assert len(handler._stages) == 1 and len(handler._llms) == 1
+
+    clock[0] += 30
+    handler.on_chain_start({}, {}, run_id=uuid.uuid4(), name="load_history")
+    assert len(handler._stages) == 2
+
+    clock[0] += 31
+    handler.on_chain_start({}, {}, run_id=uuid.uuid4(), name="load_history")
+    assert len(handler._stages) == 2  # 第一个已过期，第二个还在ttl内
+    assert not handler._llms
+
+
+def test_callbacks_from_many_threads():
+    handler = MetricsCallbackHandler()
+
+    def turn():
+        for _ in range(200):
+            run_id = uuid.uuid4()
+            handler.on_chain_start({}, {}, run_id=run_id, name="summarize_messages")
+            handler.on_chat_model_start({}, [], run_id=run_id, parent_run_id=None)
+            handler.on_llm_new_token("你", run_id=run_id)
+            handler.on_chain_end({}, run_id=run_id)
+            handler.on_llm_error(RuntimeError(), run_id=run_id)
+
+    threads = [threading.Thread(target=turn) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not handler._stages and not handler._llms
@@ -0,0 +1,159 @@
+"""外部调用调度：可重试错误的判断、退避重试、流式调用不重复输出、按优先级放行、向量化微批"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fakes import MockProvider, MockProviderEmbeddings, RateLimitError
+from outbound import (BACKGROUND, INTERACTIVE, ProviderLimiter, ScheduledEmbeddings, is_retryable,
+                      retry_after)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def limiter(**kwargs):
+    return ProviderLimiter("test", **{"max_retries": 3, "backoff_base": 0.001, "backoff_max": 0.01, **kwargs})
+
+
+def flaky(failures, error=lambda: RateLimitError(0.001)):
+    """前failures次调用抛出error，之后返回调用次数"""
+    calls = [0]
+
+    def fn():
+        calls[0] += 1
+        if calls[0] <= failures:
+            raise error()
+        return calls[0]
+    return fn
+
+
+def test_retryable_errors():
+    assert is_retryable(RateLimitError(1.0))
+    assert is_retryable(StatusError(503)) and is_retryable(StatusError(408))
+    assert not is_retryable(StatusError(400)) and not is_retryable(StatusError(401))
+    assert is_retryable(TimeoutError()) and is_retryable(ConnectionError())
+    assert not is_retryable(ValueError())
+    assert retry_after(RateLimitError(1.5)) == 1.5
+    assert retry_after(ValueError()) is None
+
+
+def test_retries_throttled_calls_until_success():
+    scheduler = limiter()
+    assert scheduler.call(flaky(2)) == 3
+    assert scheduler.snapshot() == {"calls": 3, "queued": 0, "retries": 2, "throttled": 2, "failures": 0,
+                                    "in_flight": 0, "waiting": 0}
+
+
+def test_gives_up_after_max_retries():
+    scheduler = limiter(max_retries=2)
+    with pytest.raises(RateLimitError):
+        scheduler.call(flaky(10))
+    assert scheduler.stats.calls == 3 and scheduler.stats.failures == 1
+
+
+def test_non_retryable_error_is_raised_immediately():
+    scheduler = limiter()
+    fn = flaky(1, lambda: StatusError(400))
+
+    async def request():
+        return fn()
+
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler.acall(request))
+    assert scheduler.stats.calls == 1 and scheduler.stats.retries == 0 and scheduler.snapshot()["in_flight"] == 0
+
+
+def test_stream_retries_only_before_first_item():
+    scheduler = limiter()
+    attempts = [0]
+
+    def fails_before_output():
+        attempts[0] += 1
+        if attempts[0] == 1:
+            raise RateLimitError(0.001)
+        yield from "你好"
+
+    assert list(scheduler.stream(fails_before_output)) == ["你", "好"]
+
+    def fails_after_output():
+        yield "你"
+        raise RateLimitError(0.001)
+
+    received = []
+    with pytest.raises(RateLimitError):
+        for item in scheduler.stream(fails_after_output):
+            received.append(item)
+    #已经输出的内容不会因为重试而重复
+    assert received == ["你"] and scheduler.snapshot()["in_flight"] == 0
+
+
+def test_interactive_requests_are_released_before_background():
+    scheduler = limiter(max_in_flight=1)
+    order = []
+
+    async def request(priority, name):
+        await scheduler.aacquire(priority)
+        order.append(name)
+        await asyncio.sleep(0.005)
+        scheduler.release()
+
+    async def main():
+        #占住唯一的名额，让后续请求全部排队；后台请求先到，交互式请求后到
+        await scheduler.aacquire(INTERACTIVE)
+        tasks = [asyncio.create_task(request(BACKGROUND, f"摘要{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        tasks += [asyncio.create_task(request(INTERACTIVE, f"回答{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["回答0", "回答1", "回答2", "摘要0", "摘要1", "摘要2"]
+
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = limiter(max_in_flight=1)
+
+    async def main():
+        await scheduler.aacquire()
+        waiter = asyncio.create_task(scheduler.aacquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        scheduler.release()
+        #名额没有被取消的请求占走，下一个请求可以立即拿到
+        await asyncio.wait_for(scheduler.aacquire(), 1.0)
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.snapshot()["in_flight"] == 0
+
+
+def test_token_bucket_paces_requests():
+    scheduler = limiter(rate=100.0, burst=2)
+    times = []
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        list(pool.map(lambda _: scheduler.call(lambda: times.append(time.monotonic())), range(6)))
+    times.sort()
+    #突发2个之后每秒100个：6个请求至少间隔约40ms
+    assert times[-1] - times[0] >= 0.035
+
+
+def test_embed_query_micro_batches_and_returns_each_callers_vector():
+    server = MockProvider(rate=1000.0, burst=1000, max_in_flight=1000, latency=0.02)
+    embeddings = MockProviderEmbeddings(server)
+    client = ScheduledEmbeddings(embeddings, ProviderLimiter("test-embeddings", max_retries=0), max_batch=16,
+                                 max_wait=0.01)
+    texts = [f"问题{i}" for i in range(64)]
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        vectors = list(pool.map(client.embed_query, texts))
+    assert vectors == [embeddings._vector(t) for t in texts]
+    assert embeddings.calls <= len(texts) // 4
+    assert embeddings.texts == len(texts)
@@ -0,0 +1,107 @@
+"""回答缓存：归一化后的精确匹配、相似匹配、过期、按容量淘汰，以及链中的会话隔离和按会话关闭"""
+
+import asyncio
+
+import pytest
+from langchain_core.chat_history import InMemoryChatMessageHistory
+
+from benchmarks.fakes import CountingFakeChatModel
+from context import ContextWindow
+from response_cache import HashingEmbeddings, ResponseCache
+from summary import RollingSummarizer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("response_cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_exact_hit_ignores_punctuation_width_and_case():
+    cache = ResponseCache(ttl=0, max_entries=10, shared=True)
+    cache.put(cache.key("什么是Python？", "ctx"), "一种编程语言")
+    assert cache.get(cache.key("什么是python", "ctx")) == "一种编程语言"
+    assert cache.get(cache.key("什么是ＰＹＴＨＯＮ!", "ctx")) == "一种编程语言"
+    assert cache.get(cache.key("什么是Python？", "其他上下文")) is None
+    assert cache.stats.exact_hits == 2 and cache.stats.misses == 1
+
+
+def test_semantic_hit_only_within_same_context():
+    cache = ResponseCache(embeddings=HashingEmbeddings(), threshold=0.8, ttl=0, max_entries=10)
+    cache.put(cache.key("如何申请退款", "ctx"), "在订单页申请")
+    assert cache.get(cache.key("请问如何申请退款", "ctx")) == "在订单页申请"
+    assert cache.get(cache.key("请问如何申请退款", "其他上下文")) is None
+    assert cache.get(cache.key("今天天气怎么样", "ctx")) is None
+    assert cache.stats.semantic_hits == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(embeddings=HashingEmbeddings(), threshold=0.8, ttl=10, max_entries=10)
+    cache.put(cache.key("如何申请退款", "ctx"), "在订单页申请")
+    clock[0] += 9
+    assert cache.get(cache.key("如何申请退款", "ctx")) == "在订单页申请"
+    clock[0] += 2
+    assert cache.get(cache.key("如何申请退款", "ctx")) is None
+    #过期的条目也从向量索引中移除，相似匹配不会再找到它
+    assert cache.get(cache.key("请问如何申请退款", "ctx")) is None
+    assert cache.stats.expirations == 1 and cache.snapshot()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(ttl=0, max_entries=2)
+    for question in ("一", "二"):
+        cache.put(cache.key(question, "ctx"), question)
+    cache.get(cache.key("一", "ctx"))
+    cache.put(cache.key("三", "ctx"), "三")
+    assert cache.get(cache.key("二", "ctx")) is None
+    assert cache.get(cache.key("一", "ctx")) == "一" and cache.get(cache.key("三", "ctx")) == "三"
+    assert cache.stats.evictions == 1
+
+
+def build(cache):
+    from main import build_final_chain
+    histories = {}
+    llm = CountingFakeChatModel()
+    chain = build_final_chain(llm, lambda session_id: histories.setdefault(session_id, InMemoryChatMessageHistory()),
+                              RollingSummarizer(CountingFakeChatModel()), window=ContextWindow(budget=2000),
+                              cache=cache)
+
+    def ask(session_id, question):
+        config = {"configurable": {"session_id": session_id}}
+
+        async def run():
+            return "".join([chunk.content async for chunk in chain.astream({"input": question, "config": config},
+                                                                           config=config)])
+        return asyncio.run(run())
+    return ask, llm
+
+
+def test_answers_not_shared_between_sessions_by_default():
+    ask, llm = build(ResponseCache(ttl=0, max_entries=100))
+    ask("a", "什么是机器学习？")
+    ask("b", "什么是机器学习？")
+    assert llm.calls == 2
+    ask("a", "什么是机器学习")
+    assert llm.calls == 2
+
+
+def test_shared_cache_reuses_answers_across_sessions():
+    ask, llm = build(ResponseCache(ttl=0, max_entries=100, shared=True))
+    ask("a", "什么是机器学习？")
+    ask("b", "什么是机器学习？")
+    assert llm.calls == 1
+
+
+def test_disabled_session_always_calls_model():
+    cache = ResponseCache(ttl=0, max_entries=100)
+    ask, llm = build(cache)
+    cache.disable("c")
+    for session_id in ("d", "d", "c", "c"):
+        ask(session_id, "什么是机器学习？")
+    assert llm.calls == 3
+    #关闭期间不写入缓存，重新打开后第一次仍需调用大模型
+    cache.enable("c")
+    ask("c", "什么是机器学习？")
+    ask("c", "什么是机器学习？")
+    assert llm.calls == 4
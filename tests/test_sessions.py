@@ -0,0 +1,126 @@
+"""会话：session_id的分配，按会话排队（同一会话的对话轮依次进行、不同会话并发）"""
+
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.fakes import CountingFakeChatModel, FakeLatencyHistory, message_text
+from sessions import SessionLocks, assign_session_id, resolve_session_id
+from summary import RollingSummarizer
+
+
+def test_resolve_session_id():
+    assert resolve_session_id("tab", SimpleNamespace(username="alice")) == "user:alice"
+    assert resolve_session_id("tab", SimpleNamespace(username=None)) == "tab"
+    assert resolve_session_id(None, SimpleNamespace(username="alice")) == "user:alice"
+    #对话中途没有id时报错，不悄悄开始一个新会话
+    with pytest.raises(ValueError):
+        resolve_session_id(None, SimpleNamespace(username=None))
+
+
+def test_assign_session_id_keeps_the_browser_id():
+    #刷新页面时沿用浏览器中保存的id，第一次打开时才新生成
+    assert assign_session_id("saved", SimpleNamespace(username=None)) == "saved"
+    assert assign_session_id("saved", SimpleNamespace(username="alice")) == "user:alice"
+    new = assign_session_id(None, SimpleNamespace(username=None))
+    assert new and new != assign_session_id()
+
+
+def test_same_session_runs_one_turn_at_a_time():
+    locks = SessionLocks()
+    running = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+    overlap = []
+
+    async def turn(session_id):
+        async with locks.hold(session_id):
+            running[session_id] += 1
+            peak[session_id] = max(peak[session_id], running[session_id])
+            overlap.append(sum(running.values()))
+            await asyncio.sleep(0.01)
+            running[session_id] -= 1
+
+    async def main():
+        await asyncio.gather(*(turn(s) for s in ("a", "b") for _ in range(3)))
+
+    asyncio.run(main())
+    assert peak == {"a": 1, "b": 1}
+    assert max(overlap) == 2  # 不同会话之间不互相等待
+    assert locks.waits == 4
+    #没有进行中的对话轮时不保留锁对象
+    assert locks.snapshot()["active_sessions"] == 0
+
+
+TAG = re.compile(r"^\[(\w+)/")
+
+
+class SeenTurnsModel(CountingFakeChatModel):
+    """记录每次调用时提示词中已有的同会话轮数，以及混入的其他会话的消息数"""
+
+    seen: dict = {}
+    leaked: int = 0
+
+    def _reply(self, messages):
+        humans = [m for m in messages if isinstance(m, HumanMessage)]
+        user = TAG.match(message_text(humans[-1])).group(1)
+        tags = [TAG.match(message_text(m)) for m in humans[:-1]]
+        self.seen.setdefault(user, []).append(sum(1 for t in tags if t and t.group(1) == user))
+        self.leaked += sum(1 for t in tags if t and t.group(1) != user)
+        return super()._reply(messages)
+
+
+def test_two_tabs_of_one_session_see_every_previous_turn():
+    from main import ChatApp, get_config
+    histories = {}
+    llm = SeenTurnsModel(token_delay=0.001, reply_chars=20, seen={})
+    app = ChatApp(llm=llm, summarizer=RollingSummarizer(CountingFakeChatModel()),
+                  get_session_history=lambda s: histories.setdefault(s, FakeLatencyHistory(0.002)))
+    users, tabs, turns = 3, 2, 3
+
+    async def tab(user, index):
+        config = get_config(user)
+        for turn in range(turns):
+            async with app.turn(user):
+                async for _ in app.final_chain.astream({"input": f"[{user}/{index}] 第{turn}轮", "config": config},
+                                                       config=config):
+                    pass
+
+    async def main():
+        await asyncio.gather(*(tab(f"u{u}", t) for u in range(users) for t in range(tabs)))
+
+    asyncio.run(main())
+    if app.summary_worker is not None:
+        app.summary_worker.wait_idle()
+    #每轮都看到同一会话之前的所有轮次（0、1、2……），没有读到过期历史，也没有混入其他会话
+    assert all(sorted(seen) == list(range(turns * tabs)) for seen in llm.seen.values())
+    assert len(llm.seen) == users and llm.leaked == 0
+    for user in llm.seen:
+        #流式写入的回复是AIMessageChunk，按AIMessage计
+        roles = ["human" if isinstance(m, HumanMessage) else "ai" if isinstance(m, AIMessage) else m.type
+                 for m in histories[user]._messages]
+        assert roles == ["human", "ai"] * turns * tabs
+
+
+def test_turns_run_under_separate_event_loops(monkeypatch):
+    import main
+    monkeypatch.setattr(main.setting, "max_concurrent_turns", 1)
+    app = main.ChatApp(llm=CountingFakeChatModel(), summarizer=RollingSummarizer(CountingFakeChatModel()))
+    running, peak = [0], []
+
+    async def turn(session_id):
+        async with app.turn(session_id):
+            running[0] += 1
+            peak.append(running[0])
+            await asyncio.sleep(0.005)
+            running[0] -= 1
+
+    async def main_loop():
+        #名额为1时后两轮要等待，信号量因此绑定到当前事件循环
+        await asyncio.gather(*(turn(s) for s in ("a", "b", "c")))
+
+    asyncio.run(main_loop())
+    asyncio.run(main_loop())
+    assert max(peak) == 1 and len(peak) == 6
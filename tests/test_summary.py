@@ -0,0 +1,114 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.fakes import CountingFakeChatModel
+from context import ContextWindow, TokenCounter
+from summary import RollingSummarizer
+
+
+class CharCounter(TokenCounter):
+    """按字符数计token，结果不依赖tiktoken能否加载"""
+
+    def count_text(self, text: str) -> int:
+        return len(text)
+
+
+COUNTER = CharCounter(media_tokens=100)
+
+
+def make_history(turns: int, start: int = 0):
+    history = []
+    for i in range(start, start + turns):
+        history += [HumanMessage(f"问题{i:04d}"), AIMessage(f"回答{i:04d}")]
+    return history  # 每条消息10个token（含4个token的开销）
+
+
+def make_summarizer(llm, min_new_tokens: int) -> RollingSummarizer:
+    return RollingSummarizer(llm, min_new_tokens=min_new_tokens, counter=COUNTER)
+
+
+def test_folds_only_after_enough_tokens_leave_the_window():
+    llm = CountingFakeChatModel()
+    summarizer = make_summarizer(llm, min_new_tokens=60)
+    history = make_history(3)  # 保留最近2条：移出窗口4条共40个token，还不够
+    recent, summary = summarizer.summarize("s", history, k=2)
+    assert llm.calls == 0 and summary is None
+    assert recent == history  # 没折叠的消息留在上下文中
+
+    history += make_history(1, start=3)  # 移出窗口6条共60个token，攒够了
+    recent, summary = summarizer.summarize("s", history, k=2)
+    assert llm.calls == 1 and summary
+    assert recent == history[6:]
+    assert summarizer.store.get("s").watermark == 6
+
+
+def test_messages_after_watermark_stay_until_next_fold():
+    llm = CountingFakeChatModel()
+    summarizer = make_summarizer(llm, min_new_tokens=60)
+    history = make_history(4)
+    _, summary = summarizer.summarize("s", history, k=2)
+    history += make_history(2, start=4)  # 水位线6，移出窗口到10：新消息40个token
+    recent, again = summarizer.summarize("s", history, k=2)
+    assert llm.calls == 1 and again == summary
+    assert recent == history[6:]
+    #latest同样从水位线开始保留，不丢掉还没折叠的消息
+    assert summarizer.latest("s", history, len(history) - 2) == (history[6:], summary)
+
+
+def test_one_long_message_is_folded_right_away():
+    llm = CountingFakeChatModel()
+    summarizer = make_summarizer(llm, min_new_tokens=60)
+    history = [HumanMessage("长" * 500), AIMessage("好"), HumanMessage("问"), AIMessage("答")]
+    recent, summary = summarizer.summarize("s", history, k=2)
+    assert llm.calls == 1 and summary and recent == history[2:]
+
+
+def test_prompt_stays_within_budget_with_long_messages():
+    #预算400，为摘要预留200：窗口内最多200个token，没折叠的消息不到100个token，摘要不超过100个token
+    llm = CountingFakeChatModel(reply_chars=90)
+    window = ContextWindow(budget=400, summary_reserve=200, keep_media_messages=0, counter=COUNTER)
+    summarizer = make_summarizer(llm, min_new_tokens=100)
+    history = []
+    for i in range(40):
+        selection = window.select(history)
+        recent, summary = summarizer.summarize_until("s", selection.messages, selection.boundary)
+        prompt_tokens = COUNTER.count_messages(recent) + len(summary or "")
+        assert prompt_tokens <= window.budget, i
+        #消息长短不一：移出窗口的条数不多，token数却可能很大
+        history += [HumanMessage(f"问题{i}" + "长" * (i % 5) * 20), AIMessage(f"回答{i}" + "详" * (i % 3) * 30)]
+    assert llm.calls > 0
+
+
+def test_call_count_over_long_conversation():
+    llm = CountingFakeChatModel()
+    summarizer = make_summarizer(llm, min_new_tokens=60)
+    every_turn = CountingFakeChatModel()
+    baseline = make_summarizer(every_turn, min_new_tokens=1)
+    history = []
+    for i in range(200):
+        for s in (summarizer, baseline):
+            recent, _ = s.summarize("s", history, k=2)
+            assert COUNTER.count_messages(recent) < 2 * 10 + 60
+        history += make_history(1, start=i)
+    assert every_turn.calls == 198
+    #每轮移出窗口2条共20个token，198轮共3960个token，每60个token折叠一次
+    assert llm.calls == 3960 // 60
+
+
+def test_async_fold_uses_the_same_threshold():
+    llm = CountingFakeChatModel()
+    summarizer = make_summarizer(llm, min_new_tokens=60)
+
+    async def main():
+        history = make_history(3)
+        first = await summarizer.asummarize("s", history, k=2)
+        history += make_history(1, start=3)
+        second = await summarizer.asummarize("s", history, k=2)
+        latest = await summarizer.alatest("s", history, len(history) - 2)
+        return history, first, second, latest
+
+    history, first, second, latest = asyncio.run(main())
+    assert first == (history[:6], None)
+    assert second[0] == history[6:] and llm.calls == 1
+    assert latest == second
@@ -0,0 +1,137 @@
+"""实时语音：能量VAD的切句（丢弃咳嗽、自适应阈值、超长强制切开），以及StreamingTranscriber的提交与取消"""
+
+import asyncio
+
+import numpy as np
+
+from benchmarks.fakes import FakeASR
+from vad import EnergyVAD, StreamingTranscriber, to_mono_float
+
+RATE = 16000
+CHUNK = 0.25
+SENTENCES = (2.0, 1.2, 2.6)
+PAUSE = 1.2
+
+
+def synth(noise_db=-60.0, seed=0, cough=True):
+    """几句话（0.2秒的音节 + 0.06秒的停顿），句间停顿；第一个停顿中间有一声0.1秒的咳嗽。返回(采样, 每句的起止秒数)"""
+    rng = np.random.default_rng(seed)
+    noise = 10 ** (noise_db / 20)
+    pieces, spans, t = [rng.standard_normal(int(RATE * PAUSE)) * noise], [], PAUSE
+    for index, seconds in enumerate(SENTENCES):
+        x = np.arange(int(RATE * seconds)) / RATE
+        voice = sum(np.sin(2 * np.pi * k * 180 * x) / k for k in (1, 2, 3)) * 0.15
+        pieces.append(voice * ((x % 0.26) < 0.2) + rng.standard_normal(len(x)) * noise)
+        spans.append((t, t + seconds))
+        gap = 2 * PAUSE if index == 0 else PAUSE
+        pause = rng.standard_normal(int(RATE * gap)) * noise
+        if index == 0 and cough:
+            middle = int(RATE * gap / 2)
+            pause[middle:middle + int(RATE * 0.1)] += rng.standard_normal(int(RATE * 0.1)) * 0.3
+        pieces.append(pause)
+        t += seconds + gap
+    return np.concatenate(pieces).astype(np.float32), spans
+
+
+def chunks(samples):
+    step = int(RATE * CHUNK)
+    for start in range(0, len(samples), step):
+        yield samples[start:start + step]
+
+
+def segment(samples, **kwargs):
+    vad = EnergyVAD(rate=RATE, **kwargs)
+    return [u for chunk in chunks(samples) for u in vad.feed(chunk)], vad
+
+
+def test_one_utterance_per_sentence_and_cough_dropped():
+    samples, spans = synth()
+    utterances, _ = segment(samples)
+    assert len(utterances) == len(spans)
+    for utterance, (start, end) in zip(utterances, spans):
+        seconds = len(utterance) / RATE
+        #片段 = 句子 + 开头的preroll + 结尾保留的静音，不能比句子短
+        assert end - start <= seconds <= end - start + 0.7
+
+
+def test_adaptive_threshold_in_loud_background():
+    samples, spans = synth(noise_db=-38.0, seed=1)
+    utterances, vad = segment(samples)
+    assert len(utterances) == len(spans)
+    assert vad.threshold() > vad.threshold_db
+
+
+def test_long_utterance_is_split_at_max_seconds():
+    #连续说5秒（持续不变的音调会被当成背景噪声，这里用有停顿的音节）
+    x = np.arange(RATE * 5) / RATE
+    samples = (np.sin(2 * np.pi * 200 * x) * 0.3 * ((x % 0.26) < 0.2)).astype(np.float32)
+    utterances, vad = segment(samples, max_seconds=2.0)
+    tail = vad.flush()
+    assert [round(len(u) / RATE) for u in utterances] == [2, 2]
+    assert tail is not None
+
+
+def test_flush_ends_current_utterance():
+    samples, _ = synth(cough=False)
+    cut = int(RATE * (PAUSE + 1.0))  # 第一句话说到一半
+    utterances, vad = segment(samples[:cut])
+    assert utterances == []
+    assert vad.flush() is not None
+    assert vad.flush() is None
+
+
+def test_to_mono_float_downmixes_and_resamples():
+    stereo = (np.ones((48000, 2)) * 16384).astype(np.int16)
+    mono = to_mono_float(stereo, 48000, RATE)
+    assert mono.dtype == np.float32 and len(mono) == RATE
+    assert np.allclose(mono[100:-100], 0.5, atol=1e-3)
+
+
+def as_browser_chunks(samples):
+    """浏览器发来的音频块：48kHz int16"""
+    for chunk in chunks(samples):
+        up = np.repeat(chunk, 3)
+        yield 48000, (up * 32767).astype(np.int16)
+
+
+def test_transcriber_submits_after_answer_finishes():
+    samples, spans = synth()
+
+    async def main():
+        transcriber = StreamingTranscriber(backend=FakeASR(text="你好"))
+        submitted = []
+        for rate, data in as_browser_chunks(samples):
+            transcriber.feed(rate, data)
+            await asyncio.sleep(0)
+            ready = transcriber.take_ready()
+            if ready:
+                submitted.append(transcriber.sent)
+        submitted.append(transcriber.sent)
+        #回答还没结束（submitting）时识别完成的句子先不提交，回答结束后合并成一条
+        ready = await transcriber.finish()
+        assert ready == [] and transcriber.submitting
+        transcriber.submitting = False
+        merged = transcriber.take_ready()
+        return transcriber, submitted, merged
+
+    transcriber, submitted, merged = asyncio.run(main())
+    assert transcriber.utterances == len(spans)
+    assert submitted[0] == (1, "你好")
+    assert len(merged) == len(spans) - 1
+    assert transcriber.sent == (2, "你好" * (len(spans) - 1))
+
+
+def test_finish_times_out_and_cancels_pending_work():
+    async def main():
+        transcriber = StreamingTranscriber(backend=FakeASR(delta_delay=1.0))
+        transcriber._submit(np.full(RATE, 0.1, np.float32))
+        transcriber._submit(np.full(RATE, 0.1, np.float32))
+        await asyncio.sleep(0.05)
+        worker = transcriber._worker
+        ready = await transcriber.finish(timeout=0.1)
+        await asyncio.sleep(0)
+        return transcriber, worker, ready
+
+    transcriber, worker, ready = asyncio.run(main())
+    assert ready == [] and worker.cancelled()
+    assert transcriber.partial == "" and not transcriber._queue
@@ -0,0 +1,234 @@
+"""
+实时语音：浏览器麦克风的音频块边到达边处理
+1、按能量做语音活动检测（VAD），切出一句一句的话
+2、每句话一结束就送去识别，识别中的文字实时显示，识别完成后交给前端自动提交
+"""
+
+import asyncio
+import logging
+import math
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from asr import ASRBackend, astream_transcript
+from config import get_settings
+from media import downmix, encode_wav, resample
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def to_mono_float(data: np.ndarray, rate: int, target_rate: int) -> np.ndarray:
+    """Gradio麦克风的音频块（int16/int32/float，单声道或多声道）-> target_rate的单声道float32"""
+    data = np.asarray(data)
+    if data.dtype == np.int16:
+        samples = data.astype(np.float32) / 32768.0
+    elif data.dtype == np.int32:
+        samples = data.astype(np.float32) / 2147483648.0
+    else:
+        samples = data.astype(np.float32)
+    return resample(downmix(samples), rate, target_rate).astype(np.float32)
+
+
+def frame_level(frame: np.ndarray) -> float:
+    """一帧的能量（dBFS）"""
+    rms = float(np.sqrt(np.mean(np.square(frame))))
+    return 20 * math.log10(max(rms, 1e-10))
+
+
+class EnergyVAD:
+    """
+    基于帧能量的语音活动检测，逐块输入，返回已经结束的句子：
+    1、阈值取vad_threshold_db与“背景噪声 + vad_noise_margin_db”中较大者；背景噪声取最近vad_noise_window_ms内
+       帧能量的最小值（说话时字与字之间的停顿也算），底噪较大的环境中阈值随之抬高
+    2、连续vad_start_ms的语音帧才算开始说话（滤掉咔哒声），连续vad_end_ms的静音算一句话结束
+    3、每句话开头多保留vad_preroll_ms（开头的辅音能量低），结尾多余的静音去掉
+    4、一句话超过asr_chunk_seconds时强制切开，不超过ASR单次能识别的长度
+    """
+
+    def __init__(self, rate: Optional[int] = None, frame_ms: Optional[int] = None,
+                 threshold_db: Optional[float] = None, noise_margin_db: Optional[float] = None,
+                 start_ms: Optional[int] = None, end_ms: Optional[int] = None, preroll_ms: Optional[int] = None,
+                 min_utterance_ms: Optional[int] = None, max_seconds: Optional[float] = None,
+                 noise_window_ms: Optional[int] = None):
+        self.rate = rate or settings.asr_sample_rate
+        frame_ms = frame_ms or settings.vad_frame_ms
+        self.frame = max(1, self.rate * frame_ms // 1000)
+        self.threshold_db = settings.vad_threshold_db if threshold_db is None else threshold_db
+        self.noise_margin_db = settings.vad_noise_margin_db if noise_margin_db is None else noise_margin_db
+
+        def frames(ms: float) -> int:
+            return max(1, math.ceil(ms / frame_ms))
+
+        self.start_frames = frames(start_ms or settings.vad_start_ms)
+        self.end_frames = frames(end_ms or settings.vad_end_ms)
+        self.preroll_frames = frames(settings.vad_preroll_ms if preroll_ms is None else preroll_ms)
+        self.min_frames = frames(settings.vad_min_utterance_ms if min_utterance_ms is None else min_utterance_ms)
+        self.max_frames = frames((max_seconds or settings.asr_chunk_seconds) * 1000)
+        self._levels: deque = deque(maxlen=frames(noise_window_ms or settings.vad_noise_window_ms))
+        self.speaking = False
+        self._rest = np.zeros(0, np.float32)  # 不足一帧的尾巴，留到下一块
+        self._preroll: deque = deque(maxlen=self.preroll_frames + self.start_frames)
+        self._frames: List[np.ndarray] = []
+        self._voiced_run = self._silent_run = self._voiced_total = 0
+
+    @property
+    def noise_db(self) -> Optional[float]:
+        return min(self._levels) if self._levels else None
+
+    def threshold(self) -> float:
+        noise_db = self.noise_db
+        if noise_db is None:
+            return self.threshold_db
+        return max(self.threshold_db, noise_db + self.noise_margin_db)
+
+    def feed(self, samples: np.ndarray) -> List[np.ndarray]:
+        """输入一块rate采样率的单声道float32，返回这一块中结束的句子（可能为空）"""
+        samples = np.concatenate([self._rest, samples]) if len(self._rest) else samples
+        n = len(samples) // self.frame
+        self._rest = samples[n * self.frame:]
+        utterances = []
+        for frame in samples[:n * self.frame].reshape(n, self.frame):
+            utterance = self._step(frame)
+            if utterance is not None:
+                utterances.append(utterance)
+        return utterances
+
+    def flush(self) -> Optional[np.ndarray]:
+        """录音结束：正在说的这句话直接结束"""
+        self._rest = np.zeros(0, np.float32)
+        return self._end() if self.speaking else None
+
+    def _step(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        level = frame_level(frame)
+        self._levels.append(level)
+        voiced = level > self.threshold()
+        if not self.speaking:
+            self._preroll.append(frame)
+            if not voiced:
+                self._voiced_run = 0
+                return None
+            self._voiced_run += 1
+            if self._voiced_run >= self.start_frames:
+                self.speaking = True
+                self._frames = list(self._preroll)
+                self._preroll.clear()
+                self._silent_run, self._voiced_total = 0, self._voiced_run
+            return None
+        self._frames.append(frame)
+        if voiced:
+            self._silent_run = 0
+            self._voiced_total += 1
+        else:
+            self._silent_run += 1
+        if self._silent_run >= self.end_frames or len(self._frames) >= self.max_frames:
+            return self._end()
+        return None
+
+    def _end(self) -> Optional[np.ndarray]:
+        #结尾的静音只保留preroll那么长
+        frames = self._frames[:len(self._frames) - max(0, self._silent_run - self.preroll_frames)]
+        voiced_total = self._voiced_total
+        self.speaking = False
+        self._frames = []
+        self._voiced_run = self._silent_run = self._voiced_total = 0
+        if voiced_total < self.min_frames or not frames:
+            return None
+        return np.concatenate(frames)
+
+
+class StreamingTranscriber:
+    """
+    一个麦克风流（一个浏览器标签页）的状态，保存在gr.State中：
+    feed只做VAD，不等待识别；切出的句子按顺序排队，由后台任务逐句识别（队列空了任务就退出，关掉的标签页不留任务），
+    partial是正在识别的这句话的文字，识别完成的句子由take_ready取走（前端自动提交）；
+    submitting为True（上一句的回答还没结束）时先不取走，回答结束后几句合并成一条提交
+    """
+
+    def __init__(self, backend: Optional[ASRBackend] = None, vad: Optional[EnergyVAD] = None):
+        self.backend = backend
+        self.vad = vad or EnergyVAD()
+        self.partial = ""
+        self.utterances = 0  # 切出的句子数
+        self.submitting = False
+        #最近一次取走的句子：(序号, 合并后的文字)，序号递增，前端把它放进gr.State触发自动提交
+        self.sent: Optional[Tuple[int, str]] = None
+        self._ready: List[str] = []
+        self._queue: deque = deque()
+        self._worker: Optional[asyncio.Task] = None
+
+    def feed(self, rate: int, data: np.ndarray) -> None:
+        """输入浏览器发来的一块音频；有句子结束时立即排队识别"""
+        for utterance in self.vad.feed(to_mono_float(data, rate, self.vad.rate)):
+            self._submit(utterance)
+
+    def _submit(self, samples: np.ndarray) -> None:
+        self.utterances += 1
+        self._queue.append(samples)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _transcribe(self, samples: np.ndarray) -> str:
+        with tempfile.NamedTemporaryFile(prefix="utterance_", suffix=".wav", delete=False) as f:
+            path = Path(f.name)
+        try:
+            await asyncio.to_thread(path.write_bytes, encode_wav(samples, self.vad.rate))
+            text = ""
+            async for text in astream_transcript(str(path), backend=self.backend):
+                self.partial = text
+            return text
+        finally:
+            path.unlink(missing_ok=True)
+
+    async def _run(self) -> None:
+        while self._queue:
+            samples = self._queue.popleft()
+            try:
+                text = await self._transcribe(samples)
+                if text.strip():
+                    self._ready.append(text)
+            except Exception as e:
+                logger.warning("实时语音识别失败，跳过这句话：%r", e)
+            finally:
+                self.partial = ""
+
+    def take_ready(self) -> List[str]:
+        """
+        取走已经识别完成、还没提交的句子；正在提交上一句时返回空列表
+        取走了句子就进入提交状态，前端在回答结束后把submitting置回False
+        """
+        if self.submitting:
+            return []
+        ready, self._ready = self._ready, []
+        self.submitting = bool(ready)
+        if ready:
+            self.sent = ((self.sent[0] if self.sent else 0) + 1, "".join(ready))
+        return ready
+
+    async def finish(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        停止录音：结束正在说的句子，等所有句子识别完，返回可以提交的句子
+        最多等待timeout秒（默认settings.asr_timeout），超时后取消还没识别完的句子，只返回已经识别完成的
+        """
+        utterance = self.vad.flush()
+        if utterance is not None:
+            self._submit(utterance)
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._worker), timeout or settings.asr_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("实时语音识别超时，丢弃还没识别完的%d句话", len(self._queue) + 1)
+                self.cancel()
+        return self.take_ready()
+
+    def cancel(self) -> None:
+        """丢弃排队的句子并取消后台识别任务（标签页关闭或识别超时时调用，可以在其他线程中调用）"""
+        self._queue.clear()
+        self.partial = ""
+        worker, self._worker = self._worker, None
+        if worker is not None and not worker.done():
+            worker.get_loop().call_soon_threadsafe(worker.cancel)